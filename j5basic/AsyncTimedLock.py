@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+
+"""Locks for asyncio code with the same wait semantics as TimedLock,
+and a bridge that lets a coroutine hold a threading TimedLock without blocking the event loop.
+This module needs Python 3.5 or later"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+from future import standard_library
+standard_library.install_aliases()
+from builtins import *
+from builtins import object
+import asyncio
+import collections
+import threading
+
+_current_task = getattr(asyncio, "current_task", None) or asyncio.Task.current_task
+_get_loop = getattr(asyncio, "get_running_loop", None) or asyncio.get_event_loop
+
+class AsyncTimedLock(object):
+    """A reentrant lock for asyncio tasks that allows waiting, like TimedLock is for threads.
+    The owner is the current task, so a task can acquire the lock again without blocking.
+    Waiting tasks get the lock in the order they asked for it: release hands it straight to the first waiter.
+    This is not thread-safe - use it from one event loop only"""
+    def __init__(self):
+        self._owner = None
+        self._count = 0
+        self._waiters = collections.deque()
+
+    def locked(self):
+        return self._owner is not None
+
+    async def acquire(self, wait=True):
+        """Acquires the lock, returning whether it was acquired
+        If wait is True (default), wait until the lock is available
+        If wait is a number, wait the given number of seconds before giving up
+        If wait is non-True (None, False, or zero), acquire without waiting"""
+        task = _current_task()
+        if self._owner is task:
+            self._count += 1
+            return True
+        if self._owner is None and not self._waiters:
+            self._owner, self._count = task, 1
+            return True
+        if not wait:
+            return False
+        waiter = _get_loop().create_future()
+        self._waiters.append((task, waiter))
+        # the waiter is shielded so that it is only ever resolved by release handing over the lock
+        try:
+            if wait is True:
+                await asyncio.shield(waiter)
+            else:
+                await asyncio.wait_for(asyncio.shield(waiter), wait)
+            return True
+        except asyncio.TimeoutError:
+            # the lock may have been handed over as the wait timed out
+            if waiter.done():
+                return True
+            self._waiters.remove((task, waiter))
+            return False
+        except asyncio.CancelledError:
+            if waiter.done():
+                self.release()
+            else:
+                self._waiters.remove((task, waiter))
+            raise
+
+    def release(self):
+        """Releases the lock, handing it to the first waiting task if there is one"""
+        if self._owner is not _current_task():
+            raise RuntimeError("cannot release un-acquired lock")
+        self._count -= 1
+        if self._count:
+            return
+        if self._waiters:
+            owner, waiter = self._waiters.popleft()
+            self._owner, self._count = owner, 1
+            waiter.set_result(True)
+        else:
+            self._owner = None
+
+    async def __aenter__(self):
+        return await self.acquire()
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+class ThreadLockBridge(object):
+    """Lets a coroutine acquire and hold a threading lock (such as a TimedLock) without blocking the event loop.
+    A threading lock belongs to the thread that acquired it, so a thread from the executor acquires it,
+    and then holds it on behalf of the coroutine until release is awaited.
+    Each bridge that is waiting or holding its lock takes up an executor thread,
+    so a dedicated executor is better than the loop's default one if many bridges are used at once"""
+    def __init__(self, lock, wait=True, executor=None):
+        self.lock = lock
+        self.wait = wait
+        self.executor = executor
+        self._release_event = None
+        self._holder = None
+
+    async def acquire(self):
+        """Acquires the lock as for TimedLock.acquire(self.wait), returning whether it was acquired"""
+        if self._holder is not None:
+            raise RuntimeError("%s is already in use" % self.__class__.__name__)
+        loop = _get_loop()
+        acquired_future = loop.create_future()
+        self._release_event = threading.Event()
+        self._holder = loop.run_in_executor(self.executor, self._hold, loop, acquired_future, self._release_event)
+        try:
+            acquired = await acquired_future
+        except asyncio.CancelledError:
+            # if the thread acquires the lock after this, it releases it straight away
+            self._release_event.set()
+            self._holder = None
+            raise
+        except Exception:
+            # the acquire failed in the executor thread, which has finished
+            holder, self._holder = self._holder, None
+            await holder
+            raise
+        if not acquired:
+            await self._holder
+            self._holder = None
+        return acquired
+
+    def _hold(self, loop, acquired_future, release_event):
+        """runs in the executor thread: acquires the lock, tells the coroutine, and holds the lock until release_event is set"""
+        try:
+            acquired = self.lock.acquire(self.wait)
+        except Exception as e:
+            try:
+                loop.call_soon_threadsafe(_set_failed, acquired_future, e)
+            except RuntimeError:
+                # the loop has been closed, so nobody is waiting for this
+                pass
+            return
+        try:
+            loop.call_soon_threadsafe(_set_acquired, acquired_future, acquired, release_event)
+        except RuntimeError:
+            # the loop has been closed, so nobody is waiting for this
+            release_event.set()
+        if acquired:
+            try:
+                release_event.wait()
+            finally:
+                self.lock.release()
+
+    async def release(self):
+        """Releases the lock, returning once the executor thread has released it"""
+        if self._holder is None:
+            raise RuntimeError("cannot release un-acquired lock")
+        holder, self._holder = self._holder, None
+        self._release_event.set()
+        await holder
+
+    async def __aenter__(self):
+        return await self.acquire()
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        if self._holder is not None:
+            await self.release()
+
+def _set_failed(acquired_future, exception):
+    """runs in the event loop: passes on the exception raised by the acquire, unless the coroutine has stopped waiting"""
+    if not acquired_future.cancelled():
+        acquired_future.set_exception(exception)
+
+def _set_acquired(acquired_future, acquired, release_event):
+    """runs in the event loop: passes on the result of the acquire, or releases the lock if the coroutine has stopped waiting"""
+    if acquired_future.cancelled():
+        release_event.set()
+    else:
+        acquired_future.set_result(acquired)
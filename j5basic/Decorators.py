@@ -15,8 +15,13 @@ from builtins import next
 from past.builtins import basestring
 from builtins import *
 from builtins import object
+from j5basic import LockOrder
 import inspect, types, itertools
+import collections
 import logging
+import random
+import sys
+import threading
 import time
 
 #
@@ -60,6 +65,8 @@ def getrightargs(function, args):
 # decorator decorator (for making other decorators)
 #
 
+CallingFrameInfo = collections.namedtuple("CallingFrameInfo", ["filename", "lineno", "function"])
+
 class decorator_helpers(object):
     """The basic trick is to generate the source code for a lambda function
        with the right signature and to evaluate it.
@@ -131,36 +138,59 @@ class decorator_helpers(object):
             fullsign = fullsign, defarg = defaults or ())
         return dic
 
+    _reserved_names = ("_call_", "_func_", "_getframe_", "_frameinfo_", "_sample_")
+
     @staticmethod
     def _contains_reserved_names(dic):
-        return "_call_" in dic or "_func_" in dic
+        return any(name in dic for name in decorator_helpers._reserved_names)
+
+    @staticmethod
+    def frameinfo(frame):
+        """Returns a CallingFrameInfo(filename, lineno, function) describing the given frame,
+           without keeping a reference to the frame itself"""
+        code = frame.f_code
+        return CallingFrameInfo(code.co_filename, frame.f_lineno, code.co_name)
 
     @staticmethod
-    def _decorate(func, caller, extendedargs=None, calling_frame_arg=None):
+    def _decorate(func, caller, extendedargs=None, calling_frame_arg=None, calling_frame_info=False, calling_frame_sample=None):
         """Takes a function and a caller and returns the function
            decorated with that caller. The decorated function is obtained
            by evaluating a lambda function with the correct signature.
            calling_frame_arg can be given as the name of an argument
-           which should contain the calling function's stack frame"""
+           which should contain the calling function's stack frame.
+           If calling_frame_info is set, a CallingFrameInfo tuple is passed instead of the frame.
+           If calling_frame_sample is given, it is called without arguments on each call,
+           and the calling frame is only captured if it returns True (otherwise None is passed)"""
         infodict = decorator_helpers.getinfo(func, extendedargs)
         defaults = infodict["defarg"]
         assert not decorator_helpers._contains_reserved_names(infodict["argnames"]), \
-               "You cannot use _call_ or _func_ as argument names!"
+               "You cannot use any of %s as argument names!" % ", ".join(decorator_helpers._reserved_names)
         execdict = dict(_func_=func, _call_=caller, defarg=defaults or ())
         if calling_frame_arg:
             # this uses inspect to pass the calling function's frame to the decorator
             if func.__name__ == "<lambda>":
                 # we can't do assignment in a normal lambda, so we construct a function
                 infodict["name"] = "lambda_wrapper"
-            execdict["inspect"] = inspect
+            if calling_frame_info:
+                # only the location is captured, so the caller's frame (and its locals) can be freed
+                execdict["_getframe_"] = sys._getframe
+                execdict["_frameinfo_"] = decorator_helpers.frameinfo
+                frame_src = "_frameinfo_(_getframe_(1))"
+            else:
+                execdict["inspect"] = inspect
+                frame_src = "inspect.currentframe().f_back"
+            if calling_frame_sample is not None:
+                execdict["_sample_"] = calling_frame_sample
+                frame_src = "%s if _sample_() else None" % frame_src
             infodict["calling_frame_arg"] = calling_frame_arg
+            infodict["calling_frame_src"] = frame_src
             if calling_frame_arg in infodict["argnames"]:
                 func_src = """def %(name)s(%(fullsign)s):
-                %(calling_frame_arg)s = inspect.currentframe().f_back
+                %(calling_frame_arg)s = %(calling_frame_src)s
                 return _call_(_func_, %(shortsign)s)""" % infodict
             else:
                 func_src = """def %(name)s(%(fullsign)s):
-                %(calling_frame_arg)s = inspect.currentframe().f_back
+                %(calling_frame_arg)s = %(calling_frame_src)s
                 return _call_(_func_, %(shortsign)s, %(calling_frame_arg)s=%(calling_frame_arg)s)""" % infodict
             func_code = compile(func_src, func.__code__.co_filename, 'exec')
         elif func.__name__ == "<lambda>" and not calling_frame_arg:
@@ -183,6 +213,10 @@ class decorator(object):
        keyword arguments and defaults that will be added to the function signature
        calling_frame_arg can be given as the name of an argument
        which should contain the calling function's stack frame
+       calling_frame_info, if True, passes a lightweight CallingFrameInfo(filename, lineno, function)
+       in calling_frame_arg instead of the frame itself, so that frames aren't kept alive
+       calling_frame_sample can be given as a function taking no arguments that decides
+       whether to capture the calling frame for each call (None is passed when it returns False)
        A caller function is any function like this::
 
        def caller(func, *args, **kw):
@@ -202,13 +236,21 @@ class decorator(object):
            >>> g()
            Calling 'g'"""
 
-    def __init__(self, caller, extendedargs=None, calling_frame_arg=None):
+    def __init__(self, caller, extendedargs=None, calling_frame_arg=None, calling_frame_info=False, calling_frame_sample=None):
         self.caller = caller
         self.extendedargs = extendedargs or []
         self.calling_frame_arg = calling_frame_arg
+        self.calling_frame_info = calling_frame_info
+        self.calling_frame_sample = calling_frame_sample
 
     def __call__(self, func):
-        return decorator_helpers._decorate(func, self.caller, self.extendedargs, self.calling_frame_arg)
+        return decorator_helpers._decorate(func, self.caller, self.extendedargs, self.calling_frame_arg,
+                                           self.calling_frame_info, self.calling_frame_sample)
+
+def sample_every(n):
+    """returns a calling_frame_sample function that is True for every nth call (starting with the first)"""
+    counter = itertools.count()
+    return lambda: next(counter) % n == 0
 
 def chain_decorators(*decorators):
     """returns a decorator that functions as the chain of the given decorators
@@ -216,12 +258,14 @@ def chain_decorators(*decorators):
     @chain_decorators(f1, f2, f3) is equivalent to:
     @f1
     @f2
-    @f3"""
-    @decorator
-    def chained_decorator(f, *args, **kw):
+    @f3
+
+    The decorators are applied once, when the returned decorator is applied,
+    so calling the decorated function only goes through the resulting wrappers"""
+    def chained_decorator(f):
         for decorator in reversed(decorators):
             f = decorator(f)
-        return f(*args, **kw)
+        return f
     return chained_decorator
 
 #
@@ -242,9 +286,18 @@ class SelfLocking(object):
            assuring that race conditions do not arise.  Ideally, methods wrapped with
            runwithlock (whatever functions they call) should do as little as possible,
            and preferrably nothing which has any chance of blocking for long periods of
-           time (I/O, database queries, anything over a network, etc)."""
+           time (I/O, database queries, anything over a network, etc).
+
+           The lock is recorded in the LockOrder graph when that is enabled."""
 
         def wrapper(self,*args,**kws):
+            if LockOrder.enabled:
+                try:
+                    LockOrder.acquire(self.lock, self)
+                    ret = f(self,*args,**kws)
+                finally:
+                    LockOrder.release(self.lock)
+                return ret
             try:
                 self.lock.acquire()
                 ret = f(self,*args,**kws)
@@ -285,8 +338,10 @@ def notimplemented(f):
     return wrapper
 
 def wraptimer(function):
-    """Log the time a function takes to run."""
+    """Log the time a function takes to run (if debug logging is enabled when it is called)."""
     def timecall(self, *args, **kw):
+        if not logging.root.isEnabledFor(logging.DEBUG):
+            return function(self, *args, **kw)
         start_time = time.time()
         argstr = ", ".join([repr(arg) for arg in args]) + ", ".join(["%s=%r" % (kw, val) for kw, val in kw.items()])
         logging.debug("about to call %s(%s)" % (function.__name__, argstr))
@@ -297,6 +352,224 @@ def wraptimer(function):
     timecall.__doc__ = function.__doc__
     return timecall
 
+#
+# Decorators for calling flaky or limited resources.
+# These are classes so that their counters can be inspected; an instance can decorate several functions, which then share its state
+#
+
+class RateLimitExceeded(Exception):
+    """Raised when a RateLimiter can't supply a token within the allowed wait"""
+
+class CircuitOpenError(Exception):
+    """Raised when a call is attempted through a CircuitBreaker that is open"""
+
+class RateLimiter(object):
+    """Token bucket rate limiter: allows rate calls per second on average, with bursts of up to burst calls.
+       wait has the same meaning as for TimedLock.acquire: if True, block until a token is available;
+       if a number, wait at most that many seconds; otherwise don't wait.
+       If a token can't be obtained, RateLimitExceeded is raised.
+       Waiting callers reserve their token before sleeping, so they are served in order.
+       The counters calls, throttled, rejected and throttle_time (total seconds spent waiting) can be read from stats()"""
+    def __init__(self, rate, burst=1, wait=True, time_function=None, sleep_function=None):
+        self.rate = float(rate)
+        self.burst = burst
+        self.wait = wait
+        self._time_function = time_function or time.time
+        self._sleep_function = sleep_function or time.sleep
+        self.lock = threading.Lock()
+        self._tokens = float(burst)
+        self._last_time = self._time_function()
+        self.calls = self.throttled = self.rejected = 0
+        self.throttle_time = 0.0
+
+    def _reserve(self, wait):
+        """reserves a token, returning the number of seconds to wait before using it, or None if it can't be obtained in time"""
+        with self.lock:
+            current_time = self._time_function()
+            self._tokens = min(self.burst, self._tokens + (current_time - self._last_time) * self.rate)
+            self._last_time = current_time
+            delay = (1 - self._tokens) / self.rate if self._tokens < 1 else 0
+            if delay and (not wait or (wait is not True and delay > wait)):
+                self.rejected += 1
+                return None
+            self._tokens -= 1
+            self.calls += 1
+            if delay:
+                self.throttled += 1
+                self.throttle_time += delay
+            return delay
+
+    def acquire(self, wait=None):
+        """Takes a token from the bucket, waiting as necessary (wait defaults to the limiter's setting)"""
+        delay = self._reserve(self.wait if wait is None else wait)
+        if delay is None:
+            raise RateLimitExceeded("Rate limit of %r calls per second exceeded" % self.rate)
+        if delay:
+            self._sleep_function(delay)
+
+    def _caller(self, f, *args, **kw):
+        self.acquire()
+        return f(*args, **kw)
+
+    def __call__(self, func):
+        return decorator(self._caller)(func)
+
+    def stats(self):
+        """returns a dictionary of the counters"""
+        with self.lock:
+            return dict(calls=self.calls, throttled=self.throttled, rejected=self.rejected, throttle_time=self.throttle_time)
+
+class Retry(object):
+    """Retries calls that raise one of the given exceptions, up to max_attempts calls in total.
+       The delay before retry n (starting at 0) is initial_delay * backoff**n, limited to max_delay;
+       if jitter is set, a random delay between 0 and that is used instead, to avoid callers retrying in step.
+       The counters calls, retries, failures (calls that gave up) and backoff_time can be read from stats()"""
+    def __init__(self, exceptions=(Exception,), max_attempts=3, initial_delay=0.1, backoff=2, max_delay=None, jitter=True,
+                 sleep_function=None, random_function=None):
+        self.exceptions = exceptions
+        self.max_attempts = max_attempts
+        self.initial_delay = initial_delay
+        self.backoff = backoff
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self._sleep_function = sleep_function or time.sleep
+        self._random_function = random_function or random.random
+        self.lock = threading.Lock()
+        self.calls = self.retries = self.failures = 0
+        self.backoff_time = 0.0
+
+    def get_delay(self, retry_number):
+        """returns the number of seconds to wait before the given retry"""
+        delay = self.initial_delay * (self.backoff ** retry_number)
+        if self.max_delay is not None:
+            delay = min(delay, self.max_delay)
+        if self.jitter:
+            delay *= self._random_function()
+        return delay
+
+    def _caller(self, f, *args, **kw):
+        with self.lock:
+            self.calls += 1
+        retry_number = 0
+        while True:
+            try:
+                return f(*args, **kw)
+            except self.exceptions as e:
+                if retry_number + 1 >= self.max_attempts:
+                    with self.lock:
+                        self.failures += 1
+                    raise
+                delay = self.get_delay(retry_number)
+                with self.lock:
+                    self.retries += 1
+                    self.backoff_time += delay
+                logging.debug("Retrying call to %s in %0.3f seconds after error: %s", f.__name__, delay, e)
+                self._sleep_function(delay)
+                retry_number += 1
+
+    def __call__(self, func):
+        return decorator(self._caller)(func)
+
+    def stats(self):
+        """returns a dictionary of the counters"""
+        with self.lock:
+            return dict(calls=self.calls, retries=self.retries, failures=self.failures, backoff_time=self.backoff_time)
+
+class CircuitBreaker(object):
+    """Stops calling through after failure_threshold consecutive failures (exceptions of the given types),
+       raising CircuitOpenError instead until reset_timeout seconds have passed.
+       After that a single trial call is let through (half open): if it succeeds the circuit closes, otherwise it opens again.
+       The counters calls, successes, failures, rejected and opened can be read from stats().
+       The outcome of a call that started before the state last changed is counted, but doesn't change the state"""
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30, exceptions=(Exception,), time_function=None):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.exceptions = exceptions
+        self._time_function = time_function or time.time
+        self.lock = threading.Lock()
+        self.state = self.CLOSED
+        # incremented whenever the state changes, so that calls can tell if it has changed since they started
+        self._generation = 0
+        self._consecutive_failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self.calls = self.successes = self.failures = self.rejected = self.opened = 0
+
+    def _set_state(self, state):
+        """not to be called without holding self.lock"""
+        self.state = state
+        self._generation += 1
+
+    def _open(self):
+        """not to be called without holding self.lock"""
+        self._set_state(self.OPEN)
+        self._opened_at = self._time_function()
+        self.opened += 1
+
+    def _before_call(self):
+        """checks whether a call may go ahead, returning a (generation, is trial call) token to pass to _after_call"""
+        with self.lock:
+            if self.state == self.OPEN and self._time_function() - self._opened_at >= self.reset_timeout:
+                self._set_state(self.HALF_OPEN)
+            if self.state == self.OPEN or (self.state == self.HALF_OPEN and self._trial_running):
+                self.rejected += 1
+                raise CircuitOpenError("Circuit opened after %d consecutive failures" % self._consecutive_failures)
+            is_trial = self.state == self.HALF_OPEN
+            if is_trial:
+                self._trial_running = True
+            self.calls += 1
+            return (self._generation, is_trial)
+
+    def _after_call(self, token, failed):
+        """records the outcome of the call that _before_call returned token for. If failed is None, the call raised an error
+        that doesn't count as a failure, so only the end of a trial call is noted"""
+        generation, is_trial = token
+        with self.lock:
+            if is_trial:
+                self._trial_running = False
+            if failed is None:
+                return
+            if failed:
+                self.failures += 1
+            else:
+                self.successes += 1
+            if generation != self._generation:
+                return
+            if failed:
+                self._consecutive_failures += 1
+                if self.state == self.HALF_OPEN or self._consecutive_failures >= self.failure_threshold:
+                    self._open()
+            else:
+                self._consecutive_failures = 0
+                if self.state == self.HALF_OPEN:
+                    self._set_state(self.CLOSED)
+
+    def _caller(self, f, *args, **kw):
+        token = self._before_call()
+        try:
+            result = f(*args, **kw)
+        except self.exceptions:
+            self._after_call(token, True)
+            raise
+        except:
+            self._after_call(token, None)
+            raise
+        self._after_call(token, False)
+        return result
+
+    def __call__(self, func):
+        return decorator(self._caller)(func)
+
+    def stats(self):
+        """returns a dictionary of the counters and the current state"""
+        with self.lock:
+            return dict(state=self.state, calls=self.calls, successes=self.successes, failures=self.failures,
+                        rejected=self.rejected, opened=self.opened)
+
 ### helper methods for decorators to extract or alter arguments, and pass on the right thing to the decoratees
 
 def override_arg(argname,value,args,kwargs,argspec):
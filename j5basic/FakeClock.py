@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+
+"""A clock for tests of time-based code, which only moves when told to"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+from future import standard_library
+standard_library.install_aliases()
+from builtins import *
+from builtins import object
+
+class FakeClock(object):
+    """a clock that only moves when its now attribute is changed, or when it is slept on.
+    The clock itself can be passed as a time function, or its time and sleep methods as time.time and time.sleep"""
+    def __init__(self, now=1000.0):
+        self.now = now
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
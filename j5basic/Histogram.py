@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+
+"""A histogram of durations, as kept by the instrumented TimedLock and Timer"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+from future import standard_library
+standard_library.install_aliases()
+from builtins import *
+from builtins import object
+import bisect
+
+# the upper bounds in seconds of each bucket, with a final bucket for anything longer
+DEFAULT_BOUNDS = (0.001, 0.01, 0.1, 1, 10)
+
+class Histogram(object):
+    """Counts values in buckets by the given upper bounds, and keeps their total and maximum.
+    This is not thread-safe - the statistics classes that use it record values holding their own lock"""
+    def __init__(self, bounds=DEFAULT_BOUNDS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = self.maximum = 0
+
+    def record(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.maximum = max(self.maximum, value)
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+
+"""A debugging aid that records the order in which threads acquire locks, and reports potential deadlocks.
+Once enable() has been called, each blocking acquire of a TimedLock, or of a lock taken by
+Decorators.SelfLocking.runwithlock (which includes the SemiSortedSet locks), adds an edge to a graph
+from every lock the thread already holds to the lock being acquired.
+An edge that closes a cycle means two threads could each hold a lock the other is waiting for,
+even if they never actually have; the cycle is logged as a warning and kept for potential_deadlocks().
+Only new edges do any real work (formatting the stack and searching for a cycle), so once the common lock orders
+have been seen, an acquire costs a few dictionary lookups - cheap enough for a staging server under real load"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+from future import standard_library
+standard_library.install_aliases()
+from builtins import *
+from builtins import object
+import logging
+import threading
+import traceback
+import weakref
+
+# whether acquires are being recorded - checked by the instrumented locks before doing any other work
+enabled = False
+
+# changed by enable(), so that the held locks remembered by threads from before then are ignored
+_generation = 0
+_local = threading.local()
+
+# the graph of locks, keyed by id(lock): _edges[a][b] is where lock b was first acquired while holding lock a
+_graph_lock = threading.RLock()
+_edges = {}
+_predecessors = {}
+_names = {}
+_refs = {}
+# the ids of locks that have been garbage collected, to be removed from the graph on the next change to it
+_dead = []
+_cycles = []
+
+def enable():
+    """starts recording lock acquisitions"""
+    global enabled, _generation
+    _generation += 1
+    enabled = True
+
+def disable():
+    """stops recording lock acquisitions, keeping the graph recorded so far"""
+    global enabled
+    enabled = False
+
+def reset():
+    """forgets the recorded graph and potential deadlocks"""
+    with _graph_lock:
+        _edges.clear()
+        _predecessors.clear()
+        _names.clear()
+        _refs.clear()
+        del _dead[:]
+        del _cycles[:]
+
+def _held_locks():
+    """returns the list of the ids of the locks the current thread holds, in the order they were acquired"""
+    held = getattr(_local, "held", None)
+    if held is None or _local.generation != _generation:
+        held = _local.held = []
+        _local.generation = _generation
+    return held
+
+def _lock_name(lock, owner):
+    name = getattr(lock, "name", None)
+    if not name:
+        if owner is not None:
+            name = "%s.lock" % type(owner).__name__
+        else:
+            name = type(lock).__name__
+        name = "%s at %s" % (name, hex(id(lock)))
+    return name
+
+def _purge_dead():
+    """removes locks that have been garbage collected from the graph. must be called holding _graph_lock"""
+    while _dead:
+        key = _dead.pop()
+        ref = _refs.get(key)
+        if ref is not None and ref() is None:
+            _forget(key)
+
+def _forget(key):
+    """removes the lock with the given id from the graph. must be called holding _graph_lock"""
+    for after_key in _edges.pop(key, ()):
+        _predecessors[after_key].discard(key)
+    for before_key in _predecessors.pop(key, ()):
+        _edges[before_key].pop(key, None)
+    _names.pop(key, None)
+    _refs.pop(key, None)
+
+def _register(lock, owner):
+    """makes sure lock is in the graph, replacing any garbage collected lock that had the same id. must be called holding _graph_lock"""
+    key = id(lock)
+    ref = _refs.get(key)
+    if ref is not None and ref() is lock:
+        return
+    if ref is not None:
+        _forget(key)
+    _refs[key] = weakref.ref(lock, lambda ref, key=key: _dead.append(key))
+    _names[key] = _lock_name(lock, owner)
+    _edges[key] = {}
+    _predecessors[key] = set()
+
+def _find_path(start_key, end_key):
+    """returns a list of the ids of the locks on a path in the graph from start_key to end_key, or None if there isn't one"""
+    paths = {start_key: None}
+    pending = [start_key]
+    while pending:
+        key = pending.pop()
+        if key == end_key:
+            path = []
+            while key is not None:
+                path.append(key)
+                key = paths[key]
+            return path[::-1]
+        for after_key in _edges.get(key, ()):
+            if after_key not in paths:
+                paths[after_key] = key
+                pending.append(after_key)
+    return None
+
+def _add_edge(before_key, lock, owner):
+    """records that lock is being acquired while holding the lock with id before_key, reporting any cycle this closes"""
+    key = id(lock)
+    site = "".join(traceback.format_stack(limit=12)[:-3])
+    with _graph_lock:
+        _purge_dead()
+        if before_key not in _edges:
+            # the held lock has been garbage collected
+            return
+        _register(lock, owner)
+        if key in _edges[before_key]:
+            return
+        path = _find_path(key, before_key)
+        _edges[before_key][key] = (threading.currentThread().getName(), site)
+        _predecessors[key].add(before_key)
+        if path is None:
+            return
+        cycle = [before_key] + path
+        cycle_dump = {
+            "locks": [_names[cycle_key] for cycle_key in cycle],
+            "sites": [_edges[cycle_key][next_key] for cycle_key, next_key in zip(cycle, cycle[1:])],
+        }
+        _cycles.append(cycle_dump)
+    logging.warning("Potential deadlock: locks acquired in the order %s\n%s", " -> ".join(cycle_dump["locks"]),
+                    "\n".join("%s acquired %s while holding %s at:\n%s" % (thread_name, after_name, before_name, stack)
+                              for (thread_name, stack), before_name, after_name
+                              in zip(cycle_dump["sites"], cycle_dump["locks"], cycle_dump["locks"][1:])))
+
+def before_acquire(lock, owner=None):
+    """records that the current thread is about to wait for lock. owner is the object the lock belongs to, if any, which is used to name it"""
+    held = _held_locks()
+    if not held:
+        return
+    key = id(lock)
+    if key in held:
+        return
+    for before_key in set(held):
+        edges = _edges.get(before_key)
+        if edges is None or key not in edges:
+            _add_edge(before_key, lock, owner)
+
+def acquired(lock, owner=None):
+    """records that the current thread has acquired lock"""
+    key = id(lock)
+    ref = _refs.get(key)
+    if ref is None or ref() is not lock:
+        with _graph_lock:
+            _purge_dead()
+            _register(lock, owner)
+    _held_locks().append(key)
+
+def released(lock):
+    """records that the current thread is releasing lock"""
+    held = _held_locks()
+    key = id(lock)
+    for position in range(len(held) - 1, -1, -1):
+        if held[position] == key:
+            del held[position]
+            return
+
+def acquire(lock, owner=None):
+    """acquires lock, waiting until it is available, and records this if enabled"""
+    if enabled:
+        before_acquire(lock, owner)
+        lock.acquire()
+        acquired(lock, owner)
+    else:
+        lock.acquire()
+
+def release(lock):
+    """releases lock, and records this if enabled"""
+    if enabled:
+        released(lock)
+    lock.release()
+
+def potential_deadlocks():
+    """returns a list of the cycles found in the graph, as dictionaries with the names of the locks in the order they were acquired,
+    and the (thread name, stack) where each lock was first acquired while holding the one before it"""
+    with _graph_lock:
+        return [dict(cycle_dump) for cycle_dump in _cycles]
+
+def lock_order_graph():
+    """returns a dictionary mapping the name of each recorded lock to a sorted list of the names of the locks acquired while holding it"""
+    with _graph_lock:
+        _purge_dead()
+        return dict((_names[key], sorted(_names[after_key] for after_key in edges)) for key, edges in _edges.items())
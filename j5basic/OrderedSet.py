@@ -13,39 +13,457 @@ from __future__ import unicode_literals
 from future import standard_library
 standard_library.install_aliases()
 from builtins import *
-class OrderedSet(list):
+from builtins import object
+import collections
+import itertools
+import sys
+
+# dictionaries only keep insertion order from Python 3.7
+_ordered_dict = dict if sys.version_info >= (3, 7) else collections.OrderedDict
+
+# marks the position of a removed item in IndexedOrderedSet._items until it is compacted
+_removed = object()
+
+class BaseOrderedSet(object):
+    """
+    The methods shared by OrderedSet, IndexedOrderedSet and CompactOrderedSet, implemented using their
+    _existing dictionary (keyed by the items), extend, discard, _replace and iteration.
+    (OrderedSet uses list's own versions of the methods list has.)
+
+    The set operations (union, intersection, difference, symmetric_difference, their in-place versions
+    and the corresponding operators) keep the order: items from self first, then new items in the order of the others.
+    They take linear time, as membership tests use the dictionary.
+    """
+    __slots__ = ()
+
+    def __contains__(self, x):
+        return x in self._existing
+
+    def __bool__(self):
+        return len(self) > 0
+
+    __nonzero__ = __bool__
+
+    def __eq__(self, other):
+        if isinstance(other, (BaseOrderedSet, list, tuple)):
+            return len(self) == len(other) and all(x == y for x, y in zip(self, other))
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, list(self))
+
+    def count(self, x):
+        return 1 if x in self._existing else 0
+
+    def copy(self):
+        return self.__class__(self)
+
+    def update(self,*iterables):
+        for iterable in iterables:
+            self.extend(iterable)
+
+    def append(self,x):
+        self.extend([x])
+
+    def add(self,x):
+        self.extend([x])
+
+    def remove(self,x):
+        """removes x, raising ValueError if it isn't present"""
+        if x not in self._existing:
+            raise ValueError("%r is not in %s" % (x, self.__class__.__name__))
+        self.discard(x)
+
+    def union(self, *others):
+        """returns a new OrderedSet with the items of self followed by the new items in others"""
+        result = self.copy()
+        result.update(*others)
+        return result
+
+    def intersection(self, *others):
+        """returns a new OrderedSet with the items of self that are in all the others"""
+        result = self.copy()
+        result.intersection_update(*others)
+        return result
+
+    def difference(self, *others):
+        """returns a new OrderedSet with the items of self that aren't in any of the others"""
+        result = self.copy()
+        result.difference_update(*others)
+        return result
+
+    def symmetric_difference(self, other):
+        """returns a new OrderedSet with the items of self that aren't in other, followed by the items of other that aren't in self"""
+        result = self.copy()
+        result.symmetric_difference_update(other)
+        return result
+
+    def intersection_update(self, *others):
+        """removes the items that aren't in all the others"""
+        others = [_lookup(other) for other in others]
+        self._replace([x for x in self if all(x in other for other in others)])
+
+    def difference_update(self, *others):
+        """removes the items that are in any of the others"""
+        for other in others:
+            for x in other:
+                self.discard(x)
+
+    def symmetric_difference_update(self, other):
+        """removes the items that are in other, and adds the items of other that weren't present"""
+        other = _lookup(other)
+        added = [x for x in other if x not in self._existing]
+        self.difference_update(other)
+        self.extend(added)
+
+    def issubset(self, other):
+        other = _lookup(other)
+        return all(x in other for x in self)
+
+    def issuperset(self, other):
+        return all(x in self._existing for x in other)
+
+    def isdisjoint(self, other):
+        return not any(x in self._existing for x in other)
+
+    def __or__(self, other):
+        if not isinstance(other, _set_types):
+            return NotImplemented
+        return self.union(other)
+
+    def __and__(self, other):
+        if not isinstance(other, _set_types):
+            return NotImplemented
+        return self.intersection(other)
+
+    def __sub__(self, other):
+        if not isinstance(other, _set_types):
+            return NotImplemented
+        return self.difference(other)
+
+    def __xor__(self, other):
+        if not isinstance(other, _set_types):
+            return NotImplemented
+        return self.symmetric_difference(other)
+
+    def __ior__(self, other):
+        if not isinstance(other, _set_types):
+            return NotImplemented
+        self.update(other)
+        return self
+
+    def __iand__(self, other):
+        if not isinstance(other, _set_types):
+            return NotImplemented
+        self.intersection_update(other)
+        return self
+
+    def __isub__(self, other):
+        if not isinstance(other, _set_types):
+            return NotImplemented
+        self.difference_update(other)
+        return self
+
+    def __ixor__(self, other):
+        if not isinstance(other, _set_types):
+            return NotImplemented
+        self.symmetric_difference_update(other)
+        return self
+
+class OrderedSet(list, BaseOrderedSet):
     """
     Extends list class to a class which represents a set of unique items.
     Items are ordered by when they are first added to a list (new items are
     added at the end, unless they are already present, in which case their
     positions are left unaltered).
+    Membership tests use a dictionary of the items, so are O(1), and the set algebra builds its result in one pass.
+    insert skips items that are already present like append does, but item assignment doesn't check for uniqueness.
     """
-    def __init__(self,*args,**kwargs):
-        super(OrderedSet,self).__init__(self,*args,**kwargs)
+    def __init__(self, iterable=None):
+        super(OrderedSet,self).__init__()
         self._existing = {}
-        self._append = super(OrderedSet,self).append
+        if iterable is not None:
+            self.extend(iterable)
+
+    def __reduce__(self):
+        return (self.__class__, (list(self),))
+
+    def __contains__(self, x):
+        try:
+            return x in self._existing
+        except TypeError:
+            # unhashable, so can't be an item
+            return False
+
+    def __setitem__(self, i, x):
+        super(OrderedSet,self).__setitem__(i, x)
+        self._existing = dict.fromkeys(self, 1)
+
+    def __iadd__(self, iterable):
+        self.extend(iterable)
+        return self
+
+    def insert(self, i, x):
+        if x in self._existing:
+            return
+        super(OrderedSet,self).insert(i, x)
+        self._existing[x] = 1
 
     def __delitem__(self,i):
-        del self._existing[self[i]]
+        removed = self[i] if isinstance(i, slice) else [self[i]]
         super(OrderedSet,self).__delitem__(i)
+        for x in removed:
+            del self._existing[x]
 
     def extend(self,iterable):
         existing = self._existing
-        append = self._append
+        append = super(OrderedSet,self).append
         for x in iterable:
             if x in existing: continue
             existing[x] = 1
             append(x)
 
-    def update(self,iterable):
-        self.extend(iterable)
-
     def append(self,x):
         self.extend([x])
 
-    def add(self,x):
-        self.extend([x])
-
     def remove(self,x):
         super(OrderedSet,self).remove(x)
         del self._existing[x]
+
+    def discard(self,x):
+        """removes x if it is present"""
+        if x in self._existing:
+            self.remove(x)
+
+    def pop(self, i=-1):
+        """removes and returns the item at position i (the last by default)"""
+        x = super(OrderedSet,self).pop(i)
+        del self._existing[x]
+        return x
+
+    def clear(self):
+        super(OrderedSet,self).__delitem__(slice(None))
+        self._existing = {}
+
+    def copy(self):
+        return self.__class__(self)
+
+    def difference_update(self, *others):
+        """removes the items that are in any of the others"""
+        removed = set()
+        for other in others:
+            removed.update(x for x in other if x in self._existing)
+        if removed:
+            self._replace([x for x in self if x not in removed])
+
+    def symmetric_difference_update(self, other):
+        """removes the items that are in other, and adds the items of other that weren't present"""
+        other = _lookup(other)
+        added = [x for x in other if x not in self._existing]
+        self._replace([x for x in self if x not in other] + added)
+
+    def _replace(self, items):
+        """replaces the contents with the given list of unique items"""
+        super(OrderedSet,self).__setitem__(slice(None), items)
+        self._existing = dict.fromkeys(items, 1)
+
+class IndexedOrderedSet(BaseOrderedSet):
+    """
+    An ordered set with the same interface as OrderedSet, except that it isn't a list.
+    Membership tests, index() and remove() use a dictionary of each item's position, so are O(1).
+    Removed items leave a marker in the list which is compacted away when they make up half the list,
+    or when positional access needs it (so a mix of removals and positional access is O(n) each).
+    """
+    COMPACT_MIN = 32
+
+    def __init__(self, iterable=None):
+        self._items = []
+        self._existing = {}
+        self._removed_count = 0
+        if iterable is not None:
+            self.extend(iterable)
+
+    def _compact(self):
+        """removes the markers left by removed items, and recalculates the positions"""
+        self._items = [x for x in self._items if x is not _removed]
+        self._existing = dict((x, i) for i, x in enumerate(self._items))
+        self._removed_count = 0
+
+    def _compacted_items(self):
+        if self._removed_count:
+            self._compact()
+        return self._items
+
+    def __len__(self):
+        return len(self._items) - self._removed_count
+
+    def __iter__(self):
+        if not self._removed_count:
+            return iter(self._items)
+        return (x for x in self._items if x is not _removed)
+
+    def __reversed__(self):
+        return (x for x in reversed(self._items) if x is not _removed)
+
+    def __getitem__(self, i):
+        """returns the item at position i, or a list of the items for a slice"""
+        return self._compacted_items()[i]
+
+    def __delitem__(self, i):
+        items = self._compacted_items()
+        if isinstance(i, slice):
+            for x in items[i]:
+                self.remove(x)
+        else:
+            self.remove(items[i])
+
+    def index(self, x):
+        """returns the position of x, raising ValueError if it isn't present"""
+        if x not in self._existing:
+            raise ValueError("%r is not in IndexedOrderedSet" % (x,))
+        self._compacted_items()
+        return self._existing[x]
+
+    def extend(self,iterable):
+        existing = self._existing
+        items = self._items
+        append = items.append
+        for x in iterable:
+            if x in existing: continue
+            existing[x] = len(items)
+            append(x)
+
+    def discard(self,x):
+        """removes x if it is present"""
+        position = self._existing.pop(x, None)
+        if position is None:
+            return
+        items = self._items
+        if position == len(items) - 1:
+            # removing from the end doesn't need a marker
+            items.pop()
+            while items and items[-1] is _removed:
+                items.pop()
+                self._removed_count -= 1
+            return
+        items[position] = _removed
+        self._removed_count += 1
+        if self._removed_count >= self.COMPACT_MIN and self._removed_count * 2 >= len(items):
+            self._compact()
+
+    def pop(self, i=-1):
+        """removes and returns the item at position i (the last by default)"""
+        x = self[i]
+        self.remove(x)
+        return x
+
+    def clear(self):
+        self._items = []
+        self._existing = {}
+        self._removed_count = 0
+
+    def _replace(self, items):
+        """replaces the contents with the given list of unique items"""
+        self._items = items
+        self._existing = dict((x, i) for i, x in enumerate(items))
+        self._removed_count = 0
+
+class CompactOrderedSet(BaseOrderedSet):
+    """
+    An ordered set that stores its items only as the keys of an insertion-ordered dictionary.
+    This uses less memory than OrderedSet (which also keeps a list of the items): roughly 42 bytes per item
+    (excluding the items themselves) on 64-bit CPython 3, against roughly 50 (and roughly 78 for IndexedOrderedSet,
+    which also keeps an int position for each item).
+    Membership, adding and removal are O(1), and popping the last item is too,
+    but positional access and index() are O(n).
+    """
+    __slots__ = ("_existing",)
+
+    def __init__(self, iterable=None):
+        self._existing = _ordered_dict()
+        if iterable is not None:
+            self.extend(iterable)
+
+    def _replace(self, items):
+        """replaces the contents with the given list of unique items"""
+        self._existing = _ordered_dict.fromkeys(items)
+
+    def __len__(self):
+        return len(self._existing)
+
+    def __iter__(self):
+        return iter(self._existing)
+
+    def __reversed__(self):
+        return reversed(list(self._existing))
+
+    def __getitem__(self, i):
+        """returns the item at position i, or a list of the items for a slice"""
+        if isinstance(i, slice):
+            return list(self._existing)[i]
+        length = len(self._existing)
+        if i < 0:
+            i += length
+        if not 0 <= i < length:
+            raise IndexError("CompactOrderedSet index out of range")
+        return next(itertools.islice(self._existing, i, None))
+
+    def __delitem__(self, i):
+        if isinstance(i, slice):
+            for x in self[i]:
+                self.discard(x)
+        else:
+            self.discard(self[i])
+
+    def __getstate__(self):
+        return list(self._existing)
+
+    def __setstate__(self, state):
+        self._replace(state)
+
+    def index(self, x):
+        """returns the position of x, raising ValueError if it isn't present"""
+        if x in self._existing:
+            for i, item in enumerate(self._existing):
+                if item == x:
+                    return i
+        raise ValueError("%r is not in CompactOrderedSet" % (x,))
+
+    def copy(self):
+        new_set = self.__class__()
+        new_set._existing = self._existing.copy()
+        return new_set
+
+    def extend(self,iterable):
+        # existing keys keep their position
+        self._existing.update(_ordered_dict.fromkeys(iterable))
+
+    def discard(self,x):
+        """removes x if it is present"""
+        self._existing.pop(x, None)
+
+    def pop(self, i=-1):
+        """removes and returns the item at position i (the last by default)"""
+        if i == -1 and self._existing:
+            return self._existing.popitem()[0]
+        x = self[i]
+        self.discard(x)
+        return x
+
+    def clear(self):
+        self._existing.clear()
+
+# the types that the set operators accept, which all have fast membership tests
+_set_types = (BaseOrderedSet, set, frozenset)
+
+def _lookup(iterable):
+    """returns iterable if it has fast membership tests, or a CompactOrderedSet of its items otherwise"""
+    if isinstance(iterable, _set_types + (dict,)):
+        return iterable
+    return CompactOrderedSet(iterable)
@@ -65,7 +65,15 @@ from future import standard_library
 standard_library.install_aliases()
 from builtins import *
 from past.utils import old_div
+from j5basic import SortedList
+import itertools
 import math
+import multiprocessing
+import random
+try:
+  import numpy
+except ImportError:
+  numpy = None
 
 def tagmaptoaxismap(tagmap):
   """converts a tag: (score, axis) dict to a axis: [tag, tag, tag...] dict"""
@@ -85,6 +93,14 @@ def sortaxes(axes):
   axisranges.sort()
   return [axis for axisrange, axis in axisranges]
 
+def _axesscore(total, numaxes):
+  """the score for numaxes axes, given the sum of (amax - amin) / (rmax - rmin) over the tags"""
+  wastedspace = (numaxes - 1) * 5
+  if isinstance(total, float):
+    return (100 - wastedspace) / total / numaxes
+  # the total is an integer if every tag or axis has zero width
+  return old_div((old_div((100 - wastedspace), total)), numaxes)
+
 def score(ranges, tagmap):
   """we want to maximise this: the GM of the areas covered"""
   score = 0
@@ -97,54 +113,578 @@ def score(ranges, tagmap):
     except ZeroDivisionError:
       score += 1
   numaxes = len(dict.fromkeys(list(tagmap.values())))
-  wastedspace = (numaxes - 1) * 5
-  return old_div((old_div((100 - wastedspace), score)), numaxes)
+  return _axesscore(score, numaxes)
+
+class _AxisGroup(object):
+  """a group of tags sharing an axis, with the sums needed for its contribution to the score.
+  seq gives the order groups were created in, which is used to break ties"""
+  __slots__ = ("tags", "axis", "seq", "count", "zerocount", "inverse", "contribution")
+
+  def __init__(self, tags, axis, seq, count, zerocount, inverse):
+    self.tags, self.axis, self.seq = tags, axis, seq
+    self.count, self.zerocount, self.inverse = count, zerocount, inverse
+    self.contribution = _contribution(axis, count, zerocount, inverse)
+
+def _contribution(axis, count, zerocount, inverse):
+  """returns the sum of (amax - amin) / (rmax - rmin) over count tags on the given axis, as score adds it up:
+  zerocount tags have rmin == rmax and inverse is the sum of 1 / (rmax - rmin) over the others"""
+  amin, amax = axis
+  if amax == amin:
+    return count
+  return zerocount + (amax - amin) * inverse
+
+def _arraycontributions(amins, amaxs, counts, zerocounts, inverses):
+  """a vectorized version of _contribution, for arrays of axes and sums"""
+  widths = amaxs - amins
+  return numpy.where(widths == 0, counts, zerocounts + widths * inverses)
+
+class _AxisMerger(object):
+  """finds the same grouping as trying every pair of groups each round and rescoring the whole tagmap,
+  but keeps each group's contribution to the score so that only the merged pair needs rescoring.
+  The gain of merging a pair (how much it reduces the score's denominator) never changes while both groups exist,
+  so the pairs are kept in a SortedList ordered by gain, and pairs involving merged groups are dropped lazily.
+  If numpy is available, the gains of pairing a group with many others are calculated in one vectorized call"""
+  # below this many pairs, calculating gains one at a time is quicker than setting up the arrays
+  VECTORIZE_MIN = 16
+  # below this many tags, starting a process pool costs more than it saves
+  PARALLEL_MIN = 500
+  def __init__(self, ranges, processes=None):
+    self.groups = {}
+    self.axiscounts = {}
+    self.bymin = {}
+    self.bymax = {}
+    self.nextseq = 0
+    self.deadpairs = 0
+    for tag, (rmin, rmax) in ranges.items():
+      if rmax == rmin:
+        self._newgroup((tag,), (rmin, rmax), 1, 1, 0)
+      else:
+        self._newgroup((tag,), (rmin, rmax), 1, 0, 1.0 / (rmax - rmin))
+    # float arrays only give the same gains if the axis bounds are exactly representable
+    self.vectorize = numpy is not None and all(-2**52 < bound < 2**52 for axis in self.axiscounts for bound in axis)
+    groups = list(self.groups.values())
+    if processes and processes > 1 and len(groups) >= self.PARALLEL_MIN:
+      pairkeys = self._parallelpairkeys(groups, processes)
+    else:
+      pairkeys = self._pairkeyrows(groups, self._arraystats(groups), 0, len(groups))
+    # the keys are unique and totally ordered, so the sorted pairs don't depend on the order they were calculated in
+    self.pairs = SortedList.SortedList(pairkeys)
+
+  def _ordered(self, group1, group2):
+    """returns the pair in the order it would be merged in: the group with the greater tags first"""
+    if group1.tags > group2.tags:
+      return group1, group2
+    return group2, group1
+
+  def _pairkey(self, group1, group2):
+    """returns (gain, seq1, seq2) for merging the pair; the gain is summed per group,
+    so that a group whose axis doesn't change adds exactly nothing to it"""
+    group1, group2 = self._ordered(group1, group2)
+    axis = (min(group1.axis[0], group2.axis[0]), max(group1.axis[1], group2.axis[1]))
+    gain = 0
+    for group in (group1, group2):
+      if group.axis != axis:
+        gain += group.contribution - _contribution(axis, group.count, group.zerocount, group.inverse)
+    return (gain, group1.seq, group2.seq)
+
+  def _arraystats(self, groups):
+    """returns an array with rows of the axis bounds, sums and contributions of the groups, for _pairkeys,
+    or None if the gains aren't to be vectorized"""
+    if not self.vectorize or len(groups) < self.VECTORIZE_MIN:
+      return None
+    return numpy.array([(group.axis[0], group.axis[1], group.count, group.zerocount, group.inverse, group.contribution)
+                        for group in groups], dtype=float).T
+
+  def _pairkeys(self, group, others, stats=None):
+    """returns a list of the keys for pairing group with each of others that has a different axis.
+    stats is the result of _arraystats for others, which calculates the gains in numpy"""
+    if stats is None or len(others) < self.VECTORIZE_MIN:
+      return [self._pairkey(group, other) for other in others if other.axis != group.axis]
+    othermins, othermaxs, othercounts, otherzerocounts, otherinverses, othercontributions = stats
+    amin, amax = group.axis
+    mergedmins, mergedmaxs = numpy.minimum(othermins, amin), numpy.maximum(othermaxs, amax)
+    # as in _pairkey, a group whose axis doesn't change adds exactly nothing to the gain
+    gains = numpy.where((mergedmins != othermins) | (mergedmaxs != othermaxs),
+                        othercontributions - _arraycontributions(mergedmins, mergedmaxs, othercounts, otherzerocounts, otherinverses), 0.0)
+    gains += numpy.where((mergedmins != amin) | (mergedmaxs != amax),
+                         group.contribution - _arraycontributions(mergedmins, mergedmaxs, group.count, group.zerocount, group.inverse), 0.0)
+    pairkeys = []
+    for other, gain in zip(others, gains.tolist()):
+      if other.axis == group.axis:
+        continue
+      # gains between groups of zero width tags are the integer 0 in _pairkey, which keeps an integer total exact
+      gain = gain or 0
+      if group.tags > other.tags:
+        pairkeys.append((gain, group.seq, other.seq))
+      else:
+        pairkeys.append((gain, other.seq, group.seq))
+    return pairkeys
+
+  def _pairkeyrows(self, groups, stats, start, stop):
+    """returns the keys for pairing each of groups[start:stop] with the groups after it, given _arraystats for groups"""
+    pairkeys = []
+    for n in range(start, stop):
+      pairkeys.extend(self._pairkeys(groups[n], groups[n+1:], None if stats is None else stats[:, n+1:]))
+    return pairkeys
+
+  def _parallelpairkeys(self, groups, processes):
+    """calculates the keys for all the pairs of groups across a pool of processes,
+    in chunks of rows that each have about the same number of pairs"""
+    chunkpairs = len(groups) * (len(groups) - 1) // 2 // (processes * 4) + 1
+    chunks, start, pairs = [], 0, 0
+    for n in range(len(groups)):
+      pairs += len(groups) - n - 1
+      if pairs >= chunkpairs:
+        chunks.append((start, n + 1))
+        start, pairs = n + 1, 0
+    if start < len(groups):
+      chunks.append((start, len(groups)))
+    pool = multiprocessing.Pool(processes, _initpairworker, (groups, self.vectorize))
+    try:
+      return list(itertools.chain.from_iterable(pool.map(_pairworkerrows, chunks)))
+    finally:
+      pool.close()
+      pool.join()
 
-def calculateaxes(ranges):
-  """flagrantly override the previous method"""
+  def _newgroup(self, tags, axis, count, zerocount, inverse):
+    """adds a group, without adding its pairs"""
+    group = _AxisGroup(tags, axis, self.nextseq, count, zerocount, inverse)
+    self.nextseq += 1
+    self.groups[group.seq] = group
+    self.axiscounts[axis] = self.axiscounts.get(axis, 0) + 1
+    self.bymin.setdefault(axis[0], set()).add(group.seq)
+    self.bymax.setdefault(axis[1], set()).add(group.seq)
+    return group
+
+  def _removegroup(self, group):
+    """removes the group, leaving its pairs to be dropped when they are next scanned"""
+    del self.groups[group.seq]
+    axis = group.axis
+    self.deadpairs += sum(1 for other in self.groups.values() if other.axis != axis)
+    self.axiscounts[axis] -= 1
+    if not self.axiscounts[axis]:
+      del self.axiscounts[axis]
+    for index, value in ((self.bymin, axis[0]), (self.bymax, axis[1])):
+      index[value].discard(group.seq)
+      if not index[value]:
+        del index[value]
+
+  def merge(self, group1, group2):
+    """replaces the two groups with a single group covering both their axes"""
+    group1, group2 = self._ordered(group1, group2)
+    axis = (min(group1.axis[0], group2.axis[0]), max(group1.axis[1], group2.axis[1]))
+    self._removegroup(group1)
+    self._removegroup(group2)
+    merged = self._newgroup(group1.tags + group2.tags, axis, group1.count + group2.count,
+                            group1.zerocount + group2.zerocount, group1.inverse + group2.inverse)
+    others = [other for other in self.groups.values() if other is not merged]
+    self.pairs.update(self._pairkeys(merged, others, self._arraystats(others)))
+    if self.deadpairs > len(self.pairs) // 2:
+      groups = self.groups
+      self.pairs = SortedList.SortedList([pairkey for pairkey in self.pairs if pairkey[1] in groups and pairkey[2] in groups])
+      self.deadpairs = 0
+    return merged
+
+  def total(self):
+    """the denominator of the score: the sum of the contributions of all the groups"""
+    return sum(group.contribution for group in self.groups.values())
+
+  def score(self):
+    return _axesscore(self.total(), len(self.axiscounts))
+
+  def _numaxes(self, group1, group2):
+    """the number of distinct axes there would be after merging group1 and group2"""
+    axiscounts = self.axiscounts
+    axis = (min(group1.axis[0], group2.axis[0]), max(group1.axis[1], group2.axis[1]))
+    numaxes = len(axiscounts)
+    if axiscounts[group1.axis] == 1:
+      numaxes -= 1
+    if axiscounts[group2.axis] == 1:
+      numaxes -= 1
+    if axiscounts.get(axis, 0) == (axis == group1.axis) + (axis == group2.axis):
+      numaxes += 1
+    return numaxes
+
+  def _disjointpairs(self):
+    """yields the pairs of groups where neither contains the other, and the merged axis is that of another group.
+    These are the only merges that can reduce the number of distinct axes by two"""
+    groups = self.groups
+    for amin, amax in self.axiscounts:
+      uppers = [groups[seq] for seq in self.bymax[amax] if groups[seq].axis[0] > amin]
+      if not uppers:
+        continue
+      for seq in self.bymin[amin]:
+        if groups[seq].axis[1] < amax:
+          for other in uppers:
+            yield self._pairkey(groups[seq], other)
+
+  def _better(self, best, total, pairkey):
+    """returns the better of best and pairkey as (score, seq1, seq2), and the number of axes pairkey would leave"""
+    gain, seq1, seq2 = pairkey
+    numaxes = self._numaxes(self.groups[seq1], self.groups[seq2])
+    thisscore = _axesscore(total - gain, numaxes)
+    if best is None or (thisscore, -seq1, -seq2) > (best[0], -best[1], -best[2]):
+      best = (thisscore, seq1, seq2)
+    return best, numaxes
+
+  def bestpair(self):
+    """returns (score, group1, group2) for the merge that gives the best score, or None if there are no pairs to merge.
+    Where scores are equal, the pair that comes first in the order groups were created is chosen"""
+    total = self.total()
+    groups = self.groups
+    numaxes = len(self.axiscounts)
+    wastedspace = (numaxes - 2) * 5
+    best = None
+    for pairkey in self._disjointpairs():
+      best = self._better(best, total, pairkey)[0]
+    # merges leaving numaxes - 1 axes score better the greater their gain, or the smaller it is once the wasted space
+    # makes the score negative. Any other merge either leaves numaxes - 2 axes, and was found above,
+    # or leaves more axes with a worse score for the same gain, so the pairs can be scanned in order of gain
+    # until the first merge leaving numaxes - 1 axes (and any others with the same gain)
+    if wastedspace < 100:
+      pairs = reversed(self.pairs)
+    else:
+      pairs = iter(self.pairs)
+    stopgain = None
+    dead = []
+    for pairkey in pairs:
+      if stopgain is not None and pairkey[0] != stopgain:
+        break
+      if pairkey[1] not in groups or pairkey[2] not in groups:
+        dead.append(pairkey)
+        continue
+      best, pairaxes = self._better(best, total, pairkey)
+      # when the wasted space uses up all the space, every merge leaving numaxes - 1 axes scores zero
+      if pairaxes == numaxes - 1 and wastedspace != 100:
+        stopgain = pairkey[0]
+    for pairkey in dead:
+      self.pairs.discard(pairkey)
+    self.deadpairs -= len(dead)
+    if best is None:
+      return None
+    return best[0], groups[best[1]], groups[best[2]]
+
+# the _AxisMerger used to calculate pair keys in a process pool worker, with its groups and their _arraystats
+_pairworker = None
+
+def _initpairworker(groups, vectorize):
+  global _pairworker
+  merger = _AxisMerger({})
+  merger.vectorize = vectorize
+  _pairworker = (merger, groups, merger._arraystats(groups))
+
+def _pairworkerrows(rows):
+  merger, groups, stats = _pairworker
+  return merger._pairkeyrows(groups, stats, rows[0], rows[1])
+
+def calculateaxes(ranges, processes=None):
+  """flagrantly override the previous method.
+  Groups the tags onto axes by repeatedly making the merge of two groups that most improves the score,
+  which costs O(n**2 log n) for n tags.
+  If processes is given, the gains of merging every pair of tags are calculated across a pool of that many processes;
+  the result is the same"""
   for tagname, (rmin, rmax) in list(ranges.items()):
     ranges[tagname] = math.floor(rmin),math.ceil(rmax)
-  # print 'ranges', ranges
-  def groups2tagmap(groups):
-    tagmap = {}
-    for group, range in groups.items():
-      for tag in group:
-        tagmap[tag] = range
-    return tagmap
-  groups = dict([((tag,), (rmin, rmax)) for tag, (rmin, rmax) in ranges.items()])
-  tagmap = groups2tagmap(groups)
-  bestscore = score(ranges, tagmap)
-  bestgroups = groups
-  foundimprovement = True
-  numaxes = len(groups)
-  while foundimprovement and numaxes > 1:
-    thisbestscore = bestscore
-    thisbestgroups = bestgroups
-    foundimprovement = False
-    # print "trying for improvement at", numaxes
-    for group1, (a1_min, a1_max) in bestgroups.items():
-      for group2, (a2_min, a2_max) in bestgroups.items():
-        # don't need to try both ways or on the same tag
-        if group1 <= group2: continue
-        if (a1_min, a1_max) == (a2_min, a2_max): continue
-        a_min = min(a1_min, a2_min)
-        a_max = max(a1_max, a2_max)
-        groups = bestgroups.copy()
-        del groups[group1]
-        del groups[group2]
-        groups[group1+group2] = (a_min, a_max)
-        tagmap = groups2tagmap(groups)
-        thisscore = score(ranges, tagmap)
-        # print thisscore, ", ".join(["%s: %r..%r" % (tag, rmin, rmax) for tag, (rmin, rmax) in tagmap.iteritems()])
-        if thisscore > thisbestscore:
-          thisbestscore, thisbestgroups = thisscore, groups
-          foundimprovement = True
-    if foundimprovement:
-      bestscore, bestgroups = thisbestscore, thisbestgroups
-      numaxes = len(bestgroups)
-      # print "best at", numaxes, bestscore, bestgroups
-  bestmap = groups2tagmap(bestgroups)
-  for tag1, (r1_min, r1_max) in list(bestmap.items()):
-    bestmap[tag1] = (0, (r1_min, r1_max))
+  merger = _AxisMerger(ranges, processes)
+  while len(merger.groups) > 1:
+    best = merger.bestpair()
+    # compare with the current score summed the same way, so that merges which change nothing aren't taken
+    if best is None or not best[0] > merger.score():
+      break
+    merger.merge(best[1], best[2])
+  bestmap = {}
+  for group in merger.groups.values():
+    for tag in group.tags:
+      bestmap[tag] = (0, group.axis)
   return bestmap
 
+class _IntervalNode(object):
+  """a node of IntervalIndex's treap, ordered by sortkey, with maxhi the largest hi in its subtree"""
+  __slots__ = ("sortkey", "key", "lo", "hi", "priority", "left", "right", "maxhi")
+
+  def __init__(self, sortkey, key, priority):
+    self.sortkey, self.key, self.priority = sortkey, key, priority
+    self.lo, self.hi = sortkey[:2]
+    self.left = self.right = None
+    self.maxhi = self.hi
+
+  def update(self):
+    maxhi = self.hi
+    if self.left is not None and self.left.maxhi > maxhi:
+      maxhi = self.left.maxhi
+    if self.right is not None and self.right.maxhi > maxhi:
+      maxhi = self.right.maxhi
+    self.maxhi = maxhi
+
+class IntervalIndex(object):
+  """An index of keyed ranges (lo, hi), answering which ranges contain a point, overlap a window or contain a range.
+  This is an interval tree: a treap ordered by lo, where each node knows the largest hi below it,
+  so adding and removing ranges is O(log n), and queries skip any subtree that can't contain a match,
+  costing O(log n) for each range found. Query results are in order of lo.
+  Keys can be anything hashable (tags, or axes from calculateaxes); adding an existing key replaces its range"""
+  def __init__(self, ranges=None):
+    self._root = None
+    self._nodes = {}
+    self._seq = itertools.count()
+    self._random = random.Random()
+    if ranges is not None:
+      for key, keyrange in ranges.items():
+        self.add(key, keyrange)
+
+  def __len__(self):
+    return len(self._nodes)
+
+  def __contains__(self, key):
+    return key in self._nodes
+
+  def __getitem__(self, key):
+    """returns the range of key"""
+    node = self._nodes[key]
+    return (node.lo, node.hi)
+
+  def __iter__(self):
+    """iterates over the keys in order of lo"""
+    return (node.key for node in self._inorder(None, None))
+
+  def items(self):
+    return [(node.key, (node.lo, node.hi)) for node in self._inorder(None, None)]
+
+  def _split(self, node, sortkey):
+    """splits the subtree into the nodes before sortkey and the rest"""
+    if node is None:
+      return None, None
+    if node.sortkey < sortkey:
+      node.right, right = self._split(node.right, sortkey)
+      node.update()
+      return node, right
+    left, node.left = self._split(node.left, sortkey)
+    node.update()
+    return left, node
+
+  def _merge(self, left, right):
+    """joins two subtrees, where all of left comes before right"""
+    if left is None:
+      return right
+    if right is None:
+      return left
+    if left.priority > right.priority:
+      left.right = self._merge(left.right, right)
+      left.update()
+      return left
+    right.left = self._merge(left, right.left)
+    right.update()
+    return right
+
+  def _insert(self, node, new):
+    if node is None:
+      return new
+    if new.priority > node.priority:
+      new.left, new.right = self._split(node, new.sortkey)
+      new.update()
+      return new
+    if new.sortkey < node.sortkey:
+      node.left = self._insert(node.left, new)
+    else:
+      node.right = self._insert(node.right, new)
+    node.update()
+    return node
+
+  def _delete(self, node, sortkey):
+    if node.sortkey == sortkey:
+      return self._merge(node.left, node.right)
+    if sortkey < node.sortkey:
+      node.left = self._delete(node.left, sortkey)
+    else:
+      node.right = self._delete(node.right, sortkey)
+    node.update()
+    return node
+
+  def add(self, key, keyrange):
+    """adds key with the given (lo, hi) range, replacing its previous range if it is already present"""
+    lo, hi = keyrange
+    if hi < lo:
+      raise ValueError("Range %r for %r has hi < lo" % (keyrange, key))
+    self.discard(key)
+    # the sequence number keeps the sort keys unique without comparing the keys themselves
+    node = _IntervalNode((lo, hi, next(self._seq)), key, self._random.random())
+    self._root = self._insert(self._root, node)
+    self._nodes[key] = node
+
+  def discard(self, key):
+    """removes key if it is present"""
+    node = self._nodes.pop(key, None)
+    if node is not None:
+      self._root = self._delete(self._root, node.sortkey)
+
+  def remove(self, key):
+    """removes key, raising KeyError if it isn't present"""
+    if key not in self._nodes:
+      raise KeyError(key)
+    self.discard(key)
+
+  def clear(self):
+    self._root = None
+    self._nodes = {}
+
+  def _inorder(self, maxlo, minhi):
+    """yields the nodes with lo <= maxlo and hi >= minhi (None meaning unbounded) in order"""
+    stack = []
+    node = self._root
+    while stack or node is not None:
+      # go left, skipping subtrees without a large enough hi
+      while node is not None and (minhi is None or node.maxhi >= minhi):
+        stack.append(node)
+        node = node.left
+      if not stack:
+        return
+      node = stack.pop()
+      if maxlo is not None and node.lo > maxlo:
+        # everything after this starts too late
+        return
+      if minhi is None or node.hi >= minhi:
+        yield node
+      node = node.right
+
+  def stab(self, point):
+    """returns the keys whose ranges contain point"""
+    return [node.key for node in self._inorder(point, point)]
+
+  def overlapping(self, lo, hi):
+    """returns the keys whose ranges overlap the window from lo to hi"""
+    return [node.key for node in self._inorder(hi, lo)]
+
+  def containing(self, lo, hi):
+    """returns the keys whose ranges contain the whole range from lo to hi"""
+    return [node.key for node in self._inorder(lo, hi)]
+
+def axisindex(tagmap):
+  """returns an IntervalIndex of the axes in a tagmap from calculateaxes, keyed by the axes themselves,
+  for finding the axes that contain a range"""
+  return IntervalIndex(dict((axis, axis) for score, axis in tagmap.values()))
+
+def _roundrange(keyrange):
+  """rounds a range outwards to integers, as calculateaxes does"""
+  rmin, rmax = keyrange
+  return math.floor(rmin), math.ceil(rmax)
+
+class AxisPlanner(object):
+  """Keeps the axes for a set of tag ranges that change over time, as on a live trend.
+  update() places each changed tag on the axis that gives the best score, adjusting only the groups it leaves and joins,
+  and returns the tags whose axes changed. If the score falls more than (1 - recomputeratio) of the way below the score
+  after the last full calculation, the axes are calculated again from scratch with calculateaxes.
+  Unlike calculateaxes, the ranges passed in are not changed"""
+  def __init__(self, ranges=None, recomputeratio=0.9):
+    self.recomputeratio = recomputeratio
+    self.ranges = {}
+    self.groups = {}
+    self.taggroups = {}
+    self.axiscounts = {}
+    self.fullscore = None
+    self.oldaxes = {}
+    self._groupids = itertools.count()
+    if ranges:
+      self.ranges = dict((tag, _roundrange(keyrange)) for tag, keyrange in ranges.items())
+      self.recompute()
+
+  @property
+  def tagmap(self):
+    """the tag: (score, axis) dict, as returned by calculateaxes"""
+    return dict((tag, (0, self.groups[groupid].axis)) for tag, groupid in self.taggroups.items())
+
+  def score(self):
+    if not self.groups:
+      return 0
+    return _axesscore(sum(group.contribution for group in self.groups.values()), len(self.axiscounts))
+
+  def _group(self, tags):
+    """returns an _AxisGroup for the given tags, with an axis covering all their ranges"""
+    ranges = [self.ranges[tag] for tag in tags]
+    axis = (min(rmin for rmin, rmax in ranges), max(rmax for rmin, rmax in ranges))
+    zerocount = sum(1 for rmin, rmax in ranges if rmin == rmax)
+    inverse = sum([1.0 / (rmax - rmin) for rmin, rmax in ranges if rmin != rmax] or [0])
+    return _AxisGroup(tuple(tags), axis, next(self._groupids), len(ranges), zerocount, inverse)
+
+  def _setgroup(self, groupid, group):
+    """replaces the group with the given id (None to remove it), keeping the axis counts,
+    and noting the axes its tags had before the current change in oldaxes"""
+    old = self.groups.pop(groupid, None)
+    if old is not None:
+      for tag in old.tags:
+        self.oldaxes.setdefault(tag, old.axis)
+      self.axiscounts[old.axis] -= 1
+      if not self.axiscounts[old.axis]:
+        del self.axiscounts[old.axis]
+    if group is not None:
+      self.groups[groupid] = group
+      self.axiscounts[group.axis] = self.axiscounts.get(group.axis, 0) + 1
+      for tag in group.tags:
+        self.taggroups[tag] = groupid
+
+  def _diff(self, tags):
+    """returns tag: axis for the given tags where the axis differs from oldaxes (which holds each tag's axis before
+    the current change, or None if it wasn't present), with None for tags that have been removed, and clears oldaxes"""
+    diff = {}
+    for tag in tags:
+      groupid = self.taggroups.get(tag)
+      newaxis = None if groupid is None else self.groups[groupid].axis
+      if newaxis != self.oldaxes.get(tag):
+        diff[tag] = newaxis
+    self.oldaxes = {}
+    return diff
+
+  def recompute(self):
+    """calculates all the axes from scratch, returning tag: axis for the tags whose axis changed"""
+    for tag, groupid in self.taggroups.items():
+      self.oldaxes.setdefault(tag, self.groups[groupid].axis)
+    self.groups, self.taggroups, self.axiscounts = {}, {}, {}
+    for axis, tags in tagmaptoaxismap(calculateaxes(dict(self.ranges))).items():
+      if tags:
+        self._setgroup(next(self._groupids), self._group(tags))
+    self.fullscore = self.score()
+    return self._diff(list(self.oldaxes))
+
+  def _removetag(self, tag):
+    """takes tag out of its group, shrinking the group's axis to fit the tags that are left"""
+    groupid = self.taggroups.pop(tag)
+    tags = [grouptag for grouptag in self.groups[groupid].tags if grouptag != tag]
+    self._setgroup(groupid, self._group(tags) if tags else None)
+
+  def _placetag(self, tag):
+    """adds tag to the group, or a new group of its own, that gives the best score"""
+    total = sum(group.contribution for group in self.groups.values())
+    single = self._group([tag])
+    numaxes = len(self.axiscounts) + (single.axis not in self.axiscounts)
+    bestscore, bestgroupid = _axesscore(total + single.contribution, numaxes), None
+    for groupid, group in self.groups.items():
+      axis = (min(group.axis[0], single.axis[0]), max(group.axis[1], single.axis[1]))
+      contribution = _contribution(axis, group.count + 1, group.zerocount + single.zerocount, group.inverse + single.inverse)
+      numaxes = len(self.axiscounts)
+      if axis != group.axis:
+        numaxes += (self.axiscounts[group.axis] > 1) + (axis not in self.axiscounts) - 1
+      thisscore = _axesscore(total - group.contribution + contribution, numaxes)
+      if thisscore > bestscore:
+        bestscore, bestgroupid = thisscore, groupid
+    if bestgroupid is None:
+      self._setgroup(next(self._groupids), single)
+    else:
+      self._setgroup(bestgroupid, self._group(self.groups[bestgroupid].tags + (tag,)))
+
+  def update(self, ranges=None, removed=()):
+    """sets the ranges of the given tags (adding any new ones) and removes the removed tags,
+    returning tag: axis for the tags whose axis changed, with None for removed tags"""
+    ranges = dict((tag, _roundrange(keyrange)) for tag, keyrange in (ranges or {}).items())
+    ranges = dict((tag, keyrange) for tag, keyrange in ranges.items() if self.ranges.get(tag) != keyrange)
+    for tag in set(ranges).union(removed):
+      if tag in self.taggroups:
+        self._removetag(tag)
+      else:
+        self.oldaxes.setdefault(tag, None)
+      self.ranges.pop(tag, None)
+    for tag, keyrange in ranges.items():
+      self.ranges[tag] = keyrange
+      self._placetag(tag)
+    # the score goes negative with enough axes, so the allowed drop is measured from its size
+    if self.fullscore is None or self.score() < self.fullscore - (1 - self.recomputeratio) * abs(self.fullscore):
+      return self.recompute()
+    # oldaxes now holds the tags of every group that was changed
+    return self._diff(list(self.oldaxes))
@@ -7,15 +7,28 @@ from __future__ import unicode_literals
 from future import standard_library
 standard_library.install_aliases()
 from builtins import *
+import array
+import bisect
+import contextlib
+import itertools
+import numbers
 import operator
 import threading
+try:
+    from collections.abc import MutableSet, Set
+except ImportError:
+    from collections import MutableSet, Set
 from j5basic import Decorators
+from j5basic import LockOrder
+from j5basic import SortedList
 
 _base_min = min
 _base_max = max
 
 class SemiSortedSet(set):
-    """A set that remembers its minimum and maximum, and can do inplace slicing at a certain point in a reasonably optimal way"""
+    """A set that remembers its minimum and maximum, and can do inplace slicing at a certain point in a reasonably optimal way.
+    The elements are also kept in a SortedList, so finding the minimum and maximum and removing elements are O(log n).
+    Iterating goes through a copy-on-write snapshot of the sorted elements, so other threads can change the set meanwhile"""
     def __new__(cls, iterable=None):
         self = set.__new__(cls)
         self.lock = threading.RLock()
@@ -23,18 +36,36 @@ class SemiSortedSet(set):
             set.__init__(self, iterable)
         else:
             set.__init__(self)
-        self._recalculate()
+        self._sorted = SortedList.SortedList(set.__iter__(self))
+        self._batch_depth = 0
+        self._pending_added = set()
+        self._pending_removed = set()
         return self
 
+    def __init__(self, iterable=None):
+        """The contents are set up in __new__ (so that a consumed iterator isn't used again)"""
+
+    def __reduce__(self):
+        return (self.__class__, (list(self),))
+
+    @Decorators.SelfLocking.runwithlock
+    def snapshot(self):
+        """Returns a read-only SortedListSnapshot of the elements in sorted order, which can be used without holding the lock.
+        This only costs O(n/500); changes to the set afterwards copy the parts of the sorted structure they change"""
+        self._apply_pending()
+        return self._sorted.snapshot()
+
+    def __iter__(self):
+        """Iterates over a snapshot of the elements in sorted order"""
+        return iter(self.snapshot())
+
     @Decorators.SelfLocking.runwithlock
     def copy(self):
         """makes a copy of this SemiSortedSet (with a new lock)"""
-        new_self = SemiSortedSet(set.copy(self))
-        new_self.lock = threading.RLock()
-        if hasattr(self, "__min__"):
-            new_self.__min__ = self.__min__
-        if hasattr(self, "__max__"):
-            new_self.__max__ = self.__max__
+        self._apply_pending()
+        new_self = self.__class__()
+        set.update(new_self, self)
+        new_self._sorted = self._sorted.copy()
         return new_self
 
     @Decorators.SelfLocking.runwithlock
@@ -42,120 +73,684 @@ class SemiSortedSet(set):
         """Returns the minimum element in the set"""
         if not self:
             raise ValueError("No elements in set")
-        return self.__min__
+        self._apply_pending()
+        return self._sorted[0]
 
     @Decorators.SelfLocking.runwithlock
     def max(self):
         """Returns the maximum element in the set"""
         if not self:
             raise ValueError("No elements in set")
-        return self.__max__
+        self._apply_pending()
+        return self._sorted[-1]
 
     @Decorators.SelfLocking.runwithlock
     def remove_cmp_op(self, cmp_op, comparator):
         """Removes all items in the set that satisfy cmp_op(item, comparator)"""
-        items_satisfy = set(item for item in self if cmp_op(item, comparator))
-        self.difference_update(items_satisfy)
+        if cmp_op in _range_removal_bounds:
+            self._remove_range(comparator, *_range_removal_bounds[cmp_op])
+        else:
+            items_satisfy = set(item for item in self if cmp_op(item, comparator))
+            self.difference_update(items_satisfy)
+
+    def _remove_range(self, comparator, lower, inclusive):
+        """internal method for removing the items below comparator (if lower) or above it, using the sorted structure.
+           not to be called without holding self.lock"""
+        self._apply_pending()
+        if lower:
+            removed = self._sorted.pop_range(maximum=comparator, inclusive=(True, inclusive))
+        else:
+            removed = self._sorted.pop_range(minimum=comparator, inclusive=(inclusive, True))
+        set.difference_update(self, removed)
 
     @Decorators.SelfLocking.runwithlock
     def remove_lt(self, minimum):
         """Removes all items in the set that are less than the given minimum"""
-        self.remove_cmp_op(operator.lt, minimum)
+        self._remove_range(minimum, True, False)
 
     @Decorators.SelfLocking.runwithlock
     def remove_le(self, minimum):
         """Removes all items in the set that are less than or equal to the given minimum"""
-        self.remove_cmp_op(operator.le, minimum)
+        self._remove_range(minimum, True, True)
 
     @Decorators.SelfLocking.runwithlock
     def remove_gt(self, maximum):
         """Removes all items in the set that are greater than the given maximum"""
-        self.remove_cmp_op(operator.gt, maximum)
+        self._remove_range(maximum, False, False)
 
     @Decorators.SelfLocking.runwithlock
     def remove_ge(self, maximum):
         """Removes all items in the set that are greater than or equal to the given maximum"""
-        self.remove_cmp_op(operator.ge, maximum)
+        self._remove_range(maximum, False, True)
 
-    def _recalculate(self):
-        """internal method for recalculating the cached minimum and maximum. not to be called without holding self.lock"""
-        if self:
-            self.__min__ = min(self)
-            self.__max__ = max(self)
+    @Decorators.SelfLocking.runwithlock
+    def irange(self, minimum=None, maximum=None, inclusive=(True, True), reverse=False):
+        """Returns an iterator over the items between minimum and maximum in sorted order (None meaning unbounded).
+           inclusive is a pair of flags saying whether items equal to minimum and maximum are included.
+           This iterates over a snapshot, so the set can be changed while iterating"""
+        return self.snapshot().irange(minimum, maximum, inclusive, reverse)
+
+    @Decorators.SelfLocking.runwithlock
+    def bisect_left(self, element):
+        """Returns the number of items in the set less than element"""
+        self._apply_pending()
+        return self._sorted.bisect_left(element)
+
+    @Decorators.SelfLocking.runwithlock
+    def bisect_right(self, element):
+        """Returns the number of items in the set less than or equal to element"""
+        self._apply_pending()
+        return self._sorted.bisect_right(element)
+
+    def _add_new(self, elements, presorted=False):
+        """internal method for adding elements that are known not to be in the set. not to be called without holding self.lock"""
+        set.update(self, elements)
+        if self._batch_depth:
+            self._record_added(elements)
         else:
-            if hasattr(self, "__min__"):
-                delattr(self, "__min__")
-            if hasattr(self, "__max__"):
-                delattr(self, "__max__")
-
-    def _recalculate_after_add(self, element):
-        """internal method for recalculating the cached minimum and maximum after element is added. not to be called without holding self.lock"""
-        if not hasattr(self, "__min__") or element < self.__min__:
-            self.__min__ = element
-        if not hasattr(self, "__max__") or element > self.__max__:
-            self.__max__ = element
-
-    def _recalculate_after_remove(self):
-        """internal method for recalculating the cached minimum and maximum after an item is removed. not to be called without holding self.lock"""
-        if self:
-            if self.__min__ not in self:
-                self.__min__ = min(self)
-            if self.__max__ not in self:
-                self.__max__ = max(self)
+            self._sorted.update(elements, presorted)
+
+    def _remove_existing(self, elements):
+        """internal method for removing elements that are known to be in the set. not to be called without holding self.lock"""
+        set.difference_update(self, elements)
+        if self._batch_depth:
+            self._record_removed(elements)
         else:
-            if hasattr(self, "__min__"):
-                delattr(self, "__min__")
-            if hasattr(self, "__max__"):
-                delattr(self, "__max__")
+            self._sorted.difference_update(elements)
+
+    def _record_added(self, elements):
+        """internal method for noting elements added to the set during a batch. not to be called without holding self.lock"""
+        for element in elements:
+            if element in self._pending_removed:
+                self._pending_removed.discard(element)
+            else:
+                self._pending_added.add(element)
+
+    def _record_removed(self, elements):
+        """internal method for noting elements removed from the set during a batch. not to be called without holding self.lock"""
+        for element in elements:
+            if element in self._pending_added:
+                self._pending_added.discard(element)
+            else:
+                self._pending_removed.add(element)
+
+    def _apply_pending(self):
+        """internal method for bringing the sorted structure up to date with changes made in a batch. not to be called without holding self.lock"""
+        if self._pending_removed:
+            self._sorted.difference_update(self._pending_removed)
+            self._pending_removed = set()
+        if self._pending_added:
+            self._sorted.update(self._pending_added)
+            self._pending_added = set()
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Returns a context manager that holds the lock while making many changes to the set,
+        only updating the sorted structure (and so the minimum and maximum) once at the end, or when it is needed"""
+        LockOrder.acquire(self.lock, self)
+        try:
+            self._batch_depth += 1
+            try:
+                yield self
+            finally:
+                self._batch_depth -= 1
+                if not self._batch_depth:
+                    self._apply_pending()
+        finally:
+            LockOrder.release(self.lock)
+
+    @Decorators.SelfLocking.runwithlock
+    def bulk_add(self, iterable, presorted=False):
+        """Adds all the elements in iterable, updating the sorted structure once.
+        If presorted is set, the elements should already be in increasing order, and are merged in linear time
+        (if they turn out not to be, they are sorted first)"""
+        contains = set.__contains__
+        if presorted:
+            new_elements, seen = [], set()
+            for element in iterable:
+                if not contains(self, element) and element not in seen:
+                    if new_elements and element < new_elements[-1]:
+                        presorted = False
+                    seen.add(element)
+                    new_elements.append(element)
+        else:
+            new_elements = self._new_elements([iterable])
+        self._add_new(new_elements, presorted)
+
+    @Decorators.SelfLocking.runwithlock
+    def bulk_discard(self, iterable):
+        """Removes all the elements in iterable that are in the set, updating the sorted structure once"""
+        self._remove_existing(self._existing_elements([iterable]))
+
+    def _new_elements(self, others):
+        """internal method returning the distinct elements of the given iterables that are not in the set"""
+        contains = set.__contains__
+        return [element for element in set(itertools.chain(*others)) if not contains(self, element)]
+
+    def _existing_elements(self, others):
+        """internal method returning the distinct elements of the given iterables that are in the set"""
+        contains = set.__contains__
+        return [element for element in set(itertools.chain(*others)) if contains(self, element)]
+
+    def _sorted_remove(self, element):
+        """internal method for removing an element that has been removed from the set from the sorted structure. not to be called without holding self.lock"""
+        if self._batch_depth:
+            self._record_removed((element,))
+        else:
+            self._sorted.remove(element)
 
     @Decorators.SelfLocking.runwithlock
     def add(self, element):
         """Add an element to a set. This has no effect if the element is already present."""
-        set.add(self, element)
-        self._recalculate_after_add(element)
+        if not set.__contains__(self, element):
+            set.add(self, element)
+            if self._batch_depth:
+                self._record_added((element,))
+            else:
+                self._sorted.add(element)
 
-def lock_wrapper(f, target_function):
-    def wrapper(self,*args,**kws):
-        try:
-            self.lock.acquire()
-            result = f(self,*args,**kws)
-            target_function(self)
-        finally:
-            self.lock.release()
-        return result
-    wrapper.__doc__ = f.__doc__
-    wrapper.__name__ = getattr(f, 'func_name', getattr(f, '__name__', 'locked_function'))
-    return wrapper
-
-# Override all inherited methods from set so that they lock safely
-def _wrap_set_methods():
+    @Decorators.SelfLocking.runwithlock
+    def discard(self, element):
+        """Remove an element from a set if it is a member. If the element is not a member, do nothing."""
+        if set.__contains__(self, element):
+            set.discard(self, element)
+            self._sorted_remove(element)
+
+    @Decorators.SelfLocking.runwithlock
+    def remove(self, element):
+        """Remove an element from a set; it must be a member. If the element is not a member, raise a KeyError."""
+        set.remove(self, element)
+        self._sorted_remove(element)
+
+    @Decorators.SelfLocking.runwithlock
+    def pop(self):
+        """Remove and return an arbitrary set element. Raises KeyError if the set is empty."""
+        element = set.pop(self)
+        self._sorted_remove(element)
+        return element
+
+    @Decorators.SelfLocking.runwithlock
+    def clear(self):
+        """Remove all elements from this set."""
+        set.clear(self)
+        self._sorted.clear()
+        self._pending_added = set()
+        self._pending_removed = set()
+
+    @Decorators.SelfLocking.runwithlock
+    def update(self, *others):
+        """Update a set with the union of itself and others."""
+        self._add_new(self._new_elements(others))
+
+    @Decorators.SelfLocking.runwithlock
+    def difference_update(self, *others):
+        """Remove all elements of other sets from this set."""
+        self._remove_existing(self._existing_elements(others))
+
+    @Decorators.SelfLocking.runwithlock
+    def intersection_update(self, *others):
+        """Update a set with the intersection of itself and others."""
+        keep = set.intersection(self, *others)
+        self._remove_existing([element for element in set.__iter__(self) if element not in keep])
+
+    @Decorators.SelfLocking.runwithlock
+    def symmetric_difference_update(self, other):
+        """Update a set with the symmetric difference of itself and another."""
+        other = set(other)
+        removed = self._existing_elements([other])
+        added = self._new_elements([other])
+        self._remove_existing(removed)
+        self._add_new(added)
+
+    def __ior__(self, other):
+        if not isinstance(other, (set, frozenset)):
+            return NotImplemented
+        self.update(other)
+        return self
+
+    def __iand__(self, other):
+        if not isinstance(other, (set, frozenset)):
+            return NotImplemented
+        self.intersection_update(other)
+        return self
+
+    def __isub__(self, other):
+        if not isinstance(other, (set, frozenset)):
+            return NotImplemented
+        self.difference_update(other)
+        return self
+
+    def __ixor__(self, other):
+        if not isinstance(other, (set, frozenset)):
+            return NotImplemented
+        self.symmetric_difference_update(other)
+        return self
+
+# maps comparison operators to (lower, inclusive) arguments for SemiSortedSet._remove_range
+_range_removal_bounds = {
+    operator.lt: (True, False),
+    operator.le: (True, True),
+    operator.gt: (False, False),
+    operator.ge: (False, True),
+}
+
+def _find_read_only_set_methods():
+    """returns the names of the inherited set methods that SemiSortedSet doesn't implement itself - these only read the set"""
     method_descriptor = type(set.add)
     wrapper_descriptor = type(set.__or__)
-    target_methods = {}
-    for method in ("__init__", "__delattr__", "__getattribute__", "__setattr__"):
-        target_methods[method] = None
-    for method in ("difference_update", "intersection_update", "symmetric_difference_update", "update", "__iand__", "__ior__", "__isub__", "__ixor__"):
-        target_methods[method] = SemiSortedSet._recalculate
-    for method in ("clear", "discard", "pop", "remove"):
-        target_methods[method] = SemiSortedSet._recalculate_after_remove
+    read_only_methods = []
     for function_name in dir(set):
         set_function = getattr(set, function_name)
         if not isinstance(set_function, (method_descriptor, wrapper_descriptor)):
             continue
-        override_function = getattr(SemiSortedSet, function_name)
-        if override_function is not set_function:
+        if function_name in ("__delattr__", "__getattribute__", "__setattr__"):
             continue
-        if function_name in target_methods:
-            target_function = target_methods[function_name]
-            if target_function is None:
-                continue
-            new_function = lock_wrapper(set_function, target_function)
+        if getattr(SemiSortedSet, function_name) is set_function:
+            read_only_methods.append(function_name)
+    return read_only_methods
+
+_read_only_set_methods = _find_read_only_set_methods()
+del _find_read_only_set_methods
+
+def wrap_set_methods(cls, lock=True, timed=True):
+    """Overrides the read-only set methods on the given SemiSortedSet class.
+    If lock is set they run holding self.lock, and if timed is set they log how long they take with Decorators.wraptimer.
+    Without locking, the plain set methods are used, relying on them running atomically under the GIL"""
+    for function_name in _read_only_set_methods:
+        new_function = getattr(set, function_name)
+        if lock:
+            new_function = Decorators.SelfLocking.runwithlock(new_function)
+        if timed:
+            new_function = Decorators.wraptimer(new_function)
+        setattr(cls, function_name, new_function)
+
+# Override all remaining inherited methods from set so that they lock safely
+wrap_set_methods(SemiSortedSet)
+
+class FastSemiSortedSet(SemiSortedSet):
+    """A SemiSortedSet whose read-only set methods (membership, length, comparisons and operations returning new sets)
+    don't take the lock or log their timing, so they cost the same as for a plain set.
+    Methods that change the set, or use the sorted structure, still hold the lock.
+    Timing can be added for debugging by subclassing and calling wrap_set_methods(subclass, lock=False, timed=True)"""
+
+wrap_set_methods(FastSemiSortedSet, lock=False, timed=False)
+
+class NumericSemiSortedSet(MutableSet):
+    """A set of numbers with the same interface as SemiSortedSet, stored in a sorted array rather than as Python objects.
+    typecode is the array typecode: 'd' (the default) stores floats (so ints are returned as floats), 'q' stores 64-bit ints
+    (and floats with integral values, such as 3.0, are stored as the equal int, as in a set).
+    New elements go into a small unsorted buffer, which is merged into the array when it gets full or the order is needed.
+    This uses about 8 bytes per element, compared with about 50 for SemiSortedSet plus 24 for each float object.
+    Non-numeric elements (and non-integral ones, with an integer typecode) raise TypeError when added.
+    make_semi_sorted_set chooses the class from the initial elements, but a set it returns can't change class later,
+    so only use it for sets that will only ever have elements like the initial ones.
+    The set operations that can add elements from others (union, symmetric_difference and the operators)
+    return a set of whatever class and typecode can hold the result"""
+    BUFFER_SIZE = 1024
+
+    def __init__(self, iterable=None, typecode="d"):
+        self.lock = threading.RLock()
+        self.typecode = typecode
+        self._array = array.array(typecode)
+        # whether self._array is being iterated over or has been returned by snapshot, and must be copied before being changed
+        self._array_shared = False
+        self._buffer = set()
+        if iterable is not None:
+            self.bulk_add(iterable)
+
+    def __reduce__(self):
+        return (self.__class__, (list(self), self.typecode))
+
+    @classmethod
+    def _from_iterable(cls, iterable):
+        """used by the set operators to build their result"""
+        return make_semi_sorted_set(iterable)
+
+    def _convert(self, element):
+        """returns element as stored in the array, raising TypeError if it can't be (including numbers out of the typecode's range)"""
+        if self.typecode in _integer_typecodes:
+            if not isinstance(element, numbers.Integral):
+                if not (isinstance(element, numbers.Real) and _is_integral(element)):
+                    raise TypeError("%s with typecode %r can only contain integers, not %r" % (self.__class__.__name__, self.typecode, element))
+            element = int(element)
+            minimum, maximum = _integer_range(self.typecode)
+            if not minimum <= element <= maximum:
+                raise TypeError("%s with typecode %r can't contain %r, which is out of range" % (self.__class__.__name__, self.typecode, element))
+            return element
+        if not isinstance(element, numbers.Real):
+            raise TypeError("%s can only contain numbers, not %r" % (self.__class__.__name__, element))
+        try:
+            element = float(element)
+        except OverflowError:
+            raise TypeError("%s can't contain %r, which is too large for a float" % (self.__class__.__name__, element))
+        if element != element:
+            raise ValueError("%s can't contain NaN, as it can't be ordered" % self.__class__.__name__)
+        return element
+
+    def _own_array(self):
+        """internal method returning self._array, first replacing it with a copy if it is shared. not to be called without holding self.lock"""
+        if self._array_shared:
+            self._array = array.array(self.typecode, self._array)
+            self._array_shared = False
+        return self._array
+
+    def _replace_array(self, values):
+        """internal method for replacing the contents of the array. not to be called without holding self.lock"""
+        self._array = array.array(self.typecode, values)
+        self._array_shared = False
+
+    def _array_index(self, element):
+        """returns the index of element in the array, or None if it isn't there"""
+        position = bisect.bisect_left(self._array, element)
+        if position < len(self._array) and self._array[position] == element:
+            return position
+        return None
+
+    def _merge_buffer(self):
+        """internal method for merging the insert buffer into the sorted array. not to be called without holding self.lock"""
+        if not self._buffer:
+            return
+        new_elements = sorted(self._buffer)
+        if not self._array or self._array[-1] < new_elements[0]:
+            self._own_array().extend(array.array(self.typecode, new_elements))
+        elif len(new_elements) < 32:
+            current = self._own_array()
+            for element in new_elements:
+                current.insert(bisect.bisect_left(current, element), element)
+        else:
+            # sort detects the two sorted runs, so this is a linear merge
+            merged = self._array.tolist()
+            merged.extend(new_elements)
+            merged.sort()
+            self._replace_array(merged)
+        # only cleared once the elements are in the array, so that none are lost if merging fails
+        self._buffer = set()
+
+    def __contains__(self, element):
+        try:
+            element = self._convert(element)
+        except (TypeError, ValueError):
+            return False
+        with self.lock:
+            return element in self._buffer or self._array_index(element) is not None
+
+    @Decorators.SelfLocking.runwithlock
+    def __len__(self):
+        return len(self._array) + len(self._buffer)
+
+    @Decorators.SelfLocking.runwithlock
+    def snapshot(self):
+        """Returns the array of elements in sorted order, which must not be modified.
+        Changes to the set afterwards are made to a copy of the array"""
+        self._merge_buffer()
+        self._array_shared = True
+        return self._array
+
+    def __iter__(self):
+        """Iterates over a snapshot of the elements, in sorted order"""
+        return iter(self.snapshot())
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, list(self))
+
+    @Decorators.SelfLocking.runwithlock
+    def add(self, element):
+        """Add an element to a set. This has no effect if the element is already present."""
+        element = self._convert(element)
+        if element not in self._buffer and self._array_index(element) is None:
+            self._buffer.add(element)
+            if len(self._buffer) >= self.BUFFER_SIZE:
+                self._merge_buffer()
+
+    @Decorators.SelfLocking.runwithlock
+    def discard(self, element):
+        """Remove an element from a set if it is a member. If the element is not a member, do nothing."""
+        try:
+            element = self._convert(element)
+        except (TypeError, ValueError):
+            return
+        if element in self._buffer:
+            self._buffer.discard(element)
         else:
-            new_function = Decorators.SelfLocking.runwithlock(set_function)
-        new_function = Decorators.wraptimer(new_function)
-        setattr(SemiSortedSet, function_name, new_function)
+            position = self._array_index(element)
+            if position is not None:
+                del self._own_array()[position]
+
+    @Decorators.SelfLocking.runwithlock
+    def pop(self):
+        """Remove and return the largest element. Raises KeyError if the set is empty."""
+        self._merge_buffer()
+        if not self._array:
+            raise KeyError("pop from an empty set")
+        return self._own_array().pop()
 
-# Set up function wrapping, and clean up the setup method
-_wrap_set_methods()
-del _wrap_set_methods
+    @Decorators.SelfLocking.runwithlock
+    def clear(self):
+        """Remove all elements from this set."""
+        self._replace_array([])
+        self._buffer = set()
+
+    @Decorators.SelfLocking.runwithlock
+    def copy(self):
+        """makes a copy of this set (with a new lock)"""
+        self._merge_buffer()
+        new_self = self.__class__(typecode=self.typecode)
+        new_self._array = array.array(self.typecode, self._array)
+        return new_self
+
+    @Decorators.SelfLocking.runwithlock
+    def bulk_add(self, iterable, presorted=False):
+        """Adds all the elements in iterable, merging them into the array at once.
+        presorted is accepted for compatibility with SemiSortedSet; the merge is linear for sorted input anyway"""
+        self._merge_buffer()
+        self._buffer = set(self._convert(element) for element in iterable)
+        if self._array:
+            self._buffer = set(element for element in self._buffer if self._array_index(element) is None)
+        self._merge_buffer()
+
+    @Decorators.SelfLocking.runwithlock
+    def bulk_discard(self, iterable):
+        """Removes all the elements in iterable that are in the set"""
+        removed = set()
+        for element in iterable:
+            try:
+                removed.add(self._convert(element))
+            except (TypeError, ValueError):
+                pass
+        self._buffer.difference_update(removed)
+        if len(removed) < 32:
+            for element in removed:
+                position = self._array_index(element)
+                if position is not None:
+                    del self._own_array()[position]
+        else:
+            self._replace_array([element for element in self._array if element not in removed])
+
+    def update(self, *others):
+        """Update a set with the union of itself and others."""
+        self.bulk_add(itertools.chain(*others))
+
+    def difference_update(self, *others):
+        """Remove all elements of other sets from this set."""
+        self.bulk_discard(itertools.chain(*others))
+
+    @Decorators.SelfLocking.runwithlock
+    def intersection_update(self, *others):
+        """Update a set with the intersection of itself and others."""
+        others = [_as_set(other) for other in others]
+        self.bulk_discard([element for element in self if not all(element in other for other in others)])
+
+    @Decorators.SelfLocking.runwithlock
+    def symmetric_difference_update(self, other):
+        """Update a set with the symmetric difference of itself and another."""
+        other = _as_set(other)
+        added = [element for element in other if element not in self]
+        self.bulk_discard(other)
+        self.bulk_add(added)
+
+    def union(self, *others):
+        """Return the union of sets as a new set."""
+        return self._widened(itertools.chain(self, *others))
+
+    def intersection(self, *others):
+        """Return the intersection of sets as a new set."""
+        others = [_as_set(other) for other in others]
+        return self.__class__([element for element in self if all(element in other for other in others)], self.typecode)
+
+    def difference(self, *others):
+        """Return the difference of this set and others as a new set."""
+        others = [_as_set(other) for other in others]
+        return self.__class__([element for element in self if not any(element in other for other in others)], self.typecode)
+
+    def symmetric_difference(self, other):
+        """Return the symmetric difference of two sets as a new set."""
+        other = _as_set(other)
+        return self._widened(itertools.chain([element for element in self if element not in other],
+                                             [element for element in other if element not in self]))
+
+    def issubset(self, other):
+        """Report whether another set contains this set."""
+        other = _as_set(other)
+        return all(element in other for element in self)
+
+    def issuperset(self, other):
+        """Report whether this set contains another set."""
+        return all(element in self for element in other)
+
+    def _widened(self, iterable):
+        """returns a new set of the elements, with the same typecode if they fit it, or as chosen by make_semi_sorted_set otherwise"""
+        elements = list(iterable)
+        try:
+            return self.__class__(elements, self.typecode)
+        except (TypeError, ValueError):
+            return make_semi_sorted_set(elements)
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Returns a context manager that holds the lock while making many changes to the set"""
+        with self.lock:
+            yield self
+
+    @Decorators.SelfLocking.runwithlock
+    def min(self):
+        """Returns the minimum element in the set"""
+        self._merge_buffer()
+        if not self._array:
+            raise ValueError("No elements in set")
+        return self._array[0]
 
+    @Decorators.SelfLocking.runwithlock
+    def max(self):
+        """Returns the maximum element in the set"""
+        self._merge_buffer()
+        if not self._array:
+            raise ValueError("No elements in set")
+        return self._array[-1]
+
+    def _remove_range(self, comparator, lower, inclusive):
+        """internal method for removing the items below comparator (if lower) or above it. not to be called without holding self.lock"""
+        self._merge_buffer()
+        if lower:
+            position = (bisect.bisect_right if inclusive else bisect.bisect_left)(self._array, comparator)
+            if position:
+                del self._own_array()[:position]
+        else:
+            position = (bisect.bisect_left if inclusive else bisect.bisect_right)(self._array, comparator)
+            if position < len(self._array):
+                del self._own_array()[position:]
+
+    @Decorators.SelfLocking.runwithlock
+    def remove_cmp_op(self, cmp_op, comparator):
+        """Removes all items in the set that satisfy cmp_op(item, comparator)"""
+        if cmp_op in _range_removal_bounds:
+            self._remove_range(comparator, *_range_removal_bounds[cmp_op])
+        else:
+            self._merge_buffer()
+            self._replace_array([item for item in self._array if not cmp_op(item, comparator)])
+
+    @Decorators.SelfLocking.runwithlock
+    def remove_lt(self, minimum):
+        """Removes all items in the set that are less than the given minimum"""
+        self._remove_range(minimum, True, False)
+
+    @Decorators.SelfLocking.runwithlock
+    def remove_le(self, minimum):
+        """Removes all items in the set that are less than or equal to the given minimum"""
+        self._remove_range(minimum, True, True)
+
+    @Decorators.SelfLocking.runwithlock
+    def remove_gt(self, maximum):
+        """Removes all items in the set that are greater than the given maximum"""
+        self._remove_range(maximum, False, False)
+
+    @Decorators.SelfLocking.runwithlock
+    def remove_ge(self, maximum):
+        """Removes all items in the set that are greater than or equal to the given maximum"""
+        self._remove_range(maximum, False, True)
+
+    @Decorators.SelfLocking.runwithlock
+    def irange(self, minimum=None, maximum=None, inclusive=(True, True), reverse=False):
+        """Returns an iterator over the items between minimum and maximum in sorted order (None meaning unbounded).
+           inclusive is a pair of flags saying whether items equal to minimum and maximum are included"""
+        self._merge_buffer()
+        include_min, include_max = inclusive
+        start = 0 if minimum is None else (bisect.bisect_left if include_min else bisect.bisect_right)(self._array, minimum)
+        end = len(self._array) if maximum is None else (bisect.bisect_right if include_max else bisect.bisect_left)(self._array, maximum)
+        items = self._array[start:end].tolist() if start < end else []
+        if reverse:
+            items.reverse()
+        return iter(items)
+
+    @Decorators.SelfLocking.runwithlock
+    def bisect_left(self, element):
+        """Returns the number of items in the set less than element"""
+        self._merge_buffer()
+        return bisect.bisect_left(self._array, element)
+
+    @Decorators.SelfLocking.runwithlock
+    def bisect_right(self, element):
+        """Returns the number of items in the set less than or equal to element"""
+        self._merge_buffer()
+        return bisect.bisect_right(self._array, element)
+
+_integer_typecodes = ("b", "B", "h", "H", "i", "I", "l", "L", "q", "Q")
+_integer_ranges = {}
+
+def _integer_range(typecode):
+    """returns the minimum and maximum of the ints an array with the given integer typecode can hold"""
+    if typecode not in _integer_ranges:
+        bits = array.array(typecode).itemsize * 8
+        if typecode.isupper():
+            _integer_ranges[typecode] = (0, 2 ** bits - 1)
+        else:
+            _integer_ranges[typecode] = (-2 ** (bits - 1), 2 ** (bits - 1) - 1)
+    return _integer_ranges[typecode]
+
+def _is_integral(element):
+    """returns whether the real number element has an integral value"""
+    try:
+        return float(element).is_integer()
+    except OverflowError:
+        return element == int(element)
+
+def _as_set(iterable):
+    """returns iterable if it has fast membership tests, or a set of its elements otherwise"""
+    if isinstance(iterable, (Set, dict)):
+        return iterable
+    return set(iterable)
+
+def make_semi_sorted_set(iterable=None, typecode=None):
+    """Returns a NumericSemiSortedSet if all the elements are numbers (storing ints if they are all ints, otherwise floats),
+    or a SemiSortedSet otherwise (including when there are no elements, unless typecode is given,
+    and when the numbers can't be stored in an array, such as ints beyond 64 bits).
+    The class is chosen from these elements only: adding elements that don't fit it later raises TypeError"""
+    elements = list(iterable) if iterable is not None else []
+    if typecode is not None:
+        return NumericSemiSortedSet(elements, typecode)
+    if elements and all(isinstance(element, numbers.Real) for element in elements):
+        typecode = "q" if all(isinstance(element, numbers.Integral) for element in elements) else "d"
+        try:
+            return NumericSemiSortedSet(elements, typecode)
+        except (TypeError, ValueError):
+            pass
+    return SemiSortedSet(elements)
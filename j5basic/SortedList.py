@@ -0,0 +1,309 @@
+#!/usr/bin/env python
+
+"""A list that keeps its items sorted, stored in chunks so that inserts and removals stay cheap for large lists"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+from future import standard_library
+standard_library.install_aliases()
+from builtins import *
+from builtins import object
+import bisect
+import itertools
+
+class SortedList(object):
+    """Keeps items in sorted order in a list of sorted chunks, each of at most 2*load items.
+       Adding or removing an item costs O(log n) comparisons plus moving at most 2*load items in memory.
+       Items must be totally ordered; duplicates are allowed, but callers like SemiSortedSet don't add them.
+       snapshot() returns a read-only view that shares the chunks; a chunk is only copied when it is next changed.
+       This is not thread-safe on its own - the owner is responsible for locking"""
+    DEFAULT_LOAD = 500
+
+    def __init__(self, iterable=None, load=None):
+        self._load = load or self.DEFAULT_LOAD
+        self._lists = []
+        self._maxes = []
+        self._len = 0
+        # ids of chunks that are shared with snapshots, and must be copied before being changed
+        self._shared = set()
+        if iterable is not None:
+            self._reset(sorted(iterable))
+
+    def _reset(self, values):
+        """replaces the contents with the given list, which must already be sorted"""
+        load = self._load
+        self._lists = [values[start:start+load] for start in range(0, len(values), load)]
+        self._maxes = [chunk[-1] for chunk in self._lists]
+        self._len = len(values)
+        self._shared = set()
+
+    def _own(self, pos):
+        """returns the chunk at pos, first replacing it with a copy if it is shared with a snapshot"""
+        chunk = self._lists[pos]
+        if self._shared and id(chunk) in self._shared:
+            self._shared.discard(id(chunk))
+            chunk = self._lists[pos] = chunk[:]
+        return chunk
+
+    def snapshot(self):
+        """returns a read-only SortedListSnapshot of the current items, costing O(n/load).
+           Later changes to this list copy the chunks they change, so don't affect the snapshot"""
+        self._shared = set(id(chunk) for chunk in self._lists)
+        return SortedListSnapshot(self._lists[:], self._maxes[:], self._len, self._load)
+
+    def __len__(self):
+        return self._len
+
+    def __bool__(self):
+        return self._len > 0
+
+    __nonzero__ = __bool__
+
+    def __iter__(self):
+        return itertools.chain.from_iterable(self._lists)
+
+    def __reversed__(self):
+        return itertools.chain.from_iterable(reversed(chunk) for chunk in reversed(self._lists))
+
+    def __contains__(self, value):
+        pos = bisect.bisect_left(self._maxes, value)
+        if pos == len(self._maxes):
+            return False
+        chunk = self._lists[pos]
+        return chunk[bisect.bisect_left(chunk, value)] == value
+
+    def __getitem__(self, index):
+        """returns the item at the given position in sorted order (slices are not supported)"""
+        if index == 0 and self._lists:
+            return self._lists[0][0]
+        if index == -1 and self._lists:
+            return self._lists[-1][-1]
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError("SortedList index out of range")
+        for chunk in self._lists:
+            if index < len(chunk):
+                return chunk[index]
+            index -= len(chunk)
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, list(self))
+
+    def copy(self):
+        """returns a copy of this list (the items themselves are not copied)"""
+        new_list = self.__class__(load=self._load)
+        new_list._lists = [chunk[:] for chunk in self._lists]
+        new_list._maxes = self._maxes[:]
+        new_list._len = self._len
+        return new_list
+
+    def clear(self):
+        self._lists = []
+        self._maxes = []
+        self._len = 0
+        self._shared = set()
+
+    def add(self, value):
+        """inserts value in its sorted position"""
+        maxes = self._maxes
+        if not maxes:
+            self._lists.append([value])
+            maxes.append(value)
+        else:
+            pos = bisect.bisect_right(maxes, value)
+            if pos == len(maxes):
+                pos -= 1
+                self._own(pos).append(value)
+                maxes[pos] = value
+            else:
+                bisect.insort(self._own(pos), value)
+            if len(self._lists[pos]) > 2 * self._load:
+                self._split(pos)
+        self._len += 1
+
+    def _split(self, pos):
+        """splits an oversized chunk in half"""
+        chunk = self._lists[pos]
+        half = len(chunk) // 2
+        self._lists[pos:pos+1] = [chunk[:half], chunk[half:]]
+        self._maxes[pos:pos+1] = [chunk[half-1], chunk[-1]]
+
+    def _delete(self, pos, idx):
+        """deletes the item at index idx in chunk pos, removing or merging undersized chunks"""
+        chunk = self._own(pos)
+        del chunk[idx]
+        self._len -= 1
+        if not chunk:
+            del self._lists[pos]
+            del self._maxes[pos]
+            return
+        self._maxes[pos] = chunk[-1]
+        if len(chunk) < self._load // 2 and len(self._lists) > 1:
+            # merge with a neighbour, splitting again if that makes it too big
+            if pos == 0:
+                pos = 1
+            self._own(pos-1).extend(self._lists[pos])
+            self._maxes[pos-1] = self._maxes[pos]
+            del self._lists[pos]
+            del self._maxes[pos]
+            if len(self._lists[pos-1]) > 2 * self._load:
+                self._split(pos-1)
+
+    def discard(self, value):
+        """removes value if present, returning whether it was found"""
+        pos = bisect.bisect_left(self._maxes, value)
+        if pos == len(self._maxes):
+            return False
+        chunk = self._lists[pos]
+        idx = bisect.bisect_left(chunk, value)
+        if chunk[idx] != value:
+            return False
+        self._delete(pos, idx)
+        return True
+
+    def remove(self, value):
+        """removes value, raising ValueError if it isn't present"""
+        if not self.discard(value):
+            raise ValueError("%r not in SortedList" % (value,))
+
+    def _locate(self, value, right=False):
+        """returns the (chunk, index) position of the first item greater than value (if right) or not less than value"""
+        maxes = self._maxes
+        find = bisect.bisect_right if right else bisect.bisect_left
+        pos = find(maxes, value)
+        if pos == len(maxes):
+            return (pos, 0)
+        return (pos, find(self._lists[pos], value))
+
+    def _rank(self, location):
+        pos, idx = location
+        return sum(len(chunk) for chunk in self._lists[:pos]) + idx
+
+    def bisect_left(self, value):
+        """returns the number of items less than value (the index at which value would be inserted before equal items)"""
+        return self._rank(self._locate(value))
+
+    def bisect_right(self, value):
+        """returns the number of items less than or equal to value (the index at which value would be inserted after equal items)"""
+        return self._rank(self._locate(value, right=True))
+
+    def _range_locations(self, minimum, maximum, inclusive):
+        """returns the start and end positions of the items between minimum and maximum (None meaning unbounded)"""
+        include_min, include_max = inclusive
+        start = (0, 0) if minimum is None else self._locate(minimum, right=not include_min)
+        end = (len(self._lists), 0) if maximum is None else self._locate(maximum, right=include_max)
+        return start, end
+
+    def irange(self, minimum=None, maximum=None, inclusive=(True, True), reverse=False):
+        """iterates over the items between minimum and maximum (None meaning unbounded).
+           inclusive is a pair of flags saying whether items equal to minimum and maximum are included"""
+        (spos, sidx), (epos, eidx) = self._range_locations(minimum, maximum, inclusive)
+        if (spos, sidx) >= (epos, eidx):
+            return iter(())
+        lists = self._lists
+        if spos == epos:
+            slices = [lists[spos][sidx:eidx]]
+        else:
+            slices = [lists[spos][sidx:]] + lists[spos+1:epos]
+            if epos < len(lists):
+                slices.append(lists[epos][:eidx])
+        if reverse:
+            return itertools.chain.from_iterable(reversed(chunk) for chunk in reversed(slices))
+        return itertools.chain.from_iterable(slices)
+
+    def pop_range(self, minimum=None, maximum=None, inclusive=(True, True)):
+        """removes the items between minimum and maximum (as for irange), returning them in a list.
+           This costs O(log n) plus the number of items removed"""
+        (spos, sidx), (epos, eidx) = self._range_locations(minimum, maximum, inclusive)
+        if (spos, sidx) >= (epos, eidx):
+            return []
+        lists, maxes = self._lists, self._maxes
+        if spos == epos:
+            removed = lists[spos][sidx:eidx]
+            del self._own(spos)[sidx:eidx]
+        else:
+            removed = lists[spos][sidx:]
+            del self._own(spos)[sidx:]
+            for chunk in lists[spos+1:epos]:
+                removed.extend(chunk)
+            if epos < len(lists):
+                removed.extend(lists[epos][:eidx])
+                del self._own(epos)[:eidx]
+            del lists[spos+1:epos]
+            del maxes[spos+1:epos]
+        # the chunks at the edges of the range may now be empty or have a new maximum
+        for pos in reversed(range(spos, min(spos+2, len(lists)))):
+            if lists[pos]:
+                maxes[pos] = lists[pos][-1]
+            else:
+                del lists[pos]
+                del maxes[pos]
+        self._len -= len(removed)
+        return removed
+
+    def update(self, iterable, presorted=False):
+        """adds all the items in iterable, rebuilding the chunks if that is cheaper than inserting one at a time.
+           If presorted is set, the items must already be in sorted order; they are then merged in linear time"""
+        values = list(iterable)
+        if not values:
+            return
+        if not presorted:
+            values.sort()
+        if not self._maxes or not values[0] < self._maxes[-1]:
+            self._extend(values)
+        elif len(values) * 4 > self._len:
+            # sort detects the two sorted runs, so this is a linear merge
+            merged = list(self)
+            merged.extend(values)
+            merged.sort()
+            self._reset(merged)
+        else:
+            for value in values:
+                self.add(value)
+
+    def _extend(self, values):
+        """appends sorted values that are all at least as large as the existing items"""
+        load = self._load
+        start = 0
+        if self._lists and len(self._lists[-1]) < load:
+            start = load - len(self._lists[-1])
+            self._own(len(self._lists) - 1).extend(values[:start])
+            self._maxes[-1] = self._lists[-1][-1]
+        for chunk_start in range(start, len(values), load):
+            chunk = values[chunk_start:chunk_start+load]
+            self._lists.append(chunk)
+            self._maxes.append(chunk[-1])
+        self._len += len(values)
+
+    def difference_update(self, iterable):
+        """removes all occurrences of the items in iterable, rebuilding the chunks if that is cheaper than removing one at a time"""
+        values = set(iterable)
+        if len(values) * 4 > self._len:
+            self._reset([value for value in self if value not in values])
+        else:
+            for value in values:
+                while self.discard(value):
+                    pass
+
+class SortedListSnapshot(SortedList):
+    """A read-only SortedList sharing its chunks with the SortedList it was taken from"""
+    def __init__(self, lists, maxes, length, load):
+        super(SortedListSnapshot, self).__init__(load=load)
+        self._lists = lists
+        self._maxes = maxes
+        self._len = length
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("%s is read-only" % self.__class__.__name__)
+
+    add = discard = remove = update = difference_update = pop_range = clear = _read_only
+
+    def copy(self):
+        """returns a modifiable SortedList with the same items"""
+        new_list = SortedList(load=self._load)
+        new_list._lists = [chunk[:] for chunk in self._lists]
+        new_list._maxes = self._maxes[:]
+        new_list._len = self._len
+        return new_list
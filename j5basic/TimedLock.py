@@ -7,15 +7,130 @@ from __future__ import unicode_literals
 from future import standard_library
 standard_library.install_aliases()
 from builtins import *
+from j5basic import Decorators
+from j5basic import Histogram
+from j5basic import LockOrder
+import _thread
+import collections
+import sys
 import threading
 import time
+import weakref
+
+class LockStats(object):
+    """Contention statistics for an instrumented TimedLock: histograms and totals of how long acquires waited
+    and how long the lock was held, counts of timed out and failed non-blocking acquires,
+    and who holds the lock now, where from and since when.
+    Reentrant acquires are not counted separately"""
+    def __init__(self):
+        self._mutex = threading.Lock()
+        self.acquisitions = 0
+        self.timeouts = 0
+        self.busy = 0
+        self.wait_times = Histogram.Histogram()
+        self.hold_times = Histogram.Histogram()
+        self.owner_name = None
+        self.acquired_site = None
+        self.acquired_time = None
+
+    def record_acquire(self, wait_time, owner_name, site, now):
+        with self._mutex:
+            self.acquisitions += 1
+            self.wait_times.record(wait_time)
+            self.owner_name, self.acquired_site, self.acquired_time = owner_name, site, now
+
+    def record_failure(self, timed):
+        with self._mutex:
+            if timed:
+                self.timeouts += 1
+            else:
+                self.busy += 1
+
+    def record_release(self, now):
+        with self._mutex:
+            hold_time = now - self.acquired_time
+            self.hold_times.record(hold_time)
+            self.owner_name = self.acquired_site = self.acquired_time = None
+
+    def held_for(self, now):
+        """returns how long the lock has been held, or None if it isn't held"""
+        acquired_time = self.acquired_time
+        return None if acquired_time is None else now - acquired_time
+
+    def as_dict(self, now):
+        """returns the statistics as a dictionary of plain values, with held_for measured up to now"""
+        with self._mutex:
+            site = self.acquired_site
+            return {
+                "acquisitions": self.acquisitions,
+                "timeouts": self.timeouts,
+                "busy": self.busy,
+                "histogram_bounds": list(self.wait_times.bounds),
+                "wait_histogram": list(self.wait_times.counts),
+                "hold_histogram": list(self.hold_times.counts),
+                "total_wait": self.wait_times.total,
+                "max_wait": self.wait_times.maximum,
+                "total_hold": self.hold_times.total,
+                "max_hold": self.hold_times.maximum,
+                "owner": self.owner_name,
+                "acquired_site": "%s:%d in %s" % site if site else None,
+                "held_for": self.held_for(now),
+            }
+
+# the instrumented locks, for dump_lock_stats and find_long_holders
+_instrumented_locks = weakref.WeakSet()
+
+def instrumented_locks():
+    """returns a list of the instrumented TimedLocks that still exist"""
+    return list(_instrumented_locks)
+
+def dump_lock_stats():
+    """returns a list of dictionaries with the name and LockStats of each instrumented lock, sorted by name"""
+    dumps = []
+    for lock in instrumented_locks():
+        lock_dump = lock.stats.as_dict(lock._time_function())
+        lock_dump["name"] = lock.name
+        dumps.append(lock_dump)
+    return sorted(dumps, key=lambda lock_dump: lock_dump["name"])
+
+def find_long_holders(min_held):
+    """returns the dump_lock_stats entries for the instrumented locks that have been held for at least min_held seconds,
+    longest first"""
+    holders = [lock_dump for lock_dump in dump_lock_stats() if lock_dump["held_for"] is not None and lock_dump["held_for"] >= min_held]
+    return sorted(holders, key=lambda lock_dump: -lock_dump["held_for"])
+
+def _acquisition_site():
+    """returns a CallingFrameInfo for the frame that called into this module"""
+    this_file = _acquisition_site.__code__.co_filename
+    frame = sys._getframe(1)
+    while frame is not None and frame.f_code.co_filename == this_file:
+        frame = frame.f_back
+    return None if frame is None else Decorators.decorator_helpers.frameinfo(frame)
 
 class TimedLock(threading._RLock):
-    """A lock that allows waiting"""
-    def __init__(self, time_function=None):
+    """A lock that allows waiting
+    If fair is set, waiting threads get the lock in the order they asked for it:
+    each waiter waits on its own event, and release hands the lock straight to the first waiter,
+    so only that thread is woken and later arrivals can't take the lock ahead of it
+    If instrument is set, the lock keeps LockStats in stats, and is listed by dump_lock_stats under the given name"""
+    def __init__(self, time_function=None, fair=False, instrument=False, name=None):
+        self.name = name or "TimedLock at %s" % hex(id(self))
+        self.stats = None
+        if instrument:
+            self.stats = LockStats()
+            _instrumented_locks.add(self)
         self._wait_event = threading.Event()
         self._wait_event.set()
         self._time_function = time_function or time.time
+        self._fair = fair
+        # in fair mode, guards the owner, count and queue of (thread ident, event) waiters
+        # (these are kept apart from the base class internals, which are name-mangled on Python 2)
+        self._fair_mutex = threading.Lock()
+        self._fair_owner = None
+        self._fair_count = 0
+        self._waiters = collections.deque()
+        # how many times the owner has acquired an instrumented lock, so that only the final release records the hold time
+        self._hold_depth = 0
         super(TimedLock, self).__init__()
 
     def acquire(self, wait=True):
@@ -23,6 +138,36 @@ class TimedLock(threading._RLock):
         If wait is True (default), block until the lock is available
         If wait is a number, wait the given number of seconds before giving up
         If wait is non-True (None, False, or zero), acquire non-blocking"""
+        if not LockOrder.enabled:
+            return self._instrumented_acquire(wait)
+        if wait:
+            LockOrder.before_acquire(self)
+        acquired = self._instrumented_acquire(wait)
+        if acquired:
+            LockOrder.acquired(self)
+        return acquired
+
+    def _instrumented_acquire(self, wait):
+        """acquires the lock as for acquire, recording LockStats if the lock is instrumented"""
+        if self.stats is None:
+            return self._acquire(wait)
+        if self._is_owned():
+            self._acquire(wait)
+            self._hold_depth += 1
+            return True
+        start_time = self._time_function()
+        acquired = self._acquire(wait)
+        if acquired:
+            self._hold_depth = 1
+            now = self._time_function()
+            self.stats.record_acquire(now - start_time, threading.currentThread().getName(), _acquisition_site(), now)
+        else:
+            self.stats.record_failure(timed=bool(wait))
+        return acquired
+
+    def _acquire(self, wait):
+        if self._fair:
+            return self._fair_acquire(wait)
         name = threading.currentThread().getName()
         if wait is True:
             super(TimedLock, self).acquire(True)
@@ -44,8 +189,87 @@ class TimedLock(threading._RLock):
                 elapsed_time = self._time_function() - start_time
             return False
 
+    def __enter__(self):
+        return self.acquire()
+
     def release(self):
         """Releases the lock and notifies any waiting threads"""
+        if LockOrder.enabled:
+            LockOrder.released(self)
+        if self.stats is not None and self._is_owned():
+            self._hold_depth -= 1
+            if not self._hold_depth:
+                self.stats.record_release(self._time_function())
+        if self._fair:
+            return self._fair_release()
         super(TimedLock, self).release()
         self._wait_event.set()
 
+    def _fair_acquire(self, wait):
+        """acquires the lock in fair mode, queueing behind any other waiters"""
+        me = _thread.get_ident()
+        with self._fair_mutex:
+            if self._fair_owner == me:
+                self._fair_count += 1
+                return True
+            if self._fair_owner is None and not self._waiters:
+                self._fair_owner, self._fair_count = me, 1
+                return True
+            if not wait:
+                return False
+            waiter = threading.Event()
+            self._waiters.append((me, waiter))
+        # the lock is handed over by setting the event, so a woken waiter already owns it
+        if wait is True:
+            waiter.wait()
+            return True
+        start_time = self._time_function()
+        elapsed_time = 0
+        while elapsed_time < wait:
+            if waiter.wait(wait - elapsed_time):
+                return True
+            elapsed_time = self._time_function() - start_time
+        with self._fair_mutex:
+            # the lock may have been handed over after the wait timed out
+            if waiter.is_set():
+                return True
+            self._waiters.remove((me, waiter))
+        return False
+
+    def _fair_release(self):
+        """releases the lock in fair mode, handing it to the first waiter if there is one"""
+        with self._fair_mutex:
+            if self._fair_owner != _thread.get_ident():
+                raise RuntimeError("cannot release un-acquired lock")
+            self._fair_count -= 1
+            if self._fair_count:
+                return
+            if self._waiters:
+                owner, waiter = self._waiters.popleft()
+                self._fair_owner, self._fair_count = owner, 1
+                waiter.set()
+            else:
+                self._fair_owner = None
+
+    # Internal methods used by condition variables, which must queue like any other waiter in fair mode
+
+    def _is_owned(self):
+        if not self._fair:
+            return super(TimedLock, self)._is_owned()
+        return self._fair_owner == _thread.get_ident()
+
+    def _release_save(self):
+        if not self._fair:
+            return super(TimedLock, self)._release_save()
+        if self._fair_count == 0:
+            raise RuntimeError("cannot release un-acquired lock")
+        state = (self._fair_count, self._fair_owner)
+        self._fair_count = 1
+        self._fair_release()
+        return state
+
+    def _acquire_restore(self, state):
+        if not self._fair:
+            return super(TimedLock, self)._acquire_restore(state)
+        self._fair_acquire(True)
+        self._fair_count, self._fair_owner = state
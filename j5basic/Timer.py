@@ -9,19 +9,113 @@ standard_library.install_aliases()
 from builtins import *
 from builtins import object
 from past.utils import old_div
+from multiprocessing.pool import ThreadPool
 import datetime_tz
+import heapq
+import itertools
 import logging
 import time
 import threading
 from j5basic import Errors
+from j5basic import Histogram
 
 def to_seconds(timedelta):
     """Converts timedelta to a float number of seconds"""
     return timedelta.days * (24*60*60) + timedelta.seconds + timedelta.microseconds * 0.000001
 
+# a clock that can't jump when the wall clock is changed (time.time on Python 2, which lacks time.monotonic)
+monotonic_time = getattr(time, "monotonic", time.time)
+
+class TimerStats(object):
+    """Statistics for an instrumented Timer: histograms and totals of how late each run started after its scheduled time,
+    and of how long it took, the number of runs that took longer than the timer's resolution, and the number of ticks missed"""
+    def __init__(self):
+        self._mutex = threading.Lock()
+        self.runs = 0
+        self.overruns = 0
+        self.missed_ticks = 0
+        self.latencies = Histogram.Histogram()
+        self.execution_times = Histogram.Histogram()
+
+    def record_run(self, latency, execution_time, overran):
+        with self._mutex:
+            self.runs += 1
+            if overran:
+                self.overruns += 1
+            self.latencies.record(latency)
+            self.execution_times.record(execution_time)
+
+    def record_missed(self, missed_count):
+        with self._mutex:
+            self.missed_ticks += missed_count
+
+    def as_dict(self):
+        """returns the statistics as a dictionary of plain values"""
+        with self._mutex:
+            return {
+                "runs": self.runs,
+                "overruns": self.overruns,
+                "missed_ticks": self.missed_ticks,
+                "histogram_bounds": list(self.latencies.bounds),
+                "latency_histogram": list(self.latencies.counts),
+                "execution_histogram": list(self.execution_times.counts),
+                "total_latency": self.latencies.total,
+                "max_latency": self.latencies.maximum,
+                "mean_latency": old_div(self.latencies.total, self.runs) if self.runs else None,
+                "total_execution": self.execution_times.total,
+                "max_execution": self.execution_times.maximum,
+                "mean_execution": old_div(self.execution_times.total, self.runs) if self.runs else None,
+            }
+
+class DriftCompensator(object):
+    """Waits on an event so as to wake up on time instead of consistently late:
+    it blocks for less time than asked, by the average amount that recent waits have overslept,
+    and then busy waits for the remainder (so for about that average, typically well under a millisecond)"""
+    def __init__(self, weight=0.1):
+        self.weight = weight
+        self.oversleep = 0.0
+
+    def wait(self, event, seconds):
+        """waits on event for up to seconds, returning whether the event was set"""
+        early = min(self.oversleep, seconds)
+        started = monotonic_time()
+        if event.wait(seconds - early):
+            return True
+        woken = monotonic_time()
+        if seconds > early:
+            overslept = max(woken - started - (seconds - early), 0)
+            self.oversleep += self.weight * (overslept - self.oversleep)
+        deadline = started + seconds
+        while woken < deadline:
+            if event.is_set():
+                return True
+            woken = monotonic_time()
+        return False
+
+# what a Timer does with ticks that come due while its target is still running:
+# skip them (as if they had been missed), queue them to run as soon as the target finishes (so every tick runs, late if need be),
+# or run them concurrently on a thread pool (skipping any that come due while max_concurrency runs are already in progress)
+OVERLAP_SKIP = "skip"
+OVERLAP_QUEUE = "queue"
+OVERLAP_CONCURRENT = "concurrent"
+OVERLAP_POLICIES = (OVERLAP_SKIP, OVERLAP_QUEUE, OVERLAP_CONCURRENT)
+
 class Timer(object):
-    """Accurate timer of resolution minimum 1 second - the idea is to guarantee accuracy"""
-    def __init__(self, target, args=None, kwargs=None, resolution=1):
+    """Accurate timer - the idea is to guarantee accuracy. resolution may be a number of seconds (including fractions) or a timedelta
+    By default tick times are timezone-aware datetimes from datetime_tz.datetime_tz.now().
+    If monotonic is set (or a clock is given), they are float seconds from clock (time.monotonic by default),
+    which is cheaper and unaffected by changes to the wall clock; a test can pass a virtual clock, and set interrupt_event after changing it.
+    setup_run and execute_run are given the tick time in the timer's own units; scheduled_datetime converts it to a datetime.
+    If scheduled_time_kwarg is given, the target is passed the scheduled datetime of each run in that keyword argument
+    If compensate_drift is set, start wakes up early by the amount its waits usually oversleep, which matters for sub-second resolutions
+    If instrument is set, the timer keeps TimerStats in stats
+    overlap is one of the OVERLAP_POLICIES, saying what to do with ticks that come due while the target is still running
+    If missed_count_kwarg is given, the target is passed the number of ticks skipped since its last run in that keyword argument,
+    so that it can do their work in one batch"""
+    def __init__(self, target, args=None, kwargs=None, resolution=1, monotonic=False, clock=None, scheduled_time_kwarg=None,
+                 compensate_drift=False, instrument=False, overlap=OVERLAP_SKIP, max_concurrency=4, missed_count_kwarg=None):
+        if overlap not in OVERLAP_POLICIES:
+            raise ValueError("Unknown Timer overlap policy %r" % (overlap,))
         self.interrupt_event = threading.Event()
         self.virtual_time_callback_event = threading.Event()
         self._running = True
@@ -36,6 +130,33 @@ class Timer(object):
             self.resolution = resolution
         else:
             self.resolution = datetime_tz.timedelta(seconds=resolution)
+        self.monotonic = monotonic or clock is not None
+        self.clock = clock or monotonic_time
+        self.scheduled_time_kwarg = scheduled_time_kwarg
+        self.drift_compensator = DriftCompensator() if compensate_drift else None
+        self.stats = TimerStats() if instrument else None
+        self.overlap = overlap
+        self.max_concurrency = max_concurrency
+        self.missed_count_kwarg = missed_count_kwarg
+        # the number of ticks skipped since the last run, which is only changed by the thread scheduling the timer
+        self._missed_count = 0
+        self._concurrency_slots = threading.BoundedSemaphore(max_concurrency)
+        if self.monotonic:
+            self.now = self.clock
+            self.interval = to_seconds(self.resolution)
+        else:
+            self.now = datetime_tz.datetime_tz.now
+            self.interval = self.resolution
+
+    def seconds(self, interval):
+        """Converts a difference between two tick times to a float number of seconds"""
+        return interval if self.monotonic else to_seconds(interval)
+
+    def scheduled_datetime(self, target_time):
+        """Returns the given tick time as a datetime_tz"""
+        if not self.monotonic:
+            return target_time
+        return datetime_tz.datetime_tz.now() - datetime_tz.timedelta(seconds=self.clock() - target_time)
 
     def get_stop(self):
         return self._running
@@ -47,42 +168,204 @@ class Timer(object):
     stop = property(get_stop, set_stop)
 
     def start(self):
-        nexttime = datetime_tz.datetime_tz.now()
-        while self._running:
-            try:
-                currenttime = datetime_tz.datetime_tz.now()
-                if nexttime < currenttime:
-                    first_missed_time = nexttime
-                    missed_time_delta = currenttime - first_missed_time
-                    missed_count = int(old_div(to_seconds(missed_time_delta),to_seconds(self.resolution)))
-                    if missed_count > 0:
-                        nexttime += missed_count * self.resolution
-                        logging.info("Timer function missed %04d ticks between %s and %s (at %s) - running behind schedule" % (missed_count+1, first_missed_time, nexttime, currenttime))
-                    nexttime += self.resolution
-                else:
-                    waittime = nexttime - currenttime
-                    waitseconds = to_seconds(waittime)
-                    self.interrupt_event.wait(waitseconds)
-                    self.interrupt_event.clear()
-                    currenttime = datetime_tz.datetime_tz.now()
-                if self._running and nexttime <= currenttime:
-                    self.setup_run(nexttime)
-                    self.virtual_time_callback_event.set()
-                    self.execute_run(nexttime)
-                    nexttime = nexttime + self.resolution
-                else:
-                    self.virtual_time_callback_event.set()
-            except Exception as e:
-                logging.error("Error in Timer thread: %s", Errors.error_to_str(e))
-                logging.error(Errors.traceback_str())
+        pool = ThreadPool(self.max_concurrency) if self.overlap == OVERLAP_CONCURRENT else None
+        # the first run is a full interval after starting, so that it isn't counted as having been missed
+        nexttime = self.now() + self.interval
+        try:
+            while self._running:
+                try:
+                    currenttime = self.now()
+                    if nexttime < currenttime:
+                        if self.overlap != OVERLAP_QUEUE:
+                            nexttime = self.skip_missed(nexttime, currenttime)
+                    else:
+                        waitseconds = self.seconds(nexttime - currenttime)
+                        if self.drift_compensator is not None:
+                            self.drift_compensator.wait(self.interrupt_event, waitseconds)
+                        else:
+                            self.interrupt_event.wait(waitseconds)
+                        self.interrupt_event.clear()
+                        currenttime = self.now()
+                    if self._running and nexttime <= currenttime:
+                        if pool is None:
+                            self.run(nexttime, self.take_missed_count())
+                        else:
+                            self.dispatch(pool, nexttime)
+                        nexttime = nexttime + self.interval
+                    else:
+                        self.virtual_time_callback_event.set()
+                except Exception as e:
+                    logging.error("Error in Timer thread: %s", Errors.error_to_str(e))
+                    logging.error(Errors.traceback_str())
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+    def skip_missed(self, nexttime, currenttime):
+        """Returns the first tick time after currenttime, given that the tick at nexttime has already been missed"""
+        first_missed_time = nexttime
+        missed_time_delta = currenttime - first_missed_time
+        missed_count = int(old_div(self.seconds(missed_time_delta),self.seconds(self.interval)))
+        self.record_missed(missed_count + 1)
+        if missed_count > 0:
+            nexttime += missed_count * self.interval
+            logging.info("Timer function missed %04d ticks between %s and %s (at %s) - running behind schedule" % (missed_count+1, first_missed_time, nexttime, currenttime))
+        return nexttime + self.interval
+
+    def record_missed(self, missed_count):
+        """Notes that missed_count ticks have been skipped"""
+        self._missed_count += missed_count
+        if self.stats is not None:
+            self.stats.record_missed(missed_count)
+
+    def take_missed_count(self):
+        """Returns the number of ticks skipped since this was last called, for passing to run"""
+        missed_count, self._missed_count = self._missed_count, 0
+        return missed_count
+
+    def dispatch(self, pool, target_time):
+        """Runs the tick at target_time on the given thread pool, unless max_concurrency runs are already in progress,
+        in which case the tick is skipped. Returns whether it was dispatched"""
+        if not self._concurrency_slots.acquire(False):
+            self.record_missed(1)
+            return False
+        pool.apply_async(self._run_concurrently, (target_time, self.take_missed_count()))
+        return True
+
+    def _run_concurrently(self, target_time, missed_count):
+        """runs in a pool thread: runs the target, and frees the concurrency slot dispatch took"""
+        try:
+            self.run(target_time, missed_count)
+        except Exception as e:
+            logging.error("Error in Timer run: %s", Errors.error_to_str(e))
+            logging.error(Errors.traceback_str())
+        finally:
+            self._concurrency_slots.release()
+
+    def run(self, target_time, missed_count=0):
+        """Runs the timer target for the tick at target_time, using setup_run and execute_run, and records stats if instrumented
+        missed_count is the number of ticks skipped since the last run, which is passed on to execute_run if missed_count_kwarg is set"""
+        if self.stats is None:
+            return self._run(target_time, missed_count)
+        start_time = self.now()
+        try:
+            self._run(target_time, missed_count)
+        finally:
+            execution_time = self.seconds(self.now() - start_time)
+            self.stats.record_run(max(self.seconds(start_time - target_time), 0), execution_time, execution_time > self.seconds(self.interval))
+
+    def _run(self, target_time, missed_count):
+        self.setup_run(target_time)
+        self.virtual_time_callback_event.set()
+        if self.missed_count_kwarg:
+            self.execute_run(target_time, missed_count)
+        else:
+            self.execute_run(target_time)
 
     def setup_run(self, target_time):
         """Prepares for a run of the timer target"""
 
-    def execute_run(self, target_time):
-        """Executes a run of the timer target"""
-        self.target(*self.args, **self.kwargs)
+    def execute_run(self, target_time, missed_count=0):
+        """Executes a run of the timer target (missed_count is only passed if missed_count_kwarg is set)"""
+        kwargs = self.kwargs
+        if self.scheduled_time_kwarg or self.missed_count_kwarg:
+            kwargs = dict(kwargs)
+            if self.scheduled_time_kwarg:
+                kwargs[self.scheduled_time_kwarg] = self.scheduled_datetime(target_time)
+            if self.missed_count_kwarg:
+                kwargs[self.missed_count_kwarg] = missed_count
+        self.target(*self.args, **kwargs)
+
+class TimerScheduler(object):
+    """Runs many Timers from a single scheduling thread, instead of each Timer needing its own thread for start.
+    The scheduler keeps a heap of the next tick time of each timer, and hands each due run (setup_run and execute_run)
+    to a pool of worker threads, so a slow target only holds up its own timer, as long as there are free workers.
+    A timer is rescheduled when its run finishes, dealing with any ticks that came due meanwhile according to its overlap policy
+    in the same way as Timer.start, so a timer never has more than one run at a time - except with OVERLAP_CONCURRENT,
+    where the next tick is scheduled as soon as a run is dispatched, and runs alongside it if the timer's max_concurrency allows.
+    Call start (which blocks, like Timer.start) to run the scheduler, and set stop to end it;
+    a timer is removed by setting its own stop.
+    The heap is ordered by clock (time.monotonic by default), so timers using different clocks can share a scheduler.
+    If compensate_drift is set, the scheduler wakes up early as for Timer"""
+    def __init__(self, workers=4, clock=None, compensate_drift=False):
+        self.workers = workers
+        self.clock = clock or monotonic_time
+        self.drift_compensator = DriftCompensator() if compensate_drift else None
+        self.wakeup_event = threading.Event()
+        self._running = True
+        self._lock = threading.Lock()
+        self._heap = []
+        self._counter = itertools.count()
+        self._pool = None
+
+    def get_stop(self):
+        return not self._running
+
+    def set_stop(self, new_stop):
+        self._running = not new_stop
+        self.wakeup_event.set()
+
+    stop = property(get_stop, set_stop)
+
+    def add(self, timer):
+        """Adds the timer to the scheduler, with its first run due straight away"""
+        self._schedule(timer, timer.now())
+        return timer
+
+    def _schedule(self, timer, nexttime):
+        """schedules the timer's run at nexttime, which is in the timer's units"""
+        due = self.clock() + max(timer.seconds(nexttime - timer.now()), 0)
+        with self._lock:
+            heapq.heappush(self._heap, (due, next(self._counter), timer, nexttime))
+        self.wakeup_event.set()
+
+    def start(self):
+        self._pool = ThreadPool(self.workers)
+        try:
+            while self._running:
+                currenttime = self.clock()
+                due = []
+                waitseconds = None
+                with self._lock:
+                    while self._heap and self._heap[0][0] <= currenttime:
+                        due.append(heapq.heappop(self._heap))
+                    if self._heap:
+                        waitseconds = self._heap[0][0] - currenttime
+                for duetime, count, timer, nexttime in due:
+                    if not timer._running:
+                        continue
+                    if timer.overlap == OVERLAP_CONCURRENT:
+                        timer.dispatch(self._pool, nexttime)
+                        self._reschedule(timer, nexttime)
+                    else:
+                        self._pool.apply_async(self._run, (timer, nexttime))
+                if self.drift_compensator is not None and waitseconds is not None:
+                    self.drift_compensator.wait(self.wakeup_event, waitseconds)
+                else:
+                    self.wakeup_event.wait(waitseconds)
+                self.wakeup_event.clear()
+        finally:
+            self._pool.close()
+            self._pool.join()
+
+    def _run(self, timer, nexttime):
+        """runs in a worker thread: runs the timer's target, then schedules its next run"""
+        try:
+            timer.run(nexttime, timer.take_missed_count())
+        except Exception as e:
+            logging.error("Error in Timer run: %s", Errors.error_to_str(e))
+            logging.error(Errors.traceback_str())
+        if timer._running:
+            self._reschedule(timer, nexttime)
 
+    def _reschedule(self, timer, lasttime):
+        """schedules the timer's next tick after lasttime, skipping ticks that have already passed unless its overlap policy queues them"""
+        nexttime = lasttime + timer.interval
+        currenttime = timer.now()
+        if nexttime < currenttime and timer.overlap != OVERLAP_QUEUE:
+            nexttime = timer.skip_missed(nexttime, currenttime)
+        self._schedule(timer, nexttime)
 
 if __name__ == "__main__":
     logging.getLogger().setLevel(logging.INFO)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+from future import standard_library
+standard_library.install_aliases()
+from builtins import *
+from builtins import object
+from j5basic import AsyncTimedLock
+from j5basic import TimedLock
+import asyncio
+import threading
+import time
+
+def run(coroutine):
+    """runs the coroutine to completion in a new event loop"""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+class TestAsyncTimedLock(object):
+    def test_reentrant(self):
+        """tests that the owning task can acquire the lock again"""
+        async def acquire_release():
+            lock = AsyncTimedLock.AsyncTimedLock()
+            assert await lock.acquire()
+            assert await lock.acquire(False)
+            lock.release()
+            assert lock.locked()
+            lock.release()
+            assert not lock.locked()
+            try:
+                lock.release()
+            except RuntimeError:
+                pass
+            else:
+                raise AssertionError("release of an un-acquired lock should fail")
+        run(acquire_release())
+
+    def test_wait(self):
+        """tests the non-blocking, timed and blocking forms of acquire"""
+        async def contend():
+            lock = AsyncTimedLock.AsyncTimedLock()
+            results = []
+            async def hold():
+                async with lock:
+                    await asyncio.sleep(0.2)
+            async def try_acquire():
+                await asyncio.sleep(0.05)
+                results.append(await lock.acquire(False))
+                results.append(await lock.acquire(0.05))
+                start_time = time.time()
+                results.append(await lock.acquire(True))
+                results.append(time.time() - start_time > 0.05)
+                lock.release()
+            await asyncio.gather(hold(), try_acquire())
+            return results
+        assert run(contend()) == [False, False, True, True]
+
+    def test_order(self):
+        """tests that waiting tasks get the lock in the order they asked for it"""
+        async def queue():
+            lock = AsyncTimedLock.AsyncTimedLock()
+            order = []
+            async def take(n):
+                async with lock:
+                    order.append(n)
+                    await asyncio.sleep(0)
+            await lock.acquire()
+            tasks = [asyncio.ensure_future(take(n)) for n in range(5)]
+            await asyncio.sleep(0.01)
+            lock.release()
+            await asyncio.gather(*tasks)
+            return order
+        assert run(queue()) == list(range(5))
+
+    def test_cancel(self):
+        """tests that a cancelled waiter leaves the queue"""
+        async def cancel():
+            lock = AsyncTimedLock.AsyncTimedLock()
+            await lock.acquire()
+            task = asyncio.ensure_future(lock.acquire())
+            await asyncio.sleep(0.01)
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+            lock.release()
+            assert not lock.locked()
+            assert await asyncio.ensure_future(lock.acquire(False))
+        run(cancel())
+
+class TestThreadLockBridge(object):
+    def test_hold(self):
+        """tests that the lock is held for the coroutine, and that the loop keeps running while it waits"""
+        lock = TimedLock.TimedLock()
+        acquired_event = threading.Event()
+        def hold_lock():
+            with lock:
+                acquired_event.set()
+                time.sleep(0.05)
+        threading.Thread(target=hold_lock).start()
+        acquired_event.wait()
+        async def wait_for_lock():
+            ticks = []
+            async def tick():
+                for n in range(5):
+                    ticks.append(n)
+                    await asyncio.sleep(0.02)
+            async def use_lock():
+                async with AsyncTimedLock.ThreadLockBridge(lock) as acquired:
+                    assert acquired
+                    assert not lock.acquire(False)
+                    return len(ticks)
+            ticks_waited, _ = await asyncio.gather(use_lock(), tick())
+            return ticks_waited
+        assert run(wait_for_lock()) > 1
+        assert lock.acquire(False)
+        lock.release()
+
+    def test_timeout(self):
+        """tests that a timed bridge gives up when the lock stays busy"""
+        lock = TimedLock.TimedLock()
+        lock.acquire()
+        async def wait_for_lock():
+            bridge = AsyncTimedLock.ThreadLockBridge(lock, wait=0.05)
+            return await bridge.acquire()
+        assert run(wait_for_lock()) is False
+        lock.release()
+
+    def test_acquire_error(self):
+        """tests that an error acquiring the lock is raised in the coroutine, rather than leaving it waiting"""
+        class BrokenLock(object):
+            def acquire(self, wait=True):
+                raise RuntimeError("broken lock")
+        async def wait_for_lock():
+            bridge = AsyncTimedLock.ThreadLockBridge(BrokenLock())
+            try:
+                await asyncio.wait_for(bridge.acquire(), 5)
+            except RuntimeError as e:
+                assert str(e) == "broken lock"
+            else:
+                raise AssertionError("the error from acquire should be raised")
+            # the bridge can be used again
+            assert bridge._holder is None
+        run(wait_for_lock())
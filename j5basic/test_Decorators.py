@@ -11,9 +11,12 @@ from builtins import *
 from builtins import object
 from j5basic import Decorators
 from j5basic import Decorators, DictUtils
+from j5basic import FakeClock
 import threading
 import time
 import inspect
+import logging
+from j5test import Utils
 from j5test.Utils import method_raises, raises
 
 class TestDecoratorDecorator(object):
@@ -197,6 +200,32 @@ class TestDecoratorDecorator(object):
         assert call_frame != "nonsense"
         assert call_frame.f_code.co_name == "test_decorator_lambda_calling_frame_extendedarg"
 
+    def test_decorator_calling_frame_info(self):
+        """tests that a decorated function can get the location of the calling function without the frame"""
+        frames_so_far = len(getattr(self.g, "call_frames", []))
+        callf_decorator = Decorators.decorator(self.callfdec, ['y', ('z', 3)], calling_frame_arg="calling_frame", calling_frame_info=True)
+        callf_g = callf_decorator(self.g)
+        expected_lineno = Decorators.inspect.currentframe().f_lineno + 1
+        assert callf_g(100, 4) == 100 + 12 + 25
+        assert len(self.g.call_frames) == frames_so_far + 1
+        call_info = self.g.call_frames[-1]
+        assert isinstance(call_info, Decorators.CallingFrameInfo)
+        assert call_info.function == "test_decorator_calling_frame_info"
+        assert call_info.lineno == expected_lineno
+        assert call_info.filename == Decorators.inspect.currentframe().f_code.co_filename
+        raises(TypeError, callf_g, 100, 4, calling_frame=call_info)
+
+    def test_decorator_calling_frame_sample(self):
+        """tests that the calling frame is only captured when the sampling function returns True"""
+        l = lambda x: x + 21
+        callf_decorator = Decorators.decorator(self.callfdec, ['y', ('z', 3)], calling_frame_arg="calling_frame",
+                                               calling_frame_info=True, calling_frame_sample=Decorators.sample_every(3))
+        callf_l = callf_decorator(l)
+        for i in range(6):
+            assert callf_l(100, 4) == 100 + 12 + 21
+        assert [call_info is not None for call_info in l.call_frames] == [True, False, False, True, False, False]
+        assert l.call_frames[0].function == "test_decorator_calling_frame_sample"
+
     def test_extend_decorator_signature(self):
         """tests that a decorated function can extend the signature of the underlying function"""
         ext_decorator = Decorators.decorator(self.extdec, ['y', ('z', 3)])
@@ -321,6 +350,84 @@ def test_chain_decorators():
 
     assert underlying(3) == ((3*6)*2) + 1
 
+def test_chain_decorators_applied_once():
+    applied = []
+    def counting_decorator(f):
+        applied.append(f.__name__)
+        return f
+    @Decorators.decorator
+    def increase_result(f, *args, **kwargs):
+        return f(*args, **kwargs) + 1
+    @Decorators.chain_decorators(counting_decorator, increase_result)
+    def underlying(x):
+        """multiplies x by 6"""
+        return x * 6
+
+    assert applied == ['underlying']
+    assert underlying(3) == 19
+    assert underlying(4) == 25
+    assert applied == ['underlying']
+    assert underlying.__name__ == 'underlying'
+    assert underlying.__doc__ == "multiplies x by 6"
+    assert Decorators.decorator_helpers.getinfo(underlying)["argnames"] == ['x']
+
+@Utils.if_long_test_run()
+def test_chain_decorators_call_overhead():
+    """compares call overhead against re-applying the decorators on every call"""
+    @Decorators.decorator
+    def increase_result(f, *args, **kwargs):
+        return f(*args, **kwargs) + 1
+    @Decorators.decorator
+    def double_result(f, *args, **kwargs):
+        return f(*args, **kwargs)*2
+    def rebuilding_chain(*decorators):
+        @Decorators.decorator
+        def chained_decorator(f, *args, **kw):
+            for decorator in reversed(decorators):
+                f = decorator(f)
+            return f(*args, **kw)
+        return chained_decorator
+    def underlying(x):
+        return x * 6
+    chained = Decorators.chain_decorators(increase_result, double_result)(underlying)
+    rebuilt = rebuilding_chain(increase_result, double_result)(underlying)
+    calls = 2000
+    def time_calls(f):
+        start_time = time.time()
+        for i in range(calls):
+            f(i)
+        return time.time() - start_time
+    assert chained(3) == rebuilt(3)
+    chained_time, rebuilt_time = time_calls(chained), time_calls(rebuilt)
+    print("%d calls: chained %0.4fs, rebuilt per call %0.4fs" % (calls, chained_time, rebuilt_time))
+    assert chained_time < rebuilt_time
+
+def test_wraptimer():
+    class Foo(object):
+        @Decorators.wraptimer
+        def double(self, x):
+            """doubles x"""
+            return x * 2
+    messages = []
+    class ListHandler(logging.Handler):
+        def emit(self, record):
+            messages.append(record.getMessage())
+    root_logger = logging.getLogger()
+    handler, old_level = ListHandler(), root_logger.level
+    root_logger.addHandler(handler)
+    try:
+        root_logger.setLevel(logging.INFO)
+        assert Foo().double(2) == 4
+        assert messages == []
+        root_logger.setLevel(logging.DEBUG)
+        assert Foo().double(3) == 6
+        assert len(messages) == 2
+        assert messages[0] == "about to call double(3)"
+    finally:
+        root_logger.removeHandler(handler)
+        root_logger.setLevel(old_level)
+    assert Foo.double.__doc__ == "doubles x"
+
 def test_get_right_args():
     def my_arg_function(foo, bar, jim=3):
         pass
@@ -360,3 +467,177 @@ def test_get_or_pop_arg():
     assert args == (1, 2)
     DictUtils.assert_dicts_equal(kw, {'jim': 3})
 
+
+class TestRateLimiter(object):
+    def test_burst_then_throttle(self):
+        clock = FakeClock.FakeClock()
+        limiter = Decorators.RateLimiter(10, burst=3, time_function=clock.time, sleep_function=clock.sleep)
+        @limiter
+        def f(x, y=2):
+            return x + y
+        assert Decorators.decorator_helpers.getinfo(f)["argnames"] == ['x', 'y']
+        for i in range(3):
+            assert f(i) == i + 2
+        assert clock.sleeps == []
+        assert f(1, y=1) == 2
+        assert clock.sleeps == [0.1]
+        stats = limiter.stats()
+        assert stats["calls"] == 4
+        assert stats["throttled"] == 1
+        assert abs(stats["throttle_time"] - 0.1) < 1e-9
+
+    def test_refill(self):
+        clock = FakeClock.FakeClock()
+        limiter = Decorators.RateLimiter(2, burst=2, time_function=clock.time, sleep_function=clock.sleep)
+        limiter.acquire()
+        limiter.acquire()
+        clock.now += 10
+        limiter.acquire()
+        limiter.acquire()
+        assert clock.sleeps == []
+        assert limiter.stats()["throttled"] == 0
+
+    def test_no_wait(self):
+        clock = FakeClock.FakeClock()
+        limiter = Decorators.RateLimiter(1, wait=False, time_function=clock.time, sleep_function=clock.sleep)
+        limiter.acquire()
+        raises(Decorators.RateLimitExceeded, limiter.acquire)
+        raises(Decorators.RateLimitExceeded, limiter.acquire, 0.5)
+        limiter.acquire(1)
+        assert clock.sleeps == [1.0]
+        assert limiter.stats()["rejected"] == 2
+
+    def test_threaded(self):
+        limiter = Decorators.RateLimiter(1000, burst=1)
+        results = []
+        @limiter
+        def f(i):
+            results.append(i)
+        threads = [threading.Thread(target=f, args=(i,)) for i in range(20)]
+        for thrd in threads:
+            thrd.start()
+        for thrd in threads:
+            thrd.join()
+        assert sorted(results) == list(range(20))
+        assert limiter.stats()["calls"] == 20
+
+class TestRetry(object):
+    def test_retry_success(self):
+        clock = FakeClock.FakeClock()
+        retry = Decorators.Retry((ValueError,), max_attempts=4, initial_delay=0.5, jitter=False, sleep_function=clock.sleep)
+        failures = [ValueError("one"), ValueError("two")]
+        @retry
+        def flaky(x):
+            if failures:
+                raise failures.pop(0)
+            return x * 2
+        assert flaky(3) == 6
+        assert clock.sleeps == [0.5, 1.0]
+        DictUtils.assert_dicts_equal(retry.stats(), {"calls": 1, "retries": 2, "failures": 0, "backoff_time": 1.5})
+
+    def test_retry_gives_up(self):
+        clock = FakeClock.FakeClock()
+        retry = Decorators.Retry((ValueError,), max_attempts=3, initial_delay=1, max_delay=1.5, jitter=False, sleep_function=clock.sleep)
+        attempts = []
+        @retry
+        def broken():
+            attempts.append(1)
+            raise ValueError("broken")
+        raises(ValueError, broken)
+        assert len(attempts) == 3
+        assert clock.sleeps == [1, 1.5]
+        assert retry.stats()["failures"] == 1
+
+    def test_retry_other_exceptions(self):
+        clock = FakeClock.FakeClock()
+        retry = Decorators.Retry((ValueError,), sleep_function=clock.sleep)
+        @retry
+        def broken():
+            raise KeyError("not retried")
+        raises(KeyError, broken)
+        assert clock.sleeps == []
+        assert retry.stats()["retries"] == 0
+
+    def test_jitter(self):
+        retry = Decorators.Retry(initial_delay=2, jitter=True, random_function=lambda: 0.25)
+        assert retry.get_delay(0) == 0.5
+        assert retry.get_delay(2) == 2.0
+
+class TestCircuitBreaker(object):
+    def test_open_and_reset(self):
+        clock = FakeClock.FakeClock()
+        breaker = Decorators.CircuitBreaker(failure_threshold=2, reset_timeout=10, exceptions=(IOError,), time_function=clock.time)
+        outcomes = []
+        @breaker
+        def backend():
+            if outcomes.pop(0):
+                return "ok"
+            raise IOError("down")
+        outcomes.extend([False, True, False, False])
+        raises(IOError, backend)
+        assert backend() == "ok"
+        raises(IOError, backend)
+        assert breaker.state == breaker.CLOSED
+        raises(IOError, backend)
+        assert breaker.state == breaker.OPEN
+        raises(Decorators.CircuitOpenError, backend)
+        clock.now += 10
+        # the trial call fails, so the circuit opens again
+        outcomes.append(False)
+        raises(IOError, backend)
+        assert breaker.state == breaker.OPEN
+        raises(Decorators.CircuitOpenError, backend)
+        clock.now += 10
+        outcomes.append(True)
+        assert backend() == "ok"
+        assert breaker.state == breaker.CLOSED
+        DictUtils.assert_dicts_equal(breaker.stats(), {"state": "closed", "calls": 6, "successes": 2, "failures": 4, "rejected": 2, "opened": 2})
+
+    def test_calls_in_flight(self):
+        """tests that calls that started before the state changed don't change it when they finish"""
+        clock = FakeClock.FakeClock()
+        breaker = Decorators.CircuitBreaker(failure_threshold=1, reset_timeout=10, exceptions=(IOError,), time_function=clock.time)
+        started = dict((name, threading.Event()) for name in ("success", "error", "trial"))
+        finish = dict((name, threading.Event()) for name in ("success", "error", "trial"))
+        @breaker
+        def backend(name=None, error=None):
+            if name is not None:
+                started[name].set()
+                finish[name].wait(5)
+            if error is not None:
+                raise error
+            return "ok"
+        def call_in_thread(*args):
+            thread = threading.Thread(target=lambda: raises(Exception, backend, *args) if args[1:] else backend(*args))
+            thread.start()
+            started[args[0]].wait(5)
+            return thread
+        # both start while the circuit is closed
+        early_success = call_in_thread("success")
+        early_error = call_in_thread("error", KeyError("not a failure"))
+        raises(IOError, backend, None, IOError("down"))
+        assert breaker.state == breaker.OPEN
+        finish["success"].set()
+        early_success.join()
+        assert breaker.state == breaker.OPEN
+        clock.now += 10
+        trial = call_in_thread("trial")
+        assert breaker.state == breaker.HALF_OPEN
+        finish["error"].set()
+        early_error.join()
+        # the early call finishing doesn't end the trial, so no other call is let through yet
+        raises(Decorators.CircuitOpenError, backend)
+        finish["trial"].set()
+        trial.join()
+        assert breaker.state == breaker.CLOSED
+        assert backend() == "ok"
+        DictUtils.assert_dicts_equal(breaker.stats(), {"state": "closed", "calls": 5, "successes": 3, "failures": 1, "rejected": 1, "opened": 1})
+
+    def test_other_exceptions(self):
+        breaker = Decorators.CircuitBreaker(failure_threshold=1, exceptions=(IOError,))
+        @breaker
+        def backend():
+            raise KeyError("not a failure")
+        raises(KeyError, backend)
+        raises(KeyError, backend)
+        assert breaker.state == breaker.CLOSED
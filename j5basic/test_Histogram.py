@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+from future import standard_library
+standard_library.install_aliases()
+from builtins import *
+from builtins import object
+from j5basic import Histogram
+
+class TestHistogram(object):
+    def test_record(self):
+        """tests that values are counted in the bucket of the first bound they don't exceed, and totalled"""
+        histogram = Histogram.Histogram()
+        for value in (0, 0.001, 0.5, 0.5, 20, 3):
+            histogram.record(value)
+        assert histogram.counts == [2, 0, 0, 2, 1, 1]
+        assert abs(histogram.total - 24.001) < 1e-9
+        assert histogram.maximum == 20
+
+    def test_bounds(self):
+        """tests a histogram with its own bounds"""
+        histogram = Histogram.Histogram((1, 2))
+        histogram.record(1.5)
+        assert histogram.bounds == (1, 2)
+        assert histogram.counts == [0, 1, 0]
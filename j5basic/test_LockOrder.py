@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+from future import standard_library
+standard_library.install_aliases()
+from builtins import *
+from builtins import object
+from j5basic import Decorators
+from j5basic import LockOrder
+from j5basic import SemiSortedSet
+from j5basic import TimedLock
+import gc
+import threading
+
+class Resource(object):
+    def __init__(self):
+        self.lock = threading.RLock()
+
+    @Decorators.SelfLocking.runwithlock
+    def call_with_lock(self, function, *args):
+        return function(*args)
+
+class TestLockOrder(object):
+    def setup_method(self, method):
+        LockOrder.reset()
+        LockOrder.enable()
+
+    def teardown_method(self, method):
+        LockOrder.disable()
+        LockOrder.reset()
+
+    def test_cycle(self):
+        """tests that acquiring two locks in opposite orders is reported, even without an actual deadlock"""
+        first = TimedLock.TimedLock(name="first")
+        second = TimedLock.TimedLock(name="second")
+        with first:
+            with second:
+                pass
+        assert LockOrder.lock_order_graph() == {"first": ["second"], "second": []}
+        assert LockOrder.potential_deadlocks() == []
+        def reverse_order():
+            with second:
+                with first:
+                    pass
+        thread = threading.Thread(target=reverse_order)
+        thread.start()
+        thread.join()
+        deadlocks = LockOrder.potential_deadlocks()
+        assert len(deadlocks) == 1
+        assert deadlocks[0]["locks"] == ["second", "first", "second"]
+        assert "reverse_order" in deadlocks[0]["sites"][0][1]
+        assert "test_cycle" in deadlocks[0]["sites"][1][1]
+
+    def test_reentrant_and_nonblocking(self):
+        """tests that reentrant and non-blocking acquires don't add edges"""
+        first = TimedLock.TimedLock(name="first")
+        second = TimedLock.TimedLock(name="second")
+        with first:
+            with first:
+                pass
+            assert second.acquire(False)
+            second.release()
+        with second:
+            with first:
+                pass
+        assert LockOrder.lock_order_graph() == {"first": [], "second": ["first"]}
+        assert LockOrder.potential_deadlocks() == []
+
+    def test_runwithlock(self):
+        """tests that locks taken by runwithlock, including those of SemiSortedSets, are recorded"""
+        resource = Resource()
+        s = SemiSortedSet.SemiSortedSet([1, 2, 3])
+        timed_lock = TimedLock.TimedLock(name="timed")
+        def add_under_timed_lock():
+            with timed_lock:
+                s.add(4)
+        resource.call_with_lock(add_under_timed_lock)
+        with s.batch():
+            resource.call_with_lock(timed_lock.acquire)
+            timed_lock.release()
+        graph = LockOrder.lock_order_graph()
+        resource_name = [name for name in graph if name.startswith("Resource.lock")][0]
+        set_name = [name for name in graph if name.startswith("SemiSortedSet.lock")][0]
+        assert graph[resource_name] == sorted(["timed", set_name])
+        assert graph["timed"] == [set_name]
+        assert sorted(graph[set_name]) == sorted([resource_name, "timed"])
+        cycles = [deadlock["locks"] for deadlock in LockOrder.potential_deadlocks()]
+        assert [set_name, "timed", set_name] in cycles
+
+    def test_disabled(self):
+        """tests that nothing is recorded while disabled"""
+        LockOrder.disable()
+        first = TimedLock.TimedLock(name="first")
+        second = TimedLock.TimedLock(name="second")
+        with first:
+            with second:
+                pass
+        assert LockOrder.lock_order_graph() == {}
+
+    def test_garbage_collected(self):
+        """tests that locks that no longer exist are removed from the graph"""
+        first = TimedLock.TimedLock(name="first")
+        second = TimedLock.TimedLock(name="second")
+        with first:
+            with second:
+                pass
+        del second
+        gc.collect()
+        assert LockOrder.lock_order_graph() == {"first": []}
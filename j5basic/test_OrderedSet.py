@@ -6,13 +6,190 @@ from future import standard_library
 standard_library.install_aliases()
 from builtins import *
 from j5basic import OrderedSet
+from j5test import Utils
+import copy
+import json
+import pickle
+import time
+
+class TestOrderedSet(object):
+    set_class = OrderedSet.OrderedSet
+
+    def test_ordered_set(self):
+        os = self.set_class()
+        os.extend([1,2,3])
+        os.update([4,5,6])
+        os.append(7)
+        os.add(8)
+        os.remove(2)
+        del os[4]
+        assert list(os) == [1,3,4,5,7,8]
+
+    def test_index_and_remove(self):
+        os = self.set_class(range(100))
+        os.extend([5, 50, 100])
+        assert len(os) == 101
+        assert 50 in os
+        assert 101 not in os
+        for n in range(0, 100, 3):
+            os.remove(n)
+        assert Utils.raises(ValueError, os.remove, 0)
+        os.discard(0)
+        assert 3 not in os
+        assert os.index(4) == 2
+        assert os[0] == 1
+        assert os[-1] == 100
+        assert os[:3] == [1, 2, 4]
+        assert list(reversed(os))[:2] == [100, 98]
+        assert Utils.raises(ValueError, os.index, 3)
+        assert os.pop() == 100
+        assert os.pop(0) == 1
+        assert len(os) == 65
+        del os[0:2]
+        assert os[0] == 5
+        assert os == [x for x in range(5, 100) if x % 3]
+        assert os.count(5) == 1
+        assert os.count(6) == 0
+        os.add(3)
+        assert os[-1] == 3
+        os.clear()
+        assert not os
+
+    def test_set_algebra(self):
+        a = self.set_class([5, 1, 4, 2])
+        b = self.set_class([3, 2, 6, 5])
+        assert a.union(b) == [5, 1, 4, 2, 3, 6]
+        assert a.union([7], iter([8, 1])) == [5, 1, 4, 2, 7, 8]
+        assert a.intersection(b) == [5, 2]
+        assert b.intersection(a) == [2, 5]
+        assert a.intersection(b, [5]) == [5]
+        assert a.difference(b) == [1, 4]
+        assert a.difference([1], set([4])) == [5, 2]
+        assert a.symmetric_difference(b) == [1, 4, 3, 6]
+        assert a.symmetric_difference(iter([2, 9])) == [5, 1, 4, 9]
+        assert a | b == [5, 1, 4, 2, 3, 6]
+        assert a & set([2, 4]) == [4, 2]
+        assert a - b == [1, 4]
+        assert a ^ b == [1, 4, 3, 6]
+        assert Utils.raises(TypeError, lambda: a | [1])
+        assert a == [5, 1, 4, 2]
+        assert a.issubset([1, 2, 4, 5, 6])
+        assert not a.issubset(b)
+        assert a.issuperset([1, 2])
+        assert a.isdisjoint([7, 8])
+        assert not a.isdisjoint(b)
+
+    def test_inplace_set_algebra(self):
+        c = self.set_class(range(10))
+        c |= self.set_class([12, 3, 11])
+        assert c == list(range(10)) + [12, 11]
+        c &= set(range(2, 12))
+        assert c == list(range(2, 10)) + [11]
+        c -= set([3, 5])
+        assert c == [2, 4, 6, 7, 8, 9, 11]
+        c ^= self.set_class([4, 1, 2, 20])
+        assert c == [6, 7, 8, 9, 11, 1, 20]
+        assert c.index(20) == 6
+        c.update([21], [22])
+        c.intersection_update([22, 6, 21, 1])
+        assert c == [6, 1, 21, 22]
+        assert c.index(22) == 3
+        c.difference_update([6], [22])
+        c.symmetric_difference_update([21, 30])
+        assert c == [1, 30]
+
+    def test_copy(self):
+        os = self.set_class([3, 1, 2])
+        copied = os.copy()
+        copied.add(4)
+        os.remove(1)
+        assert os == [3, 2]
+        assert copied == [3, 1, 2, 4]
+        assert type(copied) is self.set_class
+        assert copy.copy(os) == [3, 2]
+        assert pickle.loads(pickle.dumps(copied)) == copied
+
+class TestIndexedOrderedSet(TestOrderedSet):
+    set_class = OrderedSet.IndexedOrderedSet
+
+class TestCompactOrderedSet(TestOrderedSet):
+    set_class = OrderedSet.CompactOrderedSet
+
+    def test_slots(self):
+        os = self.set_class()
+        assert not hasattr(os, "__dict__")
+
+def test_list():
+    """tests that OrderedSet is still a list"""
+    os = OrderedSet.OrderedSet([3, 1, 2])
+    assert isinstance(os, list)
+    assert json.dumps(os) == "[3, 1, 2]"
+    assert os + [4] == [3, 1, 2, 4]
+    os.sort()
+    assert os == [1, 2, 3]
+    os.insert(0, 0)
+    os.insert(0, 3)
+    os[1] = 5
+    assert os == [0, 5, 2, 3]
+    assert 5 in os and 1 not in os
+    assert [1] not in os
+    os += [3, 6]
+    assert os == [0, 5, 2, 3, 6]
+
+def test_remove_all():
+    os = OrderedSet.IndexedOrderedSet(range(1000))
+    for n in range(1000):
+        assert os[0] == n
+        os.remove(n)
+    assert list(os) == []
+    os = OrderedSet.IndexedOrderedSet(range(1000))
+    for n in reversed(range(1000)):
+        assert os.pop() == n
+    assert len(os._items) == 0
+
+@Utils.if_long_test_run()
+def test_memory_per_item():
+    """compares the memory used per item (not counting the items themselves) by the OrderedSet classes"""
+    # tracemalloc is only available from Python 3.4
+    import tracemalloc
+    items = [str(n) for n in range(1000000)]
+    for set_class in (OrderedSet.OrderedSet, OrderedSet.IndexedOrderedSet, OrderedSet.CompactOrderedSet):
+        tracemalloc.start()
+        os = set_class(items)
+        used = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print("%s: %0.1f bytes per item" % (set_class.__name__, float(used) / len(items)))
+        del os
+
+@Utils.if_long_test_run()
+def test_set_algebra_speed():
+    """tests that the set algebra on a large OrderedSet takes linear time, rather than a list removal per item"""
+    os = OrderedSet.OrderedSet(range(200000))
+    start_time = time.time()
+    os -= set(range(0, 200000, 50))
+    os ^= set(range(0, 200000, 49))
+    assert 0 in os and 51 in os and 49 not in os and 50 not in os
+    assert time.time() - start_time < 0.5
+
+@Utils.if_long_test_run()
+def test_remove_speed():
+    """compares removing items from a 1M-item IndexedOrderedSet to removing them from a list"""
+    size, removals = 1000000, 1000
+    os = OrderedSet.IndexedOrderedSet(range(size))
+    plain_list = list(range(size))
+    to_remove = list(range(size // 2, size // 2 + removals))
+    start_time = time.time()
+    for x in to_remove:
+        os.remove(x)
+    orderedset_time = time.time() - start_time
+    start_time = time.time()
+    for x in to_remove:
+        plain_list.remove(x)
+    list_time = time.time() - start_time
+    start_time = time.time()
+    found = sum(1 for x in range(0, size, 1000) if x in os)
+    contains_time = time.time() - start_time
+    print("%d removals from %d items: IndexedOrderedSet %0.4fs, list %0.4fs; %d membership tests %0.4fs" % (removals, size, orderedset_time, list_time, found, contains_time))
+    assert list(os) == plain_list
+    assert orderedset_time < list_time
 
-def test_ordered_set():
-    os = OrderedSet.OrderedSet()
-    os.extend([1,2,3])
-    os.update([4,5,6])
-    os.append(7)
-    os.add(8)
-    os.remove(2)
-    del os[4]
-    assert list(os) == [1,3,4,5,7,8]
\ No newline at end of file
@@ -11,6 +11,10 @@ standard_library.install_aliases()
 from builtins import *
 from j5basic import Ranges
 from j5basic import DictUtils
+from j5test import Utils
+import multiprocessing
+import random
+import time
 
 def run_ranges_tst(ranges, expected_tagmap, expected_axislist):
     if isinstance(ranges, list):
@@ -36,3 +40,170 @@ def test_labelled():
     tagmap = {'ramp3': (0, (1512, 8021)), 'ramp2': (0, (1512, 8021)), 'ramp1': (0, (1512, 8021))}
     run_ranges_tst(ranges, tagmap, [(1512, 8021)])
 
+
+def test_duplicates_and_zero_width():
+    ranges = {'flat1': (5, 5), 'flat2': (5, 5), 'level': (0, 10), 'level2': (0, 10), 'temp': (2.5, 7.5), 'flow': (-50, 400), 'pressure': (-40, 380), 'spike': (1000, 1000)}
+    tagmap = {'flat1': (0, (5, 5)), 'flat2': (0, (5, 5)), 'level': (0, (0, 10)), 'level2': (0, (0, 10)), 'temp': (0, (0, 10)), 'flow': (0, (-50, 1000)), 'pressure': (0, (-50, 1000)), 'spike': (0, (-50, 1000))}
+    run_ranges_tst(ranges, tagmap, [(5, 5), (0, 10), (-50, 1000)])
+
+def test_no_ranges():
+    assert Ranges.calculateaxes({}) == {}
+
+def test_many_tags():
+    ranges = dict([("tag%d" % n, (-(n * 37 % 1000), n * 91 % 1000)) for n in range(300)])
+    tagmap = Ranges.calculateaxes(dict(ranges))
+    assert sorted(tagmap) == sorted(ranges)
+    for tag, (score, (amin, amax)) in tagmap.items():
+        rmin, rmax = ranges[tag]
+        assert amin <= rmin and rmax <= amax
+
+@Utils.if_module(Ranges.numpy, "numpy")
+def test_vectorized_gains():
+    ranges = dict([("tag%d" % n, (-(n * 37 % 1000), n * 91 % 1000 + n % 3)) for n in range(100)])
+    ranges.update([("flat%d" % n, (n % 4, n % 4)) for n in range(20)])
+    vectorized = Ranges.calculateaxes(dict(ranges))
+    vectorize_min = Ranges._AxisMerger.VECTORIZE_MIN
+    try:
+        Ranges._AxisMerger.VECTORIZE_MIN = len(ranges) ** 2
+        assert Ranges.calculateaxes(dict(ranges)) == vectorized
+    finally:
+        Ranges._AxisMerger.VECTORIZE_MIN = vectorize_min
+
+def test_parallel_pairs():
+    ranges = dict([("tag%d" % n, (-(n * 37 % 1000), n * 91 % 1000 + n % 3)) for n in range(60)])
+    ranges.update([("flat%d" % n, (n % 4, n % 4)) for n in range(10)])
+    serial = Ranges.calculateaxes(dict(ranges))
+    parallel_min = Ranges._AxisMerger.PARALLEL_MIN
+    try:
+        Ranges._AxisMerger.PARALLEL_MIN = 10
+        assert Ranges.calculateaxes(dict(ranges), processes=3) == serial
+    finally:
+        Ranges._AxisMerger.PARALLEL_MIN = parallel_min
+
+@Utils.if_long_test_run()
+def test_parallel_speed():
+    """compares calculating the pairs for 2000 tags serially and across all the cores"""
+    processes = max(multiprocessing.cpu_count(), 2)
+    ranges = dict([("tag%d" % n, (-(n * 37 % 1000), n * 91 % 1000)) for n in range(2000)])
+    ranges = dict([(tag, Ranges._roundrange(tagrange)) for tag, tagrange in ranges.items()])
+    start_time = time.time()
+    serial = Ranges._AxisMerger(ranges)
+    serial_time = time.time() - start_time
+    start_time = time.time()
+    parallel = Ranges._AxisMerger(ranges, processes)
+    parallel_time = time.time() - start_time
+    assert list(serial.pairs) == list(parallel.pairs)
+    print("pairs for 2000 tags: %0.2fs serially, %0.2fs across %d processes (%0.1fx)" % (serial_time, parallel_time, processes, serial_time / parallel_time))
+
+@Utils.if_long_test_run()
+def test_scaling():
+    for numtags in (100, 300, 1000):
+        ranges = dict([("tag%d" % n, (-(n * 37 % 1000), n * 91 % 1000)) for n in range(numtags)])
+        start_time = time.time()
+        tagmap = Ranges.calculateaxes(ranges)
+        print("%d tags onto %d axes in %0.2fs" % (numtags, len(Ranges.tagmaptoaxismap(tagmap)), time.time() - start_time))
+
+def test_interval_index():
+    index = Ranges.IntervalIndex({"level": (0, 10), "flow": (-50, 400), "temp": (2, 8), "flat": (5, 5)})
+    assert len(index) == 4
+    assert index.stab(5) == ["flow", "level", "temp", "flat"]
+    assert index.stab(-10) == ["flow"]
+    assert index.stab(500) == []
+    assert index.overlapping(8, 20) == ["flow", "level", "temp"]
+    assert index.containing(1, 9) == ["flow", "level"]
+    index.add("temp", (20, 30))
+    assert index["temp"] == (20, 30)
+    assert index.overlapping(8, 20) == ["flow", "level", "temp"]
+    assert index.containing(1, 9) == ["flow", "level"]
+    index.remove("flow")
+    assert "flow" not in index
+    assert Utils.raises(KeyError, index.remove, "flow")
+    assert Utils.raises(ValueError, index.add, "bad", (2, 1))
+    assert list(index) == ["level", "flat", "temp"]
+
+def test_interval_index_random():
+    rng = random.Random(5)
+    ranges = {}
+    index = Ranges.IntervalIndex()
+    for n in range(2000):
+        key = rng.randint(0, 300)
+        if rng.random() < 0.3:
+            index.discard(key)
+            ranges.pop(key, None)
+        else:
+            lo = rng.randint(-500, 500)
+            ranges[key] = (lo, lo + rng.randint(0, 200))
+            index.add(key, ranges[key])
+        if n % 50 == 0:
+            lo = rng.randint(-600, 600)
+            hi = lo + rng.randint(0, 100)
+            assert sorted(index.stab(lo)) == sorted(key for key, (rmin, rmax) in ranges.items() if rmin <= lo <= rmax)
+            assert sorted(index.overlapping(lo, hi)) == sorted(key for key, (rmin, rmax) in ranges.items() if rmin <= hi and rmax >= lo)
+            assert sorted(index.containing(lo, hi)) == sorted(key for key, (rmin, rmax) in ranges.items() if rmin <= lo and rmax >= hi)
+    assert sorted(index.items()) == sorted(ranges.items())
+
+def test_axisindex():
+    tagmap = Ranges.calculateaxes({"tag0": (0, 10), "tag1": (0, 20), "tag2": (-100, 100)})
+    index = Ranges.axisindex(tagmap)
+    for tag, (score, axis) in tagmap.items():
+        assert axis in index.containing(*axis)
+    assert index.containing(150, 160) == []
+
+def check_planner_tagmap(planner, ranges):
+    """checks each tag is on an axis covering its range, and that each axis is just big enough for its tags"""
+    tagmap = planner.tagmap
+    assert sorted(tagmap) == sorted(ranges)
+    for axis, tags in Ranges.tagmaptoaxismap(tagmap).items():
+        tagranges = [Ranges._roundrange(ranges[tag]) for tag in tags]
+        assert axis == (min(rmin for rmin, rmax in tagranges), max(rmax for rmin, rmax in tagranges))
+
+def test_axis_planner():
+    ranges = {"tag0": (0, 10), "tag1": (0, 20), "tag2": (10, 60), "tag3": (0, 100), "tag4": (-100, 100)}
+    planner = Ranges.AxisPlanner(ranges)
+    assert ranges["tag0"] == (0, 10)
+    DictUtils.assert_dicts_equal(planner.tagmap, Ranges.calculateaxes(dict(ranges)))
+    # a range that still fits its axis changes nothing
+    assert planner.update({"tag0": (1, 9.5)}) == {}
+    # moving a range far away gives it a new axis
+    diff = planner.update({"tag1": (5000, 6000)})
+    assert diff["tag1"] == (5000, 6000)
+    ranges.update({"tag0": (1, 9.5), "tag1": (5000, 6000)})
+    check_planner_tagmap(planner, ranges)
+    diff = planner.update(removed=["tag1"])
+    assert diff == {"tag1": None}
+    del ranges["tag1"]
+    check_planner_tagmap(planner, ranges)
+
+def test_axis_planner_recompute():
+    ranges = {"tag0": (0, 10), "tag1": (0, 20), "tag2": (10, 60)}
+    planner = Ranges.AxisPlanner(recomputeratio=1.0)
+    assert planner.update(ranges) == dict([(tag, axis) for tag, (score, axis) in Ranges.calculateaxes(dict(ranges)).items()])
+    # any drop in the score triggers a full recalculation
+    ranges["tag2"] = (-3000, 3000)
+    planner.update({"tag2": ranges["tag2"]})
+    assert planner.score() >= planner.fullscore
+    DictUtils.assert_dicts_equal(planner.tagmap, Ranges.calculateaxes(dict(ranges)))
+
+def test_axis_planner_diffs():
+    rng = random.Random(3)
+    ranges = {}
+    planner = Ranges.AxisPlanner(recomputeratio=0.8)
+    for n in range(200):
+        before = planner.tagmap
+        tag = "tag%d" % rng.randint(0, 30)
+        if tag in ranges and rng.random() < 0.2:
+            del ranges[tag]
+            diff = planner.update(removed=[tag])
+        else:
+            rmin = rng.uniform(-1000, 1000)
+            ranges[tag] = (rmin, rmin + rng.choice([0, 10, 100, 1000]))
+            diff = planner.update({tag: ranges[tag]})
+        after = planner.tagmap
+        expected = {}
+        for changedtag in set(before).union(after):
+            oldaxis = before[changedtag][1] if changedtag in before else None
+            newaxis = after[changedtag][1] if changedtag in after else None
+            if oldaxis != newaxis:
+                expected[changedtag] = newaxis
+        assert diff == expected
+        check_planner_tagmap(planner, ranges)
@@ -15,7 +15,10 @@ from j5basic import SemiSortedSet
 from j5test import Utils
 import copy
 import datetime
+import operator
 import random
+import threading
+import time
 
 ORWELL = datetime.date(1984,1,1)
 SPACE = datetime.date(2001,1,1)
@@ -26,17 +29,20 @@ SPACE_YEAR = [datetime.datetime(2001,1,1) + datetime.timedelta(days=n) for n in
 BASE_SET_CLASS = set
 
 class TestSemiSortedSet(object):
+    set_class = SemiSortedSet.SemiSortedSet
+
     @classmethod
     def setup_class(cls):
-        cls.empty = SemiSortedSet.SemiSortedSet()
-        cls.single_item = SemiSortedSet.SemiSortedSet([1])
-        cls.hundred = SemiSortedSet.SemiSortedSet(list(range(50,101))+list(range(1,50)))
-        cls.date = SemiSortedSet.SemiSortedSet([ORWELL, SPACE])
-        cls.space_year = SemiSortedSet.SemiSortedSet(SPACE_YEAR)
+        cls.empty = cls.set_class()
+        cls.single_item = cls.set_class([1])
+        cls.hundred = cls.set_class(list(range(50,101))+list(range(1,50)))
+        cls.date = cls.set_class([ORWELL, SPACE])
+        cls.space_year = cls.set_class(SPACE_YEAR)
 
     def test_class_inheritance(self):
         assert isinstance(self.empty, BASE_SET_CLASS)
         assert isinstance(self.single_item, SemiSortedSet.SemiSortedSet)
+        assert type(self.single_item.copy()) is self.set_class
 
     def test_bool(self):
         assert not self.empty
@@ -75,7 +81,49 @@ class TestSemiSortedSet(object):
         assert hundred.min() == 1
         hundred &= self.hundred
         assert hundred.max() == 100
-        # TODO: test ^= -= and method versions - difference_update, intersection_update, symettric_difference_update, update
+        hundred ^= self.set_class([3, 200])
+        assert hundred.min() == 1
+        assert hundred.max() == 200
+        hundred -= set([1, 4, 200])
+        assert hundred.min() == 5
+        assert hundred.max() == 100
+        hundred.update([0], [150])
+        assert (hundred.min(), hundred.max()) == (0, 150)
+        hundred.difference_update([0, 150, 100])
+        assert (hundred.min(), hundred.max()) == (5, 99)
+        hundred.intersection_update(range(10, 20))
+        assert (hundred.min(), hundred.max()) == (10, 19)
+        hundred.symmetric_difference_update([10, 30])
+        assert (hundred.min(), hundred.max()) == (11, 30)
+        assert len(hundred) == 10
+        hundred.clear()
+        assert not hundred
+        assert Utils.raises(ValueError, hundred.min)
+
+    def test_pop_window(self):
+        """tests a sliding window that keeps removing its minimum"""
+        window = self.set_class(range(1000))
+        for n in range(1000, 5000):
+            window.add(n)
+            window.remove(window.min())
+            assert window.min() == n - 999
+            assert window.max() == n
+        assert len(window) == 1000
+        while window:
+            element = window.pop()
+            assert element not in window
+            if window:
+                assert window.min() == min(set(window))
+                assert window.max() == max(set(window))
+
+    def test_construct(self):
+        from_iterator = self.set_class(iter([3, 1, 2]))
+        assert len(from_iterator) == 3
+        assert (from_iterator.min(), from_iterator.max()) == (1, 3)
+        copied = copy.copy(self.hundred)
+        copied.remove(1)
+        assert self.hundred.min() == 1
+        assert copied.min() == 2
 
     def test_slice(self):
         empty = self.empty.copy()
@@ -96,3 +144,284 @@ class TestSemiSortedSet(object):
         assert len(space_year) == 5
         assert space_year.max() == datetime.datetime(2001, 1, 5)
 
+
+    def test_irange_bisect(self):
+        assert list(self.hundred.irange(10, 13)) == [10, 11, 12, 13]
+        assert list(self.hundred.irange(10, 13, inclusive=(False, False), reverse=True)) == [12, 11]
+        assert list(self.empty.irange()) == []
+        assert self.hundred.bisect_left(10) == 9
+        assert self.hundred.bisect_right(10) == 10
+        assert self.space_year.bisect_left(datetime.datetime(2001, 2, 1)) == 31
+        hundred = self.hundred.copy()
+        for item in hundred.irange(50):
+            hundred.discard(item)
+        assert hundred.max() == 49
+
+    def test_remove_cmp_op(self):
+        hundred = self.hundred.copy()
+        hundred.remove_le(10)
+        hundred.remove_ge(90)
+        assert (hundred.min(), hundred.max(), len(hundred)) == (11, 89, 79)
+        hundred.remove_cmp_op(lambda item, divisor: item % divisor == 0, 2)
+        assert sorted(hundred) == list(range(11, 90, 2))
+        hundred.remove_cmp_op(operator.lt, 20)
+        assert hundred.min() == 21
+        assert 19 not in hundred
+
+    def test_bulk(self):
+        bulk = self.set_class([5, 10])
+        bulk.bulk_add([7, 3, 10, 3, 20])
+        assert sorted(bulk) == [3, 5, 7, 10, 20]
+        assert (bulk.min(), bulk.max()) == (3, 20)
+        bulk.bulk_add(range(15, 100), presorted=True)
+        assert len(bulk) == 89
+        assert bulk.max() == 99
+        assert list(bulk.irange(18, 21)) == [18, 19, 20, 21]
+        bulk.bulk_discard(range(0, 98))
+        assert sorted(bulk) == [98, 99]
+        assert bulk.min() == 98
+        unsorted = self.set_class()
+        unsorted.bulk_add([5, 3, 1], presorted=True)
+        assert (unsorted.min(), unsorted.max()) == (1, 5)
+        assert list(unsorted) == [1, 3, 5]
+
+    def test_batch(self):
+        batched = self.hundred.copy()
+        with batched.batch() as b:
+            assert b is batched
+            for n in range(101, 200):
+                batched.add(n)
+            batched.discard(1)
+            batched.add(1)
+            batched.remove(2)
+            batched.add(0)
+            batched.discard(0)
+            batched.difference_update(range(150, 160))
+            assert 150 not in batched
+            assert 199 in batched
+            # reading the minimum brings the sorted structure up to date
+            assert batched.min() == 1
+            batched.update([500])
+            with batched.batch():
+                batched.discard(500)
+        assert len(batched) == 188
+        assert (batched.min(), batched.max()) == (1, 199)
+        assert sorted(batched) == list(batched._sorted)
+        assert not batched._pending_added and not batched._pending_removed
+        batched.remove_ge(150)
+        assert batched.max() == 149
+
+    def test_snapshot_iteration(self):
+        changing = self.hundred.copy()
+        snapshot = changing.snapshot()
+        for item in changing:
+            changing.discard(item)
+            changing.add(item + 1000)
+        assert len(changing) == 100
+        assert changing.min() == 1001
+        assert list(snapshot) == list(range(1, 101))
+
+    @Utils.if_long_test_run()
+    def test_threaded_iteration(self):
+        """tests that iterating while another thread changes the set doesn't fail"""
+        changing = self.set_class(range(10000))
+        errors = []
+        stop = threading.Event()
+        def mutate():
+            n = 10000
+            while not stop.is_set():
+                changing.add(n)
+                changing.discard(n - 10000)
+                n += 1
+        def iterate():
+            try:
+                for i in range(50):
+                    items = list(changing)
+                    assert len(items) >= 9999
+                    assert items == sorted(items)
+            except Exception as e:
+                errors.append(e)
+        mutator = threading.Thread(target=mutate)
+        mutator.start()
+        readers = [threading.Thread(target=iterate) for i in range(4)]
+        for reader in readers:
+            reader.start()
+        for reader in readers:
+            reader.join()
+        stop.set()
+        mutator.join()
+        assert not errors
+
+class TestFastSemiSortedSet(TestSemiSortedSet):
+    set_class = SemiSortedSet.FastSemiSortedSet
+
+    def test_unwrapped(self):
+        assert SemiSortedSet.FastSemiSortedSet.__contains__ is set.__contains__
+        assert SemiSortedSet.FastSemiSortedSet.issubset is set.issubset
+        assert SemiSortedSet.SemiSortedSet.__contains__ is not set.__contains__
+
+@Utils.if_long_test_run()
+def test_operation_cost():
+    """compares the per-operation cost of the SemiSortedSet classes to a plain set"""
+    repeat = 20000
+    operations = [
+        ("contains", lambda s: [n in s for n in range(repeat)]),
+        ("len", lambda s: [len(s) for n in range(repeat)]),
+        ("issubset", lambda s: [s.issubset(s) for n in range(repeat // 100)]),
+        ("add/discard", lambda s: [(s.add(n), s.discard(n)) for n in range(repeat, 2 * repeat)]),
+    ]
+    results = {}
+    for set_class in (set, SemiSortedSet.SemiSortedSet, SemiSortedSet.FastSemiSortedSet):
+        test_set = set_class(range(repeat))
+        for name, operation in operations:
+            start_time = time.time()
+            operation(test_set)
+            results[set_class.__name__, name] = (time.time() - start_time) / repeat * 1e6
+    print("operation      set     SemiSortedSet  FastSemiSortedSet (microseconds per operation)")
+    for name, operation in operations:
+        print("%-12s %8.3f %12.3f %12.3f" % (name, results["set", name], results["SemiSortedSet", name], results["FastSemiSortedSet", name]))
+    assert results["FastSemiSortedSet", "contains"] < results["SemiSortedSet", "contains"]
+
+class TestNumericSemiSortedSet(object):
+    def test_basic(self):
+        numeric = SemiSortedSet.NumericSemiSortedSet([5, 3.5, 10])
+        assert len(numeric) == 3
+        assert 5 in numeric
+        assert 3.5 in numeric
+        assert 4 not in numeric
+        assert "5" not in numeric
+        assert list(numeric) == [3.5, 5.0, 10.0]
+        numeric.add(1)
+        numeric.add(1)
+        numeric.add(20)
+        assert len(numeric) == 5
+        assert (numeric.min(), numeric.max()) == (1, 20)
+        numeric.discard(1)
+        numeric.discard(3.5)
+        numeric.discard(2)
+        assert (numeric.min(), numeric.max()) == (5, 20)
+        assert Utils.raises(KeyError, numeric.remove, 2)
+        assert Utils.raises(TypeError, numeric.add, "a")
+        assert Utils.raises(ValueError, numeric.add, float("nan"))
+        assert numeric == set([5, 10, 20])
+        assert numeric.pop() == 20
+        numeric.clear()
+        assert not numeric
+        assert Utils.raises(ValueError, numeric.min)
+
+    def test_buffer_merge(self):
+        rand = random.Random(84)
+        values = [rand.randint(0, 100000) for n in range(5000)]
+        numeric = SemiSortedSet.NumericSemiSortedSet(typecode="q")
+        for value in values:
+            numeric.add(value)
+        assert len(numeric) == len(set(values))
+        assert list(numeric) == sorted(set(values))
+        assert numeric.min() == min(values)
+        assert Utils.raises(TypeError, numeric.add, 1.5)
+
+    def test_ranges(self):
+        numeric = SemiSortedSet.NumericSemiSortedSet(range(0, 100), typecode="q")
+        numeric.add(150)
+        assert list(numeric.irange(10, 13)) == [10, 11, 12, 13]
+        assert list(numeric.irange(10, 13, inclusive=(False, False), reverse=True)) == [12, 11]
+        assert numeric.bisect_left(10) == 10
+        assert numeric.bisect_right(10) == 11
+        numeric.remove_lt(10)
+        numeric.remove_ge(150)
+        numeric.remove_gt(90)
+        numeric.remove_le(10)
+        assert (numeric.min(), numeric.max(), len(numeric)) == (11, 90, 80)
+        numeric.remove_cmp_op(lambda item, divisor: item % divisor == 0, 2)
+        assert list(numeric) == list(range(11, 90, 2))
+        copied = numeric.copy()
+        copied.bulk_discard(range(0, 50))
+        assert copied.min() == 51
+        assert numeric.min() == 11
+        numeric.bulk_add(range(200, 300), presorted=True)
+        assert numeric.max() == 299
+        numeric.update([1], [2])
+        numeric.difference_update([2])
+        assert numeric.min() == 1
+
+    def test_integral_floats(self):
+        numeric = SemiSortedSet.NumericSemiSortedSet([3], typecode="q")
+        assert 3.0 in numeric
+        assert 3.5 not in numeric
+        numeric.add(4.0)
+        assert list(numeric) == [3, 4]
+        assert isinstance(numeric.max(), int)
+        numeric.discard(3.0)
+        assert list(numeric) == [4]
+        assert Utils.raises(TypeError, numeric.add, float("inf"))
+
+    def test_out_of_range(self):
+        numeric = SemiSortedSet.NumericSemiSortedSet([1, 2], typecode="q")
+        numeric.add(3)
+        assert Utils.raises(TypeError, numeric.add, 2 ** 70)
+        assert 2 ** 70 not in numeric
+        assert (len(numeric), numeric.min(), numeric.max()) == (3, 1, 3)
+        assert Utils.raises(TypeError, SemiSortedSet.NumericSemiSortedSet(typecode="B").add, -1)
+        floats = SemiSortedSet.NumericSemiSortedSet([1.5])
+        assert 10 ** 400 not in floats
+        assert Utils.raises(TypeError, floats.add, 10 ** 400)
+        big = SemiSortedSet.make_semi_sorted_set([1, 2 ** 70])
+        assert isinstance(big, SemiSortedSet.SemiSortedSet)
+        assert big.max() == 2 ** 70
+        assert isinstance(numeric.union([2 ** 70]), SemiSortedSet.SemiSortedSet)
+        assert list(floats.union([10 ** 400])) == [1.5, 10 ** 400]
+
+    def test_set_methods(self):
+        a = SemiSortedSet.NumericSemiSortedSet([1, 2, 3, 4], typecode="q")
+        b = SemiSortedSet.NumericSemiSortedSet([3, 4, 5], typecode="q")
+        assert list(a.union(b, [10])) == [1, 2, 3, 4, 5, 10]
+        assert a.union(b).typecode == "q"
+        assert a.union([2.5]).typecode == "d"
+        assert isinstance(SemiSortedSet.NumericSemiSortedSet().union(["x"]), SemiSortedSet.SemiSortedSet)
+        assert list(a.intersection(b, iter([4, 5]))) == [4]
+        assert a.intersection([7]).typecode == "q"
+        assert list(a.difference(b)) == [1, 2]
+        assert list(a.difference([1], set([2]))) == [3, 4]
+        assert list(a.symmetric_difference(iter([4, 5]))) == [1, 2, 3, 5]
+        assert a.issubset(range(10))
+        assert not a.issubset(b)
+        assert a.issuperset([1, 2])
+        assert not a.issuperset(b)
+        a.intersection_update(range(2, 10), [2, 3, 4])
+        assert list(a) == [2, 3, 4]
+        a.symmetric_difference_update([4, 6])
+        assert list(a) == [2, 3, 6]
+        assert list(b) == [3, 4, 5]
+
+    def test_snapshot(self):
+        numeric = SemiSortedSet.NumericSemiSortedSet(range(10), typecode="q")
+        snapshot = numeric.snapshot()
+        for item in numeric:
+            numeric.discard(item)
+        numeric.add(20)
+        assert list(snapshot) == list(range(10))
+        assert list(numeric) == [20]
+
+    def test_timestamps(self):
+        window = SemiSortedSet.NumericSemiSortedSet()
+        for n in range(5000):
+            window.add(1.5e9 + n * 0.1)
+            window.remove_lt(1.5e9 + (n - 100) * 0.1)
+        assert len(window) == 101
+        assert window.max() == 1.5e9 + 4999 * 0.1
+
+    def test_make_semi_sorted_set(self):
+        ints = SemiSortedSet.make_semi_sorted_set([1, 2, 3])
+        assert isinstance(ints, SemiSortedSet.NumericSemiSortedSet)
+        assert ints.typecode == "q"
+        floats = SemiSortedSet.make_semi_sorted_set([1, 2.5])
+        assert floats.typecode == "d"
+        dates = SemiSortedSet.make_semi_sorted_set([ORWELL, SPACE])
+        assert isinstance(dates, SemiSortedSet.SemiSortedSet)
+        assert isinstance(SemiSortedSet.make_semi_sorted_set(), SemiSortedSet.SemiSortedSet)
+        assert isinstance(SemiSortedSet.make_semi_sorted_set(typecode="d"), SemiSortedSet.NumericSemiSortedSet)
+        mixed = ints | set([2.5])
+        assert mixed.typecode == "d"
+        assert list(mixed) == [1, 2, 2.5, 3]
+        assert isinstance(ints & set([1, 5]), SemiSortedSet.NumericSemiSortedSet)
+        assert copy.copy(ints) == ints
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+
+"""Tests the SortedList code"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from future import standard_library
+standard_library.install_aliases()
+from builtins import range
+from builtins import *
+from builtins import object
+from j5basic import SortedList
+from j5test import Utils
+import random
+
+class TestSortedList(object):
+    def test_add_remove(self):
+        sl = SortedList.SortedList([5, 3, 9], load=2)
+        assert list(sl) == [3, 5, 9]
+        sl.add(4)
+        sl.add(10)
+        sl.add(0)
+        assert list(sl) == [0, 3, 4, 5, 9, 10]
+        assert list(reversed(sl)) == [10, 9, 5, 4, 3, 0]
+        assert len(sl) == 6
+        assert sl[0] == 0
+        assert sl[-1] == 10
+        assert sl[3] == 5
+        assert sl[-2] == 9
+        assert 4 in sl
+        assert 6 not in sl
+        assert 11 not in sl
+        sl.remove(4)
+        assert sl.discard(4) is False
+        assert Utils.raises(ValueError, sl.remove, 4)
+        assert Utils.raises(IndexError, sl.__getitem__, 5)
+        assert list(sl) == [0, 3, 5, 9, 10]
+
+    def test_update(self):
+        sl = SortedList.SortedList(load=4)
+        sl.update([5, 1, 3])
+        sl.update([7, 6])
+        sl.update(range(8, 20), presorted=True)
+        sl.update([2, 4, 0])
+        sl.update([30])
+        assert list(sl) == [0, 1, 2, 3, 4, 5, 6, 7] + list(range(8, 20)) + [30]
+        assert all(len(chunk) <= 8 for chunk in sl._lists)
+        assert sl._maxes == [chunk[-1] for chunk in sl._lists]
+        sl.update(range(-10, 40, 3), presorted=True)
+        assert list(sl) == sorted([0, 1, 2, 3, 4, 5, 6, 7] + list(range(8, 20)) + [30] + list(range(-10, 40, 3)))
+
+    def test_copy(self):
+        sl = SortedList.SortedList(range(10), load=2)
+        copied = sl.copy()
+        copied.remove(5)
+        sl.add(20)
+        assert list(sl) == list(range(10)) + [20]
+        assert list(copied) == [0, 1, 2, 3, 4, 6, 7, 8, 9]
+
+    def test_snapshot(self):
+        sl = SortedList.SortedList(range(20), load=2)
+        snapshot = sl.snapshot()
+        sl.add(5.5)
+        sl.remove(10)
+        sl.pop_range(15)
+        sl.update([-1])
+        assert list(snapshot) == list(range(20))
+        assert list(sl) == [-1, 0, 1, 2, 3, 4, 5, 5.5, 6, 7, 8, 9, 11, 12, 13, 14]
+        assert list(snapshot.irange(9, 11)) == [9, 10, 11]
+        assert snapshot.bisect_left(10) == 10
+        assert Utils.raises(TypeError, snapshot.add, 1)
+        assert Utils.raises(TypeError, snapshot.pop_range)
+        copied = snapshot.copy()
+        copied.add(100)
+        assert list(copied) == list(range(20)) + [100]
+        assert len(snapshot) == 20
+        # unchanged chunks are still shared, changed ones have been copied
+        assert snapshot._lists[1] is sl._lists[1]
+        assert snapshot._lists[0] is not sl._lists[0]
+
+    def test_random_operations(self):
+        """checks that a SortedList stays consistent with a sorted list through random changes"""
+        rand = random.Random(1984)
+        sl = SortedList.SortedList(load=4)
+        expected = []
+        for i in range(2000):
+            value = rand.randint(0, 200)
+            if value in expected and rand.random() < 0.6:
+                sl.remove(value)
+                expected.remove(value)
+            elif rand.random() < 0.05:
+                values = [rand.randint(0, 200) for n in range(rand.randint(0, 40))]
+                sl.update(values)
+                expected.extend(values)
+            elif rand.random() < 0.05:
+                values = [rand.randint(0, 200) for n in range(rand.randint(0, 40))]
+                sl.difference_update(values)
+                expected = [value for value in expected if value not in values]
+            else:
+                sl.add(value)
+                expected.append(value)
+            expected.sort()
+            assert len(sl) == len(expected)
+            if expected:
+                assert sl[0] == expected[0]
+                assert sl[-1] == expected[-1]
+        assert list(sl) == expected
+        assert all(len(chunk) <= 8 for chunk in sl._lists)
+        assert sl._maxes == [chunk[-1] for chunk in sl._lists]
+
+    def test_ranges(self):
+        sl = SortedList.SortedList(range(0, 100, 2), load=4)
+        assert list(sl.irange(10, 20)) == [10, 12, 14, 16, 18, 20]
+        assert list(sl.irange(9, 21)) == [10, 12, 14, 16, 18, 20]
+        assert list(sl.irange(10, 20, inclusive=(False, False))) == [12, 14, 16, 18]
+        assert list(sl.irange(10, 20, reverse=True)) == [20, 18, 16, 14, 12, 10]
+        assert list(sl.irange(maximum=4)) == [0, 2, 4]
+        assert list(sl.irange(minimum=95)) == [96, 98]
+        assert list(sl.irange(20, 10)) == []
+        assert sl.bisect_left(10) == 5
+        assert sl.bisect_right(10) == 6
+        assert sl.bisect_left(11) == sl.bisect_right(11) == 6
+        assert sl.bisect_left(1000) == 50
+        assert sl.pop_range(10, 30, inclusive=(True, False)) == list(range(10, 30, 2))
+        assert sl.pop_range(maximum=3) == [0, 2]
+        assert sl.pop_range(minimum=90, inclusive=(False, True)) == [92, 94, 96, 98]
+        assert sl.pop_range(50, 40) == []
+        assert list(sl) == [4, 6, 8] + list(range(30, 91, 2))
+        assert sl._maxes == [chunk[-1] for chunk in sl._lists]
+        assert all(sl._lists)
+        assert sl.pop_range() == [4, 6, 8] + list(range(30, 91, 2))
+        assert not sl
+
+    def test_random_ranges(self):
+        """checks range removal against list comprehensions"""
+        rand = random.Random(2001)
+        for i in range(200):
+            values = sorted(set(rand.randint(0, 300) for n in range(rand.randint(0, 150))))
+            sl = SortedList.SortedList(values, load=rand.randint(1, 8))
+            minimum, maximum = rand.randint(-10, 310), rand.randint(-10, 310)
+            inclusive = (rand.random() < 0.5, rand.random() < 0.5)
+            expected = [value for value in values if (minimum < value or (inclusive[0] and minimum == value)) and
+                                                     (value < maximum or (inclusive[1] and value == maximum))]
+            assert list(sl.irange(minimum, maximum, inclusive)) == expected
+            assert sl.pop_range(minimum, maximum, inclusive) == expected
+            assert list(sl) == [value for value in values if value not in expected]
+            assert sl._maxes == [chunk[-1] for chunk in sl._lists]
+            assert all(sl._lists)
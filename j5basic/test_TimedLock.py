@@ -11,6 +11,7 @@ from builtins import range
 from builtins import *
 from builtins import object
 from j5basic import TimedLock
+from j5basic import FakeClock
 from j5.OS import ThreadControl
 try:
     from j5.OS import ThreadControl
@@ -180,3 +181,167 @@ class TestTimedLock(object):
         # check that we didn't wait very long to catch the event
         assert bt2_ea.ts - bt1_er.ts < 1.11
 
+
+    def test_fair_order(self):
+        """tests that in fair mode waiting threads get the lock in the order they asked for it"""
+        lock = TimedLock.TimedLock(fair=True)
+        lock.acquire()
+        order = []
+        go = threading.Event()
+        def acquire_and_record(n, wait):
+            if lock.acquire(wait):
+                order.append(n)
+                go.wait(1)
+                lock.release()
+        threads = []
+        for n in range(5):
+            thread = threading.Thread(target=acquire_and_record, name="bt%d" % n, args=(n, True if n % 2 else 5))
+            thread.start()
+            threads.append(thread)
+            # wait until this thread is queued before starting the next one
+            for attempt in range(100):
+                if len(lock._waiters) == n + 1:
+                    break
+                time.sleep(0.01)
+        lock.release()
+        # the lock has been handed straight to the first waiter, so can't be taken ahead of it
+        assert not lock.acquire(False)
+        go.set()
+        for thread in threads:
+            thread.join(1)
+        assert order == [0, 1, 2, 3, 4]
+
+    def test_fair_timeout(self):
+        """tests that in fair mode a timed wait gives up, and leaves the queue, if the lock isn't released in time"""
+        lock = TimedLock.TimedLock(fair=True)
+        lock.acquire()
+        results = []
+        thread = threading.Thread(target=lambda: results.append(lock.acquire(0.1)))
+        thread.start()
+        thread.join(1)
+        assert results == [False]
+        assert len(lock._waiters) == 0
+        lock.release()
+        assert lock.acquire(False)
+        lock.release()
+
+    def test_fair_reentrant(self):
+        """tests that fair locks are reentrant, and can be used with the with statement and a Condition"""
+        lock = TimedLock.TimedLock(fair=True)
+        with lock:
+            assert lock.acquire(False)
+            assert lock.acquire(0.1)
+            lock.release()
+            lock.release()
+        assert Utils.raises(RuntimeError, lock.release)
+        condition = threading.Condition(lock)
+        notified = []
+        def notify():
+            with condition:
+                notified.append(True)
+                condition.notify()
+        with condition:
+            lock.acquire()
+            threading.Thread(target=notify).start()
+            condition.wait(1)
+            assert lock._fair_count == 2
+            lock.release()
+        assert notified == [True]
+
+    def test_fair_own_state(self):
+        """tests that fair mode keeps its own state, rather than the base class internals (which are name-mangled on Python 2)"""
+        def hidden(self):
+            raise AttributeError("base class internals aren't available")
+        def ignore(self, value):
+            pass
+        class HiddenInternalsLock(TimedLock.TimedLock):
+            _owner = _count = _block = property(hidden, ignore)
+        lock = HiddenInternalsLock(fair=True, instrument=True)
+        assert lock.acquire()
+        assert lock.acquire(False)
+        lock.release()
+        lock.release()
+        assert lock.stats.acquisitions == 1
+        assert lock.stats.owner_name is None
+        condition = threading.Condition(lock)
+        with condition:
+            condition.wait(0.01)
+
+    def test_fair_time_function(self):
+        """tests that fair timed waits measure the elapsed time with the given time function"""
+        now = [1000.0]
+        def fake_time():
+            # each check of the time jumps forward a second
+            now[0] += 1
+            return now[0]
+        lock = TimedLock.TimedLock(time_function=fake_time, fair=True)
+        lock.acquire()
+        results = []
+        start_time = time.time()
+        thread = threading.Thread(target=lambda: results.append(lock.acquire(1.5)))
+        thread.start()
+        thread.join(3)
+        assert results == [False]
+        # the fake time runs out after one real wait of 1.5 seconds, rather than after checking again
+        assert time.time() - start_time < 2.5
+        lock.release()
+
+class TestLockStats(object):
+    def test_hold_and_wait(self):
+        """tests that an instrumented lock records how long it was held, and where from"""
+        clock = FakeClock.FakeClock()
+        lock = TimedLock.TimedLock(time_function=clock, instrument=True, name="test_hold_and_wait")
+        lock.acquire()
+        lock.acquire()
+        clock.now += 0.5
+        stats = lock.stats.as_dict(clock())
+        assert stats["acquisitions"] == 1
+        assert stats["owner"] == threading.currentThread().getName()
+        assert "test_hold_and_wait" in stats["acquired_site"]
+        assert stats["held_for"] == 0.5
+        lock.release()
+        assert lock.stats.owner_name is not None
+        lock.release()
+        stats = lock.stats.as_dict(clock())
+        assert stats["owner"] is None and stats["held_for"] is None
+        assert stats["hold_histogram"] == [0, 0, 0, 1, 0, 0]
+        assert stats["wait_histogram"] == [1, 0, 0, 0, 0, 0]
+        assert stats["max_hold"] == 0.5
+        with lock:
+            clock.now += 20
+        assert lock.stats.hold_times.counts == [0, 0, 0, 1, 0, 1]
+        assert lock.stats.acquisitions == 2
+
+    def test_failures(self):
+        """tests that timeouts and failed non-blocking acquires are counted"""
+        for fair in (False, True):
+            lock = TimedLock.TimedLock(instrument=True, fair=fair)
+            lock.acquire()
+            results = []
+            def try_acquire():
+                results.append(lock.acquire(False))
+                results.append(lock.acquire(0.05))
+            thread = threading.Thread(target=try_acquire)
+            thread.start()
+            thread.join(1)
+            assert results == [False, False]
+            assert lock.stats.busy == 1
+            assert lock.stats.timeouts == 1
+            lock.release()
+
+    def test_registry(self):
+        """tests that instrumented locks can be dumped, and long holders found"""
+        clock = FakeClock.FakeClock()
+        held = TimedLock.TimedLock(time_function=clock, instrument=True, name="test_registry held")
+        free = TimedLock.TimedLock(time_function=clock, instrument=True, name="test_registry free")
+        plain = TimedLock.TimedLock()
+        held.acquire()
+        clock.now += 30
+        names = [lock_dump["name"] for lock_dump in TimedLock.dump_lock_stats()]
+        assert "test_registry held" in names and "test_registry free" in names
+        assert plain not in TimedLock.instrumented_locks()
+        long_holders = TimedLock.find_long_holders(10)
+        assert [lock_dump["name"] for lock_dump in long_holders if lock_dump["name"].startswith("test_registry")] == ["test_registry held"]
+        assert long_holders[0]["held_for"] >= 30
+        held.release()
+        assert not [lock_dump for lock_dump in TimedLock.find_long_holders(10) if lock_dump["name"].startswith("test_registry")]
@@ -10,6 +10,7 @@ from builtins import next
 from builtins import *
 from builtins import object
 from j5basic import Timer
+from j5basic import FakeClock
 from j5test import Utils
 import threading
 import time
@@ -129,3 +130,420 @@ class TestTimer(object):
         assert tm.lasttime is None
         self.finish_wait(thread, tm.errors)
 
+
+class TestTimerScheduler(object):
+    def test_many_timers(self):
+        """tests that one scheduler thread and a few workers can run many timers"""
+        clock = FakeClock.FakeClock()
+        ticks = [[] for n in range(50)]
+        scheduler, start = virtual_scheduler(clock, workers=2)
+        for timer_ticks in ticks:
+            scheduler.add(Timer.Timer(timer_ticks.append, args=(1,), clock=clock))
+        threads_before = threading.active_count()
+        thread = start()
+        try:
+            for n in range(3):
+                advance(clock, 1, scheduler.wakeup_event, scheduled(scheduler, 50))
+            assert threading.active_count() <= threads_before + 1 + 2 + 3
+        finally:
+            scheduler.stop = True
+            thread.join()
+        assert [len(timer_ticks) for timer_ticks in ticks] == [4] * 50
+
+    def test_slow_target(self):
+        """tests that a slow target misses its own ticks without delaying other timers"""
+        clock = FakeClock.FakeClock()
+        fast_times, slow_times = [], []
+        slow_finish = threading.Event()
+        def slow_target():
+            slow_times.append(clock.now)
+            if len(slow_times) == 1:
+                assert slow_finish.wait(5)
+        scheduler, start = virtual_scheduler(clock, workers=2)
+        scheduler.add(Timer.Timer(lambda: fast_times.append(clock.now), clock=clock))
+        slow_timer = scheduler.add(Timer.Timer(slow_target, clock=clock, instrument=True))
+        thread = start(running=1)
+        try:
+            # the slow timer's first run holds on to it until 1002.5, so its ticks at 1001 and 1002 are missed
+            advance(clock, 1, scheduler.wakeup_event, scheduled(scheduler, 1))
+            advance(clock, 1, scheduler.wakeup_event, scheduled(scheduler, 1))
+            advance(clock, 0.5, scheduler.wakeup_event, scheduled(scheduler, 1))
+            slow_finish.set()
+            wait_for(scheduled(scheduler, 2))
+            advance(clock, 0.5, scheduler.wakeup_event, scheduled(scheduler, 2))
+        finally:
+            scheduler.stop = True
+            thread.join()
+        assert fast_times == [1000.0, 1001.0, 1002.0, 1003.0]
+        assert slow_times == [1000.0, 1003.0]
+        assert slow_timer.stats.missed_ticks == 2
+
+    def test_stop_timer(self):
+        """tests that stopping a timer removes it from the scheduler"""
+        clock = FakeClock.FakeClock()
+        stopped_ticks, running_ticks = [], []
+        scheduler, start = virtual_scheduler(clock)
+        stopped_timer = scheduler.add(Timer.Timer(stopped_ticks.append, args=(1,), clock=clock))
+        scheduler.add(Timer.Timer(running_ticks.append, args=(1,), clock=clock))
+        thread = start()
+        try:
+            advance(clock, 1, scheduler.wakeup_event, scheduled(scheduler, 2))
+            stopped_timer.stop = True
+            advance(clock, 1, scheduler.wakeup_event, scheduled(scheduler, 1))
+            advance(clock, 1, scheduler.wakeup_event, scheduled(scheduler, 1))
+        finally:
+            scheduler.stop = True
+            thread.join()
+        assert len(stopped_ticks) == 2
+        assert len(running_ticks) == 4
+
+    def test_errors(self):
+        """tests that an error in a target is logged, and the timer keeps running"""
+        clock = FakeClock.FakeClock()
+        ticks = []
+        def fail():
+            ticks.append(clock.now)
+            raise ValueError("failing target")
+        scheduler, start = virtual_scheduler(clock)
+        scheduler.add(Timer.Timer(fail, clock=clock))
+        thread = start()
+        try:
+            advance(clock, 1, scheduler.wakeup_event, scheduled(scheduler, 1))
+            advance(clock, 1, scheduler.wakeup_event, scheduled(scheduler, 1))
+        finally:
+            scheduler.stop = True
+            thread.join()
+        assert ticks == [1000.0, 1001.0, 1002.0]
+
+class WatchedEvent(object):
+    """an Event that knows whether a thread is blocked waiting for it, so a test can tell when a timer has caught up with its clock"""
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self.waiters = 0
+
+    def set(self):
+        self._event.set()
+
+    def clear(self):
+        self._event.clear()
+
+    def is_set(self):
+        return self._event.is_set()
+
+    def wait(self, timeout=None):
+        with self._lock:
+            self.waiters += 1
+        try:
+            return self._event.wait(timeout)
+        finally:
+            with self._lock:
+                self.waiters -= 1
+
+    def idle(self):
+        return self.waiters > 0 and not self._event.is_set()
+
+def wait_for(condition, timeout=5):
+    """waits until condition() is true, failing if that takes longer than timeout real seconds"""
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timed out waiting for %s" % condition
+        time.sleep(0.001)
+
+def start_thread(target, event, condition=None):
+    """runs target (a start method) in a thread, returning once it is waiting on event (and condition() is true)"""
+    thread = threading.Thread(target=target)
+    thread.start()
+    wait_for(lambda: (condition is None or condition()) and event.idle())
+    return thread
+
+def scheduled(scheduler, count):
+    """returns a condition that is true when count timers are waiting in the scheduler for their next run
+    (so none of them is running, or about to be rescheduled)"""
+    return lambda: len(scheduler._heap) == count
+
+def virtual_scheduler(clock, workers=4):
+    """returns a scheduler on the given virtual clock, and a function that starts it in a thread once its timers are added,
+    returning once their first runs are over (except for as many as are given, which are still running)"""
+    scheduler = Timer.TimerScheduler(workers=workers, clock=clock)
+    scheduler.wakeup_event = WatchedEvent()
+    def start(running=0):
+        return start_thread(scheduler.start, scheduler.wakeup_event, scheduled(scheduler, len(scheduler._heap) - running))
+    return scheduler, start
+
+def advance(clock, seconds, event, condition=None):
+    """moves the clock on, wakes up whatever is waiting on event, and waits until it is waiting again (and condition() is true)"""
+    clock.now += seconds
+    event.set()
+    wait_for(lambda: (condition is None or condition()) and event.idle())
+
+class TestMonotonicTimer(object):
+    def test_virtual_clock(self):
+        """tests running from an injected clock, including skipping missed ticks"""
+        clock = FakeClock.FakeClock()
+        run_times = []
+        class RecordingTimer(Timer.Timer):
+            def setup_run(self, target_time):
+                run_times.append(target_time)
+        timer = RecordingTimer(lambda: None, clock=clock)
+        assert timer.monotonic
+        timer.interrupt_event = WatchedEvent()
+        thread = start_thread(timer.start, timer.interrupt_event)
+        try:
+            advance(clock, 0.5, timer.interrupt_event)
+            assert run_times == []
+            advance(clock, 0.5, timer.interrupt_event)
+            advance(clock, 1, timer.interrupt_event)
+            # the tick at 1003 runs late, and the one at 1004 is skipped
+            advance(clock, 2.5, timer.interrupt_event)
+            advance(clock, 0.25, timer.interrupt_event)
+            assert run_times == [1001.0, 1002.0, 1003.0]
+            advance(clock, 0.25, timer.interrupt_event)
+            assert run_times == [1001.0, 1002.0, 1003.0, 1005.0]
+        finally:
+            timer.stop = True
+            thread.join()
+
+    def test_skip_missed(self):
+        """tests that the missed tick arithmetic matches for datetimes and floats"""
+        float_timer = Timer.Timer(None, resolution=2, monotonic=True)
+        datetime_timer = Timer.Timer(None, resolution=2)
+        assert float_timer.skip_missed(100.0, 100.5) == 102.0
+        assert float_timer.skip_missed(100.0, 107.0) == 108.0
+        start = Timer.datetime_tz.datetime_tz.now()
+        assert datetime_timer.skip_missed(start, start + Timer.datetime_tz.timedelta(seconds=7)) == start + Timer.datetime_tz.timedelta(seconds=8)
+
+    def test_scheduled_time(self):
+        """tests that the scheduled time is passed to the target as a datetime when asked for"""
+        received = []
+        timer = Timer.Timer(lambda scheduled: received.append(scheduled), monotonic=True, scheduled_time_kwarg="scheduled")
+        before = Timer.datetime_tz.datetime_tz.now()
+        timer.execute_run(timer.now())
+        after = Timer.datetime_tz.datetime_tz.now()
+        assert isinstance(received[0], Timer.datetime_tz.datetime_tz)
+        assert before - Timer.datetime_tz.timedelta(seconds=0.01) <= received[0] <= after
+
+    def test_scheduler(self):
+        """tests that monotonic and datetime timers can share a scheduler"""
+        clock = FakeClock.FakeClock()
+        start_datetime = Timer.datetime_tz.datetime_tz.now()
+        target_times = []
+        class RecordingTimer(Timer.Timer):
+            def setup_run(self, target_time):
+                target_times.append(target_time)
+        scheduler, start = virtual_scheduler(clock)
+        scheduler.add(RecordingTimer(lambda: None, clock=clock))
+        datetime_timer = RecordingTimer(lambda: None)
+        # the datetime timer's wall clock follows the virtual clock
+        datetime_timer.now = lambda: start_datetime + Timer.datetime_tz.timedelta(seconds=clock.now - 1000)
+        scheduler.add(datetime_timer)
+        thread = start()
+        try:
+            advance(clock, 1, scheduler.wakeup_event, scheduled(scheduler, 2))
+            advance(clock, 1, scheduler.wakeup_event, scheduled(scheduler, 2))
+        finally:
+            scheduler.stop = True
+            thread.join()
+        monotonic_times = [target_time for target_time in target_times if isinstance(target_time, float)]
+        datetime_times = [target_time for target_time in target_times if not isinstance(target_time, float)]
+        assert monotonic_times == [1000.0, 1001.0, 1002.0]
+        assert datetime_times == [start_datetime + Timer.datetime_tz.timedelta(seconds=n) for n in range(3)]
+
+class TestTimerStats(object):
+    def test_run_stats(self):
+        """tests that latency, execution time, overruns and missed ticks are recorded"""
+        clock = FakeClock.FakeClock()
+        def slow_target():
+            clock.now += 2
+        timer = Timer.Timer(slow_target, clock=clock, instrument=True)
+        clock.now = 1000.5
+        timer.run(1000.0)
+        assert timer.skip_missed(1001.0, 1004.5) == 1005.0
+        stats = timer.stats.as_dict()
+        assert stats["runs"] == 1
+        assert stats["overruns"] == 1
+        assert stats["missed_ticks"] == 4
+        assert stats["latency_histogram"] == [0, 0, 0, 1, 0, 0]
+        assert stats["execution_histogram"] == [0, 0, 0, 0, 1, 0]
+        assert stats["mean_latency"] == 0.5
+        assert stats["max_execution"] == 2
+
+    def test_keeping_up(self):
+        """tests that a timer whose target keeps up reports no missed ticks"""
+        clock = FakeClock.FakeClock()
+        timer = Timer.Timer(lambda: None, clock=clock, instrument=True)
+        timer.interrupt_event = WatchedEvent()
+        thread = start_thread(timer.start, timer.interrupt_event)
+        try:
+            for n in range(3):
+                advance(clock, 1, timer.interrupt_event)
+        finally:
+            timer.stop = True
+            thread.join()
+        stats = timer.stats.as_dict()
+        assert stats["runs"] == 3
+        assert stats["missed_ticks"] == 0
+
+    @Utils.if_long_test_run()
+    def test_subsecond(self):
+        """tests a 20ms resolution with drift compensation"""
+        driver = TimerDriver(0.02)
+        timer = Timer.Timer(driver.timefunc, resolution=0.02, monotonic=True, compensate_drift=True, instrument=True)
+        thread = threading.Thread(target=timer.start)
+        thread.start()
+        time.sleep(0.5)
+        timer.stop = True
+        thread.join()
+        stats = timer.stats.as_dict()
+        assert 20 <= stats["runs"] <= 26
+        assert stats["mean_latency"] < 0.005
+
+    @Utils.if_long_test_run()
+    def test_drift_compensator(self):
+        """tests that the compensator learns how long waits oversleep, and wakes up that much earlier"""
+        compensator = Timer.DriftCompensator(weight=1)
+        event = threading.Event()
+        class SlowEvent(object):
+            def wait(self, seconds):
+                time.sleep(seconds + 0.01)
+                return False
+        compensator.wait(SlowEvent(), 0.02)
+        assert 0.009 <= compensator.oversleep < 0.02
+        start_time = time.time()
+        assert not compensator.wait(event, 0.05)
+        assert 0.05 <= time.time() - start_time < 0.058
+        event.set()
+        assert compensator.wait(event, 1)
+
+class TestOverlapPolicies(object):
+    def test_unknown_policy(self):
+        """tests that an unknown overlap policy is rejected"""
+        try:
+            Timer.Timer(None, overlap="sometimes")
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("an unknown overlap policy should be rejected")
+
+    def test_skip_coalesced(self):
+        """tests that skipped ticks are counted and passed to the next run"""
+        clock = FakeClock.FakeClock()
+        runs = []
+        def target(missed):
+            runs.append(missed)
+            if len(runs) == 1:
+                # the first run overruns the ticks at 1002 and 1003
+                clock.now += 2.5
+        timer = Timer.Timer(target, clock=clock, missed_count_kwarg="missed")
+        timer.interrupt_event = WatchedEvent()
+        thread = start_thread(timer.start, timer.interrupt_event)
+        try:
+            advance(clock, 1, timer.interrupt_event)
+            advance(clock, 0.5, timer.interrupt_event)
+            advance(clock, 1, timer.interrupt_event)
+        finally:
+            timer.stop = True
+            thread.join()
+        assert runs == [0, 2, 0]
+
+    def test_queue(self):
+        """tests that every tick runs, late if need be"""
+        clock = FakeClock.FakeClock()
+        target_times = []
+        class RecordingTimer(Timer.Timer):
+            def setup_run(self, target_time):
+                target_times.append(target_time)
+        def target():
+            if len(target_times) == 1:
+                # the first run overruns the ticks at 1002 and 1003
+                clock.now += 2.5
+        timer = RecordingTimer(target, clock=clock, overlap=Timer.OVERLAP_QUEUE)
+        timer.interrupt_event = WatchedEvent()
+        thread = start_thread(timer.start, timer.interrupt_event)
+        try:
+            advance(clock, 1, timer.interrupt_event)
+            assert target_times == [1001.0, 1002.0, 1003.0]
+            advance(clock, 0.5, timer.interrupt_event)
+        finally:
+            timer.stop = True
+            thread.join()
+        assert target_times == [1001.0, 1002.0, 1003.0, 1004.0]
+
+    def test_concurrent(self):
+        """tests that slow runs overlap, up to max_concurrency at once"""
+        clock = FakeClock.FakeClock()
+        lock = threading.Lock()
+        started, running, max_running, finished = [], [], [], []
+        finish = threading.Event()
+        class RecordingTimer(Timer.Timer):
+            def _run_concurrently(self, target_time, missed_count):
+                Timer.Timer._run_concurrently(self, target_time, missed_count)
+                finished.append(target_time)
+        def target(missed):
+            with lock:
+                started.append(missed)
+                running.append(missed)
+                max_running.append(len(running))
+            assert finish.wait(5)
+            with lock:
+                running.pop()
+        timer = RecordingTimer(target, clock=clock, overlap=Timer.OVERLAP_CONCURRENT, max_concurrency=2,
+                               missed_count_kwarg="missed", instrument=True)
+        timer.interrupt_event = WatchedEvent()
+        thread = start_thread(timer.start, timer.interrupt_event)
+        try:
+            advance(clock, 1, timer.interrupt_event, lambda: len(started) == 1)
+            advance(clock, 1, timer.interrupt_event, lambda: len(started) == 2)
+            # the ticks at 1003 and 1004 are skipped, as two runs are already in progress
+            advance(clock, 1, timer.interrupt_event)
+            advance(clock, 1, timer.interrupt_event)
+            finish.set()
+            wait_for(lambda: len(finished) == 2)
+            advance(clock, 1, timer.interrupt_event, lambda: len(finished) == 3)
+        finally:
+            finish.set()
+            timer.stop = True
+            thread.join()
+        assert max(max_running) == 2
+        assert started == [0, 0, 2]
+        stats = timer.stats.as_dict()
+        assert stats["runs"] == 3
+        assert stats["missed_ticks"] == 2
+
+    def test_scheduler_policies(self):
+        """tests that the scheduler follows the queue and concurrent policies"""
+        clock = FakeClock.FakeClock()
+        queued_times, concurrent_times, concurrent_finished = [], [], []
+        queued_finish, concurrent_finish = threading.Event(), threading.Event()
+        class QueuedTimer(Timer.Timer):
+            def setup_run(self, target_time):
+                queued_times.append(target_time)
+        class ConcurrentTimer(Timer.Timer):
+            def setup_run(self, target_time):
+                concurrent_times.append(target_time)
+            def _run_concurrently(self, target_time, missed_count):
+                Timer.Timer._run_concurrently(self, target_time, missed_count)
+                concurrent_finished.append(target_time)
+        scheduler, start = virtual_scheduler(clock)
+        scheduler.add(QueuedTimer(lambda: queued_finish.wait(5), clock=clock, overlap=Timer.OVERLAP_QUEUE))
+        scheduler.add(ConcurrentTimer(lambda: concurrent_finish.wait(5), clock=clock, overlap=Timer.OVERLAP_CONCURRENT, max_concurrency=2))
+        thread = start(running=1)
+        try:
+            wait_for(lambda: len(concurrent_times) == 1)
+            advance(clock, 1, scheduler.wakeup_event, lambda: len(concurrent_times) == 2 and scheduled(scheduler, 1)())
+            # the concurrent timer's tick at 1002 is skipped, as two runs are already in progress
+            advance(clock, 1, scheduler.wakeup_event, scheduled(scheduler, 1))
+            assert concurrent_times == [1000.0, 1001.0]
+            # the queued timer's first run has held on to it until 1002, so it runs the ticks at 1001 and 1002 straight after
+            queued_finish.set()
+            wait_for(lambda: len(queued_times) == 3 and scheduled(scheduler, 2)())
+            concurrent_finish.set()
+            wait_for(lambda: len(concurrent_finished) == 2)
+            advance(clock, 1, scheduler.wakeup_event, lambda: len(concurrent_finished) == 3 and scheduled(scheduler, 2)())
+        finally:
+            queued_finish.set()
+            concurrent_finish.set()
+            scheduler.stop = True
+            thread.join()
+        assert queued_times == [1000.0, 1001.0, 1002.0, 1003.0]
+        assert concurrent_times == [1000.0, 1001.0, 1003.0]
@@ -24,6 +24,7 @@ setup(
     extras_require = {
         'CleanXHTML':  ["cssutils", "lxml"],
         'Colours':  ["numpy"],
+        'Ranges':  ["numpy"],
         'time-related': ["pytz", 'virtualtime'],
         'tests': ['j5test'],
     }